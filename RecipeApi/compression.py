@@ -0,0 +1,152 @@
+"""
+Response compression.
+
+Like django.middleware.gzip.GZipMiddleware, but with a size threshold, a
+content-type allowlist, Accept-Encoding negotiation (br when the optional
+`brotli` package is installed, then gzip, then deflate) and a
+content-addressed cache of compressed bodies. Hot responses such as the home
+page or a popular recipe usually serialize to identical bytes, and cached
+bodies always do. Each distinct body is compressed once per encoding, and
+later hits only pay for a hash lookup.
+
+BREACH: the compressed length of a body shows whether text an attacker got
+reflected into it matches a secret elsewhere in that body. So responses that
+carry credentials, the API token from login and the event stream ticket, are
+never compressed (COMPRESSION_EXCLUDED_ROUTES, by URL name); no padding is
+added to anything else. Add a route there when it starts returning a secret.
+Django masks its CSRF token per response, so HTML forms are safe.
+"""
+import gzip
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+DEFAULT_TYPES = ('application/json', 'text/', 'application/javascript', 'application/xml',
+                 'application/rss+xml', 'application/atom+xml', 'image/svg+xml')
+DEFAULT_EXCLUDED_ROUTES = ('login', 'my-events-ticket')
+
+
+def compress(body, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(level, 11))
+    if encoding == 'gzip':
+        # mtime=0 keeps the output (and so the cache entry) deterministic
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    return zlib.compress(body, level)
+
+
+def supported_encodings():
+    return ('br', 'gzip', 'deflate') if brotli else ('gzip', 'deflate')
+
+
+def negotiate(accept_encoding, supported=None):
+    """Pick the best supported coding from an Accept-Encoding header, or None."""
+    supported = supported or supported_encodings()
+    weights = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().lower().partition(';')
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[coding] = quality
+    candidates = [(weights.get(coding, weights.get('*', 0.0)), -rank, coding)
+                  for rank, coding in enumerate(supported)]
+    quality, _, coding = max(candidates)
+    return coding if quality > 0 else None
+
+
+class CompressedBodyCache:
+    # LRU of (body digest, encoding) -> compressed bytes, bounded by total size
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compress(self, body, encoding, level):
+        key = (hashlib.blake2b(body, digest_size=16).digest(), encoding)
+        with self._lock:
+            compressed = self._entries.get(key)
+            if compressed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.inc('cache_requests_total', cache='compressed-body', result='hit')
+                return compressed
+            self.misses += 1
+        metrics.inc('cache_requests_total', cache='compressed-body', result='miss')
+        compressed = compress(body, encoding, level)
+        if len(compressed) <= self.max_bytes // 8:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = compressed
+                    self.size += len(compressed)
+                while self.size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= len(evicted)
+        return compressed
+
+
+class CompressionMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 512)
+        self.level = getattr(settings, 'COMPRESSION_LEVEL', 6)
+        self.content_types = tuple(getattr(settings, 'COMPRESSION_CONTENT_TYPES', DEFAULT_TYPES))
+        self.excluded_routes = frozenset(getattr(settings, 'COMPRESSION_EXCLUDED_ROUTES', DEFAULT_EXCLUDED_ROUTES))
+        self.cache = CompressedBodyCache(getattr(settings, 'COMPRESSION_CACHE_BYTES', 16 * 1024 * 1024))
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if not self.compressible(response) or self.carries_credentials(request):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+        body = response.content
+        compressed = self.cache.get_or_compress(body, encoding, self.level)
+        if len(compressed) >= len(body):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        # The representation changed, so a strong ETag must not be reused for it
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+    def carries_credentials(self, request):
+        match = getattr(request, 'resolver_match', None)
+        return match is not None and match.url_name in self.excluded_routes
+
+    def compressible(self, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return False
+        if response.status_code in (204, 206, 304) or len(response.content) < self.min_size:
+            return False
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        return content_type.startswith(self.content_types)
@@ -0,0 +1,137 @@
+"""
+Media serving for production.
+
+MEDIA_SERVE_BACKEND picks how the bytes go out:
+
+- "stream": Django streams the file itself, answering single Range requests
+  with 206 (fine behind a CDN or for small deployments).
+- "x-sendfile": Apache/lighttpd send the file named in X-Sendfile.
+- "x-accel-redirect": nginx serves MEDIA_ACCEL_REDIRECT_PREFIX + path from an
+  `internal` location.
+
+Content-hashed names (see RecipeApi/storage.py) are cached forever as
+immutable. Every response carries an ETag and conditional requests get 304.
+"""
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.core.exceptions import SuspiciousFileOperation
+from django.views.decorators.http import require_safe
+
+from .storage import content_hash
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+MUTABLE = 'public, max-age=3600'
+CHUNK_SIZE = 64 * 1024
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _etag(path, stat):
+    digest = content_hash(path)
+    return f'"{digest}"' if digest else f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+
+def parse_range(header, size):
+    """Return (start, end) inclusive for a single byte range, None to send everything, or raise ValueError."""
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None  # multiple or malformed ranges: ignore and send the whole file
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+@require_safe
+def serve_media(request, path):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("File not found.")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found.")
+
+    etag = _etag(path, stat)
+    cache_control = IMMUTABLE if content_hash(path) else MUTABLE
+    if _etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Cache-Control'] = cache_control
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    backend = getattr(settings, 'MEDIA_SERVE_BACKEND', 'stream')
+
+    if backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+    elif backend == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/') + path
+    else:
+        response = _stream(request, full_path, stat.st_size, etag, content_type)
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = formatdate(stat.st_mtime, usegmt=True)
+    response['Cache-Control'] = cache_control
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _stream(request, full_path, size, etag, content_type):
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = StreamingHttpResponse(_read_range(full_path, start, end), status=206,
+                                             content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+            return response
+    # Whole file: FileResponse lets the WSGI server use sendfile() via wsgi.file_wrapper
+    return FileResponse(open(full_path, 'rb'), content_type=content_type)
@@ -0,0 +1,306 @@
+"""
+Prometheus-style metrics.
+
+MetricsMiddleware records per-route request counters, latency and DB-time
+histograms. Other code can record its own metrics with `metrics.inc()` and
+`metrics.observe()`, for example cache hits. Each thread writes to its own
+shard, so recording never contends across threads; shards are only merged
+when /metrics is scraped.
+
+With several worker processes (gunicorn), set METRICS_MULTIPROC_DIR to a
+directory shared by the workers. Each process then writes its snapshot there
+every METRICS_FLUSH_SECONDS, and a scrape served by any worker sums them all.
+The file of a worker that has exited is deleted at the next scrape, so its
+counters drop out of the sums (Prometheus reads that as a counter reset).
+
+/metrics is open to staff users and to `Authorization: Bearer <METRICS_TOKEN>`.
+"""
+import atexit
+import hmac
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.views.decorators.http import require_safe
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFINITIONS = {
+    'http_requests_total': ('counter', "HTTP requests by route, method and status."),
+    'http_request_duration_seconds': ('histogram', "Time to produce a response, by route."),
+    'http_request_db_seconds': ('histogram', "Time spent in SQL per request, by route."),
+    'http_request_db_queries_total': ('counter', "SQL queries issued, by route."),
+    'http_requests_shed_total': ('counter', "Low-priority requests rejected with 503 under overload."),
+    'http_request_deadline_exceeded_total': ('counter', "Requests cancelled for running past their time budget."),
+    'cache_requests_total': ('counter', "Application cache lookups by cache and result (hit/miss)."),
+    'cache_hit_ratio': ('gauge', "Hits / lookups per cache since start."),
+    'db_connections_open': ('gauge', "Open database connections held by worker threads."),
+    'sse_connections_open': ('gauge', "Open server-sent event streams, by kind."),
+    'sse_events_sent_total': ('counter', "Events written to server-sent event streams, by kind."),
+    'sse_events_dropped_total': ('counter', "Events dropped for subscribers that fell behind."),
+    'sse_fanout_seconds': ('histogram', "Time from publishing an event to writing it to a stream."),
+}
+
+
+class _Shard:
+    __slots__ = ('lock', 'counters', 'histograms')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._open_connections = {}
+        self._gauges = {}
+        self._gauges_lock = threading.Lock()
+        self._last_flush = 0.0
+        self._flushed_pid = None
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, value=1, **labels):
+        shard = self._shard()
+        key = _key(name, labels)
+        with shard.lock:
+            shard.counters[key] = shard.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        shard = self._shard()
+        key = _key(name, labels)
+        with shard.lock:
+            histogram = shard.histograms.get(key)
+            if histogram is None:
+                histogram = shard.histograms[key] = [0] * (len(BUCKETS) + 2)  # buckets, +Inf, sum
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(BUCKETS)] += 1
+            histogram[-1] += value
+
+    def adjust(self, name, delta, **labels):
+        # Gauges that go up and down (open streams); shared across threads
+        key = _key(name, labels)
+        with self._gauges_lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    def note_connections(self, **kwargs):
+        # Tracked per thread, since connections are thread local
+        count = sum(1 for conn in connections.all(initialized_only=True) if conn.connection is not None)
+        ident = threading.get_ident()
+        with self._gauges_lock:
+            if count:
+                self._open_connections[ident] = count
+            else:
+                self._open_connections.pop(ident, None)
+
+    def snapshot(self):
+        counters, histograms = {}, {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            with shard.lock:
+                for key, value in shard.counters.items():
+                    counters[key] = counters.get(key, 0) + value
+                for key, values in shard.histograms.items():
+                    merged = histograms.setdefault(key, [0] * len(values))
+                    for i, value in enumerate(values):
+                        merged[i] += value
+        # Connections of threads that have exited are gone with them
+        live = {thread.ident for thread in threading.enumerate()}
+        with self._gauges_lock:
+            gauges = dict(self._gauges)
+            for ident in [ident for ident in self._open_connections if ident not in live]:
+                del self._open_connections[ident]
+            gauges[_key('db_connections_open', {})] = sum(self._open_connections.values())
+        return {'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    # Multiprocess mode
+
+    def _directory(self):
+        directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+        return Path(directory) if directory else None
+
+    def flush(self):
+        directory = self._directory()
+        if directory is None:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        data = {kind: [[name, list(labels), value] for (name, labels), value in values.items()]
+                for kind, values in self.snapshot().items()}
+        path = directory / f'metrics-{os.getpid()}.json'
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data))
+        os.replace(tmp, path)
+        self._last_flush = time.monotonic()
+        self._flushed_pid = os.getpid()
+
+    def maybe_flush(self):
+        # A new process (or a forked worker) flushes on its first request, so a
+        # file left under its pid by an earlier process is replaced straight away
+        if self._directory() is not None and (self._flushed_pid != os.getpid() or
+                time.monotonic() - self._last_flush > getattr(settings, 'METRICS_FLUSH_SECONDS', 5)):
+            self.flush()
+
+    def collect(self):
+        """Snapshot of this process, or the sum over all workers in multiprocess mode."""
+        directory = self._directory()
+        if directory is None:
+            return self.snapshot()
+        self.flush()
+        total = {'counters': {}, 'histograms': {}, 'gauges': {}}
+        for path in directory.glob('metrics-*.json'):
+            if not _alive(int(path.stem.split('-')[1])):
+                path.unlink(missing_ok=True)  # exited worker: a later process may reuse its pid
+                continue
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for kind, entries in data.items():
+                for name, labels, value in entries:
+                    key = (name, tuple(tuple(pair) for pair in labels))
+                    if isinstance(value, list):
+                        merged = total[kind].setdefault(key, [0] * len(value))
+                        for i, item in enumerate(value):
+                            merged[i] += item
+                    else:
+                        total[kind][key] = total[kind].get(key, 0) + value
+        return total
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+adjust = registry.adjust
+atexit.register(registry.flush)
+# Counted again once close_old_connections (also on request_finished, connected
+# earlier) has closed what CONN_MAX_AGE no longer allows
+request_finished.connect(registry.note_connections, dispatch_uid='metrics-connections')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def render(data):
+    # Derived gauge: hit ratio per cache from the lookup counters
+    lookups = {}
+    for (name, labels), value in data['counters'].items():
+        if name == 'cache_requests_total':
+            labels = dict(labels)
+            hits, total = lookups.get(labels.get('cache'), (0, 0))
+            lookups[labels.get('cache')] = (hits + (value if labels.get('result') == 'hit' else 0), total + value)
+    gauges = dict(data['gauges'])
+    for cache_name, (hits, total) in lookups.items():
+        gauges[('cache_hit_ratio', (('cache', cache_name),))] = hits / total if total else 0
+
+    by_name = {}
+    for kind in ('counters', 'gauges', 'histograms'):
+        source = gauges if kind == 'gauges' else data[kind]
+        for (name, labels), value in source.items():
+            by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, help_text = DEFINITIONS.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(by_name[name]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def _authorized(request):
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and header.startswith('Bearer ') and hmac.compare_digest(header[len('Bearer '):], token):
+        return True
+    from .profiling import _is_staff
+    return _is_staff(request)
+
+
+@require_safe
+def metrics_view(request):
+    if not _authorized(request):
+        return HttpResponse("Forbidden", status=403, content_type='text/plain')
+    return HttpResponse(render(registry.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        db = {'time': 0.0, 'queries': 0}
+
+        def time_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                db['time'] += time.perf_counter() - start
+                db['queries'] += 1
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(time_query):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        route = (match.url_name or match.view_name) if match else 'unmatched'
+        inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+        observe('http_request_duration_seconds', elapsed, route=route)
+        observe('http_request_db_seconds', db['time'], route=route)
+        if db['queries']:
+            inc('http_request_db_queries_total', db['queries'], route=route)
+        registry.note_connections()
+        registry.maybe_flush()
+        return response
@@ -0,0 +1,200 @@
+"""
+Request deadlines and load shedding.
+
+Every request gets a time budget (REQUEST_DEADLINES by URL name, else
+REQUEST_DEADLINE_DEFAULT seconds). SQL that would run past it is stopped:
+on SQLite through a progress handler that interrupts the running statement,
+on PostgreSQL through statement_timeout, and on any backend by refusing to
+start a query once the budget is gone. The client gets a 503 instead of
+a worker stuck behind a LIKE scan.
+
+Before the view runs, an admission check sheds low-priority reads
+(LOAD_SHEDDING['low_priority_routes'] and deep pagination) with a 503 and
+Retry-After while the service is overloaded. Overloaded means the request
+waited in the proxy's queue longer than max_queue_time (X-Request-Start, set
+by nginx/Heroku/Apache), or a moving average of latency over the threshold.
+Writes and cheap hot endpoints such as /api/home/ are always admitted.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connection
+from django.http import JsonResponse
+
+from . import metrics
+
+DEFAULT_SHEDDING = {
+    'max_queue_time': 0.5,  # seconds spent queued in front of the workers
+    'latency_threshold': 1.0,  # seconds, moving average over recent requests
+    'low_priority_routes': ('recipe-search', 'recipe-facets', 'recipe-filter', 'recipe-list'),
+    'deep_page': 20,  # ?page= beyond this is low priority on any route
+    'retry_after': 5,
+}
+SQLITE_PROGRESS_STEPS = 10000  # VM instructions between deadline checks
+EWMA_ALPHA = 0.2
+EWMA_STALE_AFTER = 10  # seconds without completed requests before the average is forgotten
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def queue_time(request):
+    """
+    Seconds the request waited before a worker picked it up, from the proxy's
+    X-Request-Start header ("t=1729340000.123", or a bare number in seconds,
+    milliseconds or microseconds); None without the header.
+    """
+    value = request.META.get('HTTP_X_REQUEST_START', '')
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return None
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(time.time() - started, 0.0)
+
+
+class AdmissionController:
+    # Per process; in-process concurrency says nothing under sync workers, so
+    # the queueing signal comes from the proxy (see queue_time)
+
+    def __init__(self, max_queue_time, latency_threshold):
+        self.max_queue_time = max_queue_time
+        self.latency_threshold = latency_threshold
+        self.latency = 0.0
+        self.updated = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed):
+        with self._lock:
+            self.latency += EWMA_ALPHA * (elapsed - self.latency)
+            self.updated = time.monotonic()
+
+    def overloaded(self, request):
+        waited = queue_time(request)
+        if waited is not None and waited > self.max_queue_time:
+            return True
+        fresh = time.monotonic() - self.updated < EWMA_STALE_AFTER
+        return fresh and self.latency > self.latency_threshold
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def _controller(max_queue_time, latency_threshold):
+    # One per process and configuration, shared by every OverloadMiddleware
+    # instance (the batch endpoint builds its own for sub-requests)
+    key = (max_queue_time, latency_threshold)
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AdmissionController(max_queue_time, latency_threshold)
+        return _controllers[key]
+
+
+def _route(request):
+    match = request.resolver_match
+    return match.url_name or match.view_name
+
+
+def _unavailable(detail, retry_after):
+    response = JsonResponse({'detail': detail}, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+class OverloadMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = {**DEFAULT_SHEDDING, **getattr(settings, 'LOAD_SHEDDING', {})}
+        self.low_priority = frozenset(options['low_priority_routes'])
+        self.deep_page = options['deep_page']
+        self.retry_after = options['retry_after']
+        self.deadlines = getattr(settings, 'REQUEST_DEADLINES', {})
+        self.default_deadline = getattr(settings, 'REQUEST_DEADLINE_DEFAULT', None)
+        self.controller = _controller(options['max_queue_time'], options['latency_threshold'])
+
+    def __call__(self, request):
+        request._deadline = None
+        state = {'installed': None}
+
+        def enforce(execute, sql, params, many, context):
+            deadline = request._deadline
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded()
+                if state['installed'] is None:
+                    state['installed'] = self.install(context, deadline, remaining)
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(enforce):
+                response = self.get_response(request)
+            if not getattr(request, '_shed', False):
+                self.controller.record(time.perf_counter() - start)
+        finally:
+            if state['installed']:
+                self.uninstall(state['installed'])
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        route = _route(request)
+        if self.is_low_priority(request, route) and self.controller.overloaded(request):
+            request._shed = True
+            metrics.inc('http_requests_shed_total', route=route)
+            return _unavailable("The service is busy; try again shortly.", self.retry_after)
+        budget = self.deadlines.get(route, self.default_deadline)
+        if budget:
+            request._deadline = time.monotonic() + budget
+        return None
+
+    def process_exception(self, request, exception):
+        deadline = getattr(request, '_deadline', None)
+        if isinstance(exception, DeadlineExceeded) or \
+                (isinstance(exception, OperationalError) and deadline is not None and time.monotonic() >= deadline):
+            metrics.inc('http_request_deadline_exceeded_total', route=_route(request))
+            return _unavailable("The request took too long and was cancelled.", self.retry_after)
+        return None
+
+    def is_low_priority(self, request, route):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            return False  # never drop a write
+        if route in self.low_priority:
+            return True
+        try:
+            return int(request.GET.get('page', 1)) > self.deep_page
+        except ValueError:
+            return False
+
+    def install(self, context, deadline, remaining):
+        db = context['connection']
+        raw = db.connection
+        if db.vendor == 'sqlite':
+            # A non-zero return interrupts the running statement ("interrupted" OperationalError)
+            raw.set_progress_handler(lambda: time.monotonic() > deadline, SQLITE_PROGRESS_STEPS)
+        elif db.vendor == 'postgresql':
+            with raw.cursor() as cursor:
+                cursor.execute('SET statement_timeout = %s', [max(int(remaining * 1000), 1)])
+        return db
+
+    def uninstall(self, db):
+        raw = db.connection
+        if raw is None:
+            return
+        if db.vendor == 'sqlite':
+            raw.set_progress_handler(None, 0)
+        elif db.vendor == 'postgresql':
+            try:
+                with db.cursor() as cursor:
+                    cursor.execute('RESET statement_timeout')
+            except DatabaseError:
+                pass  # aborted transaction; the setting dies with the connection or the rollback
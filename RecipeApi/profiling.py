@@ -0,0 +1,121 @@
+"""
+Opt-in request profiling.
+
+With PROFILING_ENABLED off the middleware removes itself at startup
+(MiddlewareNotUsed), so it costs nothing. When on, a request is profiled if a
+staff user sends an ``X-Profile`` header or ``?_profile=1``, or if it falls in
+the PROFILING_SAMPLE_RATE random sample. The view runs under cProfile with
+every SQL query timed. The pstats dump goes to a bounded ring of files in
+PROFILING_DIR. Responses to staff users also get a short summary in their
+headers (sampled requests from anyone else only leave the dump)::
+
+    Server-Timing: app;dur=412.3, sql;dur=97.1;desc="23 queries"
+    X-Profile-Id: 1729340000000000000-4242
+    X-Profile-Summary: {"top": [...], "slow_sql": [...]}
+
+Load a dump with ``python -m pstats <PROFILING_DIR>/<id>.prof``.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+TOP_FUNCTIONS = 10
+SLOW_QUERIES = 3
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    # The API authenticates with tokens inside DRF views, after middleware has run
+    try:
+        authenticated = TokenAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    return bool(authenticated and authenticated[0].is_staff)
+
+
+def summarize(stats, queries, limit=TOP_FUNCTIONS):
+    rows = []
+    for (filename, line, function), (_, calls, self_time, cumulative, _) in stats.stats.items():
+        rows.append((cumulative, self_time, calls, f"{os.path.basename(filename)}:{line}({function})"))
+    rows.sort(reverse=True)
+    slowest = sorted(queries, key=lambda query: query[1], reverse=True)[:SLOW_QUERIES]
+    return {
+        'top': [{'fn': name, 'calls': calls, 'cum_ms': round(cum * 1000, 2), 'self_ms': round(own * 1000, 2)}
+                for cum, own, calls, name in rows[:limit]],
+        'slow_sql': [{'ms': round(duration * 1000, 2), 'sql': ' '.join(sql.split())[:200]}
+                     for sql, duration in slowest],
+    }
+
+
+class ProfilingMiddleware:
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+        self.ring_size = getattr(settings, 'PROFILING_RING_SIZE', 50)
+        self.directory = Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        return self.profile(request)
+
+    def should_profile(self, request):
+        if 'HTTP_X_PROFILE' in request.META or '_profile' in request.GET:
+            return _is_staff(request)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profile(self, request):
+        queries = []
+
+        def time_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((sql, time.perf_counter() - start))
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        with connection.execute_wrapper(time_query):
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        stats = pstats.Stats(profiler)
+        profile_id = self.save(stats)
+        if not _is_staff(request):
+            return response  # function paths and SQL are not for the public
+        sql_time = sum(duration for _, duration in queries)
+        response['Server-Timing'] = (f'app;dur={elapsed * 1000:.1f}, '
+                                     f'sql;dur={sql_time * 1000:.1f};desc="{len(queries)} queries"')
+        response['X-Profile-Id'] = profile_id
+        response['X-Profile-Summary'] = json.dumps(summarize(stats, queries), separators=(',', ':'))
+        return response
+
+    def save(self, stats):
+        profile_id = f"{time.time_ns()}-{os.getpid()}"
+        stats.dump_stats(self.directory / f"{profile_id}.prof")
+        # Keep only the newest PROFILING_RING_SIZE dumps
+        dumps = sorted(self.directory.glob('*.prof'), key=lambda path: path.name)
+        for old in dumps[:-self.ring_size]:
+            old.unlink(missing_ok=True)
+        return profile_id
@@ -12,13 +12,16 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 import os
 from pathlib import Path
 import environ
-env = environ.Env()
-environ.Env.read_env()
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+env = environ.Env()
+# Read .env only when there is one; read_env() without a path inspects the call stack to find it
+if (BASE_DIR / '.env').exists():
+    environ.Env.read_env(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -51,7 +54,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'RecipeApi.metrics.MetricsMiddleware',
+    'RecipeApi.overload.OverloadMiddleware',
+    'blog.invalidation.InvalidationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'RecipeApi.compression.CompressionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,6 +67,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'RecipeApi.profiling.ProfilingMiddleware',
     # 'querycount.middleware.QueryCountMiddleware',
 ]
 
@@ -132,6 +140,16 @@ USE_TZ = True
 STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# "stream" (Django, with Range support), "x-sendfile" or "x-accel-redirect"
+MEDIA_SERVE_BACKEND = env('MEDIA_SERVE_BACKEND', default='stream')
+# nginx `internal` location aliased to MEDIA_ROOT, used by the x-accel-redirect backend
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Uploaded files get content-hashed names so they can be cached as immutable
+STORAGES = {
+    'default': {'BACKEND': 'RecipeApi.storage.ContentHashedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -211,3 +229,67 @@ TINYMCE_DEFAULT_CONFIG = {
 
 
 
+# Half-life of favourites/reviews in the trending score (blog/trending.py)
+TRENDING_HALF_LIFE_HOURS = 72
+# Largest batch accepted by /api/my-recipes/bulk/; a full batch of typical
+# recipes must stay below DATA_UPLOAD_MAX_MEMORY_SIZE (5 MB)
+BULK_MAX_ITEMS = 200
+# Most sub-requests accepted by /api/batch/
+BATCH_MAX_REQUESTS = 10
+# Largest batch of change log entries returned by /api/changes/
+SYNC_MAX_BATCH = 500
+# On-demand profiling (RecipeApi/profiling.py); removed from the stack when disabled
+PROFILING_ENABLED = env.bool('PROFILING_ENABLED', default=False)
+PROFILING_SAMPLE_RATE = env.float('PROFILING_SAMPLE_RATE', default=0.0)
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_RING_SIZE = 50
+# Response compression (RecipeApi/compression.py)
+COMPRESSION_MIN_SIZE = 512
+COMPRESSION_LEVEL = 6
+COMPRESSION_CACHE_BYTES = 16 * 1024 * 1024
+# URL names whose responses carry credentials; never compressed (BREACH)
+COMPRESSION_EXCLUDED_ROUTES = ('login', 'my-events-ticket')
+# Lifetime of cached /api/my-stats/ results; writes invalidate them sooner
+# through the invalidation bus
+AUTHOR_STATS_CACHE_SECONDS = 600
+# Metrics (RecipeApi/metrics.py). Set METRICS_MULTIPROC_DIR when running several
+# worker processes so /metrics reports the sum over all of them
+METRICS_TOKEN = env('METRICS_TOKEN', default=None)
+METRICS_MULTIPROC_DIR = env('METRICS_MULTIPROC_DIR', default=None)
+METRICS_FLUSH_SECONDS = 5
+# Time budgets in seconds by URL name (RecipeApi/overload.py); SQL past the
+# budget is cancelled and the request answered with 503
+REQUEST_DEADLINE_DEFAULT = 10
+REQUEST_DEADLINES = {
+    'home': 2,
+    'recipe-search': 3,
+    'recipe-facets': 3,
+}
+# Low-priority reads and deep pages are shed with 503 + Retry-After while
+# requests wait in the proxy queue (X-Request-Start) longer than
+# max_queue_time seconds or average latency exceeds the threshold
+LOAD_SHEDDING = {
+    'max_queue_time': env.float('LOAD_SHEDDING_MAX_QUEUE_TIME', default=0.5),
+    'latency_threshold': 1.0,
+    'low_priority_routes': ('recipe-search', 'recipe-facets', 'recipe-filter', 'recipe-list'),
+    'deep_page': 20,
+    'retry_after': 5,
+}
+# Sitemaps and feeds (blog/sitemaps.py): the front-end page for a recipe,
+# recipes per sitemap chunk, and how long rendered chunks/feeds are cached
+RECIPE_PUBLIC_URL = env('RECIPE_PUBLIC_URL',
+                        default='https://srr23.github.io/Recipe_Website_FrontEnd/recipe_details.html?slug={slug}')
+SITEMAP_CHUNK_SIZE = 10000
+SITEMAP_CACHE_SECONDS = 3600
+# Pub/sub behind the SSE streams (blog/events.py). The in-memory broker only
+# reaches clients connected to the same process; use
+# 'blog.events.RedisBroker' (needs the redis package) with several processes
+EVENTS_BROKER = env('EVENTS_BROKER', default='blog.events.InMemoryBroker')
+EVENTS_REDIS_URL = env('EVENTS_REDIS_URL', default='redis://localhost:6379/0')
+# Lifetime of the ?ticket= a browser opens /api/my-events/ with
+EVENTS_TICKET_SECONDS = 60
+# Cross-worker invalidation bus (blog/invalidation.py): how often a worker
+# reads the log, and how long entries are kept (manage.py prune_invalidations).
+# A worker idle for longer than that flushes its caches instead.
+INVALIDATION_POLL_SECONDS = 1
+INVALIDATION_RETENTION_SECONDS = 3600
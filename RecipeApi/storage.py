@@ -0,0 +1,50 @@
+import hashlib
+import os
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+
+HASH_LENGTH = 12
+# "recipe_images/curry.3f2a9c0b1d4e.jpg"
+HASHED_NAME = re.compile(r'\.([0-9a-f]{%d})\.[^./]+$' % HASH_LENGTH)
+
+
+def content_hash(name):
+    # The hash embedded in a stored name, or None for files saved before hashing
+    match = HASHED_NAME.search(name)
+    return match.group(1) if match else None
+
+
+class ContentHashedStorage(FileSystemStorage):
+    """
+    Media storage that puts a hash of the file content into every uploaded
+    file name. A stored name never changes meaning, so the media view can serve
+    it with `Cache-Control: immutable`. Uploading identical content twice
+    reuses the existing file.
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        root, ext = os.path.splitext(name)
+        suffix = f".{digest.hexdigest()[:HASH_LENGTH]}{ext.lower()}"
+        if max_length is not None and len(root) + len(suffix) > max_length:
+            # Shorten the file name here: truncation in get_available_name
+            # would cut into the hash, and different files could share a name
+            directory, stem = os.path.split(root)
+            room = max_length - len(suffix) - (len(directory) + 1 if directory else 0)
+            if room < 1:
+                raise SuspiciousFileOperation(f'Storage can not find an available filename for "{name}". '
+                                              'Please make sure that the corresponding file field '
+                                              'allows sufficient "max_length".')
+            root = os.path.join(directory, stem[:room])
+        hashed = root + suffix
+        if self.exists(hashed):
+            return hashed
+        return super().save(hashed, content, max_length=max_length)
@@ -15,15 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
-from django.conf.urls.static import static
+from .media import serve_media
+from .metrics import metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('account/', include('user_account.urls')),
     path('api/', include('blog.urls')),
+    path('metrics', metrics_view, name='metrics'),
+    # Served in production too; see RecipeApi/media.py for the X-Sendfile / X-Accel-Redirect backends
+    re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
 ]
-
-if settings.DEBUG:
-    
-    urlpatterns+=static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,17 +1,49 @@
 from django.contrib import admin
 from .models import *
+from .paginator import EstimatedCountPaginator
 # Register your models here.
 
 class RecipeAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ('title',)}
+    list_display = ('title', 'author', 'category', 'created_at')
+    list_select_related = ('author', 'category')
+    list_filter = ('category', 'created_at')
+    # Slugs are stored lowercase, so an exact match is enough (and uses the slug
+    # index); '^title' is served by the prefix index from migration 0013
+    search_fields = ('slug__exact', '^title')
+    autocomplete_fields = ('author', 'category')
+    ordering = ('-created_at',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     
 class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {"slug": ('title',)}
+    search_fields = ('^title',)
+
+
+class ReviewAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipe', 'user', 'rating', 'created_date')
+    list_select_related = ('recipe', 'user')
+    list_filter = ('rating', 'created_date')
+    autocomplete_fields = ('recipe', 'user')
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class FavouriteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipe', 'user', 'created_at')
+    list_select_related = ('recipe', 'user')
+    list_filter = ('created_at',)
+    autocomplete_fields = ('recipe', 'user')
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
 
 
 admin.site.register(Category, CategoryAdmin)
 admin.site.register(Recipe, RecipeAdmin)
-admin.site.register(Review)
-admin.site.register(Favourite)
\ No newline at end of file
+admin.site.register(Review, ReviewAdmin)
+admin.site.register(Favourite, FavouriteAdmin)
\ No newline at end of file
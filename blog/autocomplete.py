@@ -0,0 +1,273 @@
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+
+from django.db.models import Count
+
+from .invalidation import bus
+
+_NON_WORD = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+# Words shorter than this are not offered as standalone "popular terms"
+MIN_TERM_LENGTH = 3
+
+# Memoized lookups kept per worker; least recently used ones are dropped first
+MAX_MEMOIZED = 2048
+
+
+def normalize(text):
+    # Lowercase, strip accents and punctuation so "Crème brûlée!" matches "creme br"
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = _NON_WORD.sub(' ', text.lower())
+    return _SPACES.sub(' ', text).strip()
+
+
+def word_starts(normalized):
+    # "chicken tikka masala" -> ["chicken tikka masala", "tikka masala", "masala"]
+    words = normalized.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words)) if words[i]]
+
+
+class Suggestion:
+    __slots__ = ('kind', 'ref', 'text', 'slug', 'popularity')
+
+    def __init__(self, kind, ref, text, slug=None, popularity=0):
+        self.kind = kind
+        self.ref = ref
+        self.text = text
+        self.slug = slug
+        self.popularity = popularity
+
+    def as_dict(self):
+        return {'type': self.kind, 'text': self.text, 'slug': self.slug}
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index over recipe titles, category titles and the
+    words used in recipe titles.
+
+    Every suggestion is registered under one or more normalized keys, kept in
+    a sorted list; a prefix lookup is two bisects followed by a top-k pick
+    by popularity over the matching slice. Results for a prefix are memoized
+    (up to MAX_MEMOIZED, least recently used first out) until the next write.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []
+        self._entries = []
+        self._registered = {}   # (kind, ref) -> (Suggestion, [keys])
+        self._term_counts = Counter()
+        self._recipe_terms = {}  # recipe id -> set of terms in its title
+        self._results = OrderedDict()
+        self.loaded = False
+
+    # Loading
+
+    def ensure_loaded(self):
+        if self.loaded:
+            return
+        with self._lock:
+            if not self.loaded:
+                self.load()
+
+    def load(self):
+        from .models import Category, Recipe
+
+        pairs = []
+        registered = {}
+        term_counts = Counter()
+        recipe_terms = {}
+
+        recipes = Recipe.objects.values('id', 'title', 'slug') \
+                                .annotate(popularity=Count('favourited_by'))
+        for row in recipes.iterator():
+            suggestion = Suggestion('recipe', row['id'], row['title'], row['slug'], row['popularity'])
+            keys = word_starts(normalize(row['title']))
+            registered[('recipe', row['id'])] = (suggestion, keys)
+            pairs.extend((key, suggestion) for key in keys)
+            terms = self._terms_for(row['title'])
+            recipe_terms[row['id']] = terms
+            term_counts.update(terms)
+
+        categories = Category.objects.values('id', 'title', 'slug') \
+                                     .annotate(popularity=Count('category_recipe'))
+        for row in categories.iterator():
+            suggestion = Suggestion('category', row['id'], row['title'], row['slug'], row['popularity'])
+            keys = word_starts(normalize(row['title']))
+            registered[('category', row['id'])] = (suggestion, keys)
+            pairs.extend((key, suggestion) for key in keys)
+
+        for term, count in term_counts.items():
+            suggestion = Suggestion('term', term, term, popularity=count)
+            registered[('term', term)] = (suggestion, [term])
+            pairs.append((term, suggestion))
+
+        pairs.sort(key=lambda pair: pair[0])
+        with self._lock:
+            self._keys = [key for key, _ in pairs]
+            self._entries = [suggestion for _, suggestion in pairs]
+            self._registered = registered
+            self._term_counts = term_counts
+            self._recipe_terms = recipe_terms
+            self._results = OrderedDict()
+            self.loaded = True
+
+    def clear(self):
+        with self._lock:
+            self._keys, self._entries = [], []
+            self._registered, self._recipe_terms, self._results = {}, {}, OrderedDict()
+            self._term_counts = Counter()
+            self.loaded = False
+
+    # Lookup
+
+    def suggest(self, query, limit=8):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        self.ensure_loaded()
+
+        cache_key = (prefix, limit)
+        with self._lock:
+            results = self._results.get(cache_key)
+            if results is not None:
+                self._results.move_to_end(cache_key)
+                return results
+
+            start = bisect_left(self._keys, prefix)
+            end = bisect_left(self._keys, prefix + '\uffff', start)
+            # A suggestion can match through several of its keys; keep it once
+            matches = {}
+            for suggestion in self._entries[start:end]:
+                matches[(suggestion.kind, suggestion.ref)] = suggestion
+            best = heapq.nlargest(limit, matches.values(),
+                                  key=lambda s: (s.popularity, s.kind != 'term', -len(s.text)))
+            results = [suggestion.as_dict() for suggestion in best]
+            self._results[cache_key] = results
+            if len(self._results) > MAX_MEMOIZED:
+                self._results.popitem(last=False)
+        return results
+
+    # Incremental updates, called from signal handlers once the index is loaded
+
+    def update_recipe(self, recipe):
+        with self._lock:
+            previous = self._registered.get(('recipe', recipe.pk))
+            popularity = previous[0].popularity if previous else 0
+            self._unregister(('recipe', recipe.pk))
+            self._register(Suggestion('recipe', recipe.pk, recipe.title, recipe.slug, popularity))
+            self._set_recipe_terms(recipe.pk, self._terms_for(recipe.title))
+            self._results.clear()
+
+    def remove_recipe(self, recipe_id):
+        with self._lock:
+            self._unregister(('recipe', recipe_id))
+            self._set_recipe_terms(recipe_id, set())
+            self._results.clear()
+
+    def update_category(self, category):
+        with self._lock:
+            previous = self._registered.get(('category', category.pk))
+            popularity = previous[0].popularity if previous else 0
+            self._unregister(('category', category.pk))
+            self._register(Suggestion('category', category.pk, category.title, category.slug, popularity))
+            self._results.clear()
+
+    def remove_category(self, category_id):
+        with self._lock:
+            self._unregister(('category', category_id))
+            self._results.clear()
+
+    def adjust_popularity(self, kind, ref, delta):
+        with self._lock:
+            registered = self._registered.get((kind, ref))
+            if registered:
+                registered[0].popularity = max(registered[0].popularity + delta, 0)
+                self._results.clear()
+
+    # Changes made by other workers, applied from the invalidation bus
+
+    def refresh(self, key):
+        if not self.loaded:
+            return
+        kind, _, ref = (key or '').partition(':')
+        if kind not in ('recipe', 'category'):
+            self.clear()  # unknown scope ("everything"): reload lazily on the next lookup
+            return
+        from .models import Category, Recipe
+
+        if kind == 'recipe':
+            row = Recipe.objects.filter(pk=ref).values('id', 'title', 'slug') \
+                                .annotate(popularity=Count('favourited_by')).first()
+        else:
+            row = Category.objects.filter(pk=ref).values('id', 'title', 'slug') \
+                                  .annotate(popularity=Count('category_recipe')).first()
+        with self._lock:
+            self._unregister((kind, int(ref)))
+            if kind == 'recipe':
+                self._set_recipe_terms(int(ref), self._terms_for(row['title']) if row else set())
+            if row:
+                self._register(Suggestion(kind, row['id'], row['title'], row['slug'], row['popularity']))
+            self._results.clear()
+
+    # Internals
+
+    @staticmethod
+    def _terms_for(title):
+        return {word for word in normalize(title).split(' ') if len(word) >= MIN_TERM_LENGTH}
+
+    def _register(self, suggestion, keys=None):
+        if keys is None:
+            keys = word_starts(normalize(suggestion.text))
+        for key in keys:
+            position = bisect_left(self._keys, key)
+            self._keys.insert(position, key)
+            self._entries.insert(position, suggestion)
+        self._registered[(suggestion.kind, suggestion.ref)] = (suggestion, keys)
+
+    def _unregister(self, ref):
+        registered = self._registered.pop(ref, None)
+        if registered is None:
+            return
+        suggestion, keys = registered
+        for key in keys:
+            position = bisect_left(self._keys, key)
+            while position < len(self._keys) and self._keys[position] == key:
+                if self._entries[position] is suggestion:
+                    del self._keys[position]
+                    del self._entries[position]
+                    break
+                position += 1
+
+    def _set_recipe_terms(self, recipe_id, terms):
+        old_terms = self._recipe_terms.pop(recipe_id, set())
+        if terms:
+            self._recipe_terms[recipe_id] = terms
+        for term in old_terms - terms:
+            self._term_counts[term] -= 1
+            if self._term_counts[term] <= 0:
+                del self._term_counts[term]
+                self._unregister(('term', term))
+            else:
+                self._registered[('term', term)][0].popularity = self._term_counts[term]
+        for term in terms - old_terms:
+            self._term_counts[term] += 1
+            registered = self._registered.get(('term', term))
+            if registered:
+                registered[0].popularity = self._term_counts[term]
+            else:
+                self._register(Suggestion('term', term, term, popularity=1), [term])
+
+
+# Process-wide index, loaded on the first autocomplete request. Writes in this
+# process update it from signals; writes in other workers arrive over the bus.
+autocomplete_index = PrefixIndex()
+bus.subscribe('recipe:', autocomplete_index.refresh, local=False)
+bus.subscribe('category:', autocomplete_index.refresh, local=False)
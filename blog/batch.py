@@ -0,0 +1,92 @@
+import json
+from urllib.parse import urlsplit
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.handlers.exception import response_for_exception
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+from RecipeApi.metrics import MetricsMiddleware
+from RecipeApi.overload import OverloadMiddleware
+
+# Runs several GET requests in-process for /api/batch/. Each sub-request goes
+# through the URL resolver to its view, skipping the rest of the middleware
+# stack but not per-route metrics and OverloadMiddleware: a batched search is
+# counted, shed and given its deadline like a direct one. It reuses the outer
+# request's authenticated user (no second token lookup) and the same thread,
+# and so the same DB connection. Async views (the event streams) are refused:
+# there is no event loop here to run them on.
+
+ALLOWED_PREFIX = '/api/'
+
+
+def max_requests():
+    return getattr(settings, 'BATCH_MAX_REQUESTS', 10)
+
+
+def _sub_request(request, path, query):
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = path
+    sub.META = {**request.META, 'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                'CONTENT_LENGTH': '0'}
+    sub.META.pop('CONTENT_TYPE', None)
+    sub.GET = QueryDict(query)
+    sub.COOKIES = request.COOKIES
+    sub.user = request.user
+    if request.user.is_authenticated:
+        # DRF views take this user instead of running the authentication classes again
+        sub._force_auth_user = request.user
+        sub._force_auth_token = request.auth
+    return sub
+
+
+def _run_view(sub):
+    # The innermost layer, standing in for Django's handler: view middleware
+    # hooks of OverloadMiddleware, then the view
+    match = sub.resolver_match
+    response = _overload.process_view(sub, match.func, match.args, match.kwargs)
+    if response is not None:
+        return response
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response = response.render()
+    except Exception as exc:
+        response = _overload.process_exception(sub, exc) or response_for_exception(sub, exc)
+    return response
+
+
+_overload = OverloadMiddleware(_run_view)
+_handler = MetricsMiddleware(_overload)
+
+
+def _body(response):
+    content = response.content.decode(response.charset or 'utf-8', errors='replace')
+    if response.get('Content-Type', '').startswith('application/json') and content:
+        return json.loads(content)
+    return content
+
+
+def dispatch(request, url):
+    """Run one GET sub-request; returns {'path', 'status', 'body'}."""
+    parts = urlsplit(url)
+    path = parts.path
+    if not path.startswith(ALLOWED_PREFIX) or parts.netloc:
+        return {'path': url, 'status': 400, 'body': {'detail': f"Only {ALLOWED_PREFIX} paths can be batched."}}
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return {'path': url, 'status': 404, 'body': {'detail': "Not found."}}
+    if match.url_name == 'batch':
+        return {'path': url, 'status': 400, 'body': {'detail': "Batches cannot be nested."}}
+    if iscoroutinefunction(match.func):
+        return {'path': url, 'status': 400, 'body': {'detail': "Async views cannot be batched."}}
+
+    sub = _sub_request(request, path, parts.query)
+    sub.resolver_match = match
+    response = _handler(sub)
+    if response.streaming:
+        return {'path': url, 'status': 400, 'body': {'detail': "Streaming responses cannot be batched."}}
+    return {'path': url, 'status': response.status_code, 'body': _body(response)}
@@ -0,0 +1,180 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers, status
+
+from .models import Category, Recipe
+from .signals import recipes_written
+from .serializers import BulkRecipeSerializer
+from .slug import generate_unique_slugs
+
+# Bulk writes bypass Recipe.save(), so slugs are generated for the whole batch
+# in one query, and the side effects of the Recipe post_save receivers
+# (change log, counters, search indexes, invalidations) run once per batch
+# through signals.recipes_written.
+# Images cannot be sent in a JSON array; upload them per recipe afterwards.
+
+
+def max_items():
+    return getattr(settings, 'BULK_MAX_ITEMS', 200)
+
+
+def check_batch(items):
+    if not isinstance(items, list):
+        raise serializers.ValidationError({'detail': "Expected a list of items."})
+    if not items:
+        raise serializers.ValidationError({'detail': "The list is empty."})
+    if len(items) > max_items():
+        raise serializers.ValidationError({'detail': f"At most {max_items()} items per request."})
+
+
+def _categories_for(items):
+    ids = set()
+    for item in items:
+        if isinstance(item, dict):
+            try:
+                ids.add(int(item.get('category')))
+            except (TypeError, ValueError):
+                pass
+    return Category.objects.in_bulk(ids) if ids else {}
+
+
+def batch_status(results):
+    ok = sum(1 for result in results if result['status'] < 400)
+    if ok == len(results):
+        return results[0]['status']
+    return status.HTTP_207_MULTI_STATUS if ok else status.HTTP_400_BAD_REQUEST
+
+
+def bulk_create_recipes(author, items):
+    check_batch(items)
+    context = {'categories': _categories_for(items)}
+    results = [None] * len(items)
+    recipes = []
+
+    for index, item in enumerate(items):
+        serializer = BulkRecipeSerializer(data=item, context=context)
+        if serializer.is_valid():
+            recipes.append((index, Recipe(author=author, **serializer.validated_data)))
+        else:
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+
+    slugs = generate_unique_slugs(Recipe, [recipe.title for _, recipe in recipes])
+    for (_, recipe), slug in zip(recipes, slugs):
+        recipe.slug = slug
+        recipe.render_content()
+
+    with transaction.atomic():
+        Recipe.objects.bulk_create([recipe for _, recipe in recipes])
+        recipes_written([recipe for _, recipe in recipes], created=True)
+
+    for index, recipe in recipes:
+        results[index] = {'index': index, 'status': status.HTTP_201_CREATED, 'id': recipe.pk, 'slug': recipe.slug}
+    return results
+
+
+def _lookup(item):
+    if not isinstance(item, dict):
+        return None
+    if item.get('id') is not None:
+        return ('id', str(item['id']))
+    if item.get('slug'):
+        return ('slug', item['slug'])
+    return None
+
+
+def bulk_update_recipes(author, items):
+    check_batch(items)
+    lookups = [_lookup(item) for item in items]
+    ids = [value for kind, value in filter(None, lookups) if kind == 'id']
+    slugs = [value for kind, value in filter(None, lookups) if kind == 'slug']
+    owned = Recipe.objects.filter(author=author).select_related('category').filter(Q(id__in=[i for i in ids if i.isdigit()]) | Q(slug__in=slugs))
+    by_id, by_slug = {}, {}
+    for recipe in owned:
+        by_id[str(recipe.pk)] = recipe
+        by_slug[recipe.slug] = recipe
+
+    context = {'categories': _categories_for(items)}
+    results = [None] * len(items)
+    changed = {}
+    targeted = {}  # recipe id -> index of the item that claimed it
+    retitled = []
+    fields = {'updated_at'}
+
+    for index, (item, lookup) in enumerate(zip(items, lookups)):
+        if lookup is None:
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST,
+                              'errors': {'detail': "Each item needs an 'id' or 'slug'."}}
+            continue
+        recipe = (by_id if lookup[0] == 'id' else by_slug).get(lookup[1])
+        if recipe is None:
+            results[index] = {'index': index, 'status': status.HTTP_404_NOT_FOUND,
+                              'errors': {'detail': "Recipe not found."}}
+            continue
+        if recipe.pk in targeted:
+            # Same id twice, or an id and that recipe's slug: the later item would overwrite the earlier one
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST,
+                              'errors': {'detail': f"Item {targeted[recipe.pk]} already targets this recipe."}}
+            continue
+        targeted[recipe.pk] = index
+        data = {key: value for key, value in item.items() if key not in ('id', 'slug')}
+        serializer = BulkRecipeSerializer(recipe, data=data, partial=True, context=context)
+        if not serializer.is_valid():
+            results[index] = {'index': index, 'status': status.HTTP_400_BAD_REQUEST, 'errors': serializer.errors}
+            continue
+        for field, value in serializer.validated_data.items():
+            setattr(recipe, field, value)
+            fields.add(field)
+        if 'title' in serializer.validated_data:
+            retitled.append(recipe)
+        if {'ingredients', 'instructions'} & set(serializer.validated_data):
+            recipe.render_content()
+            fields.update(Recipe.CONTENT_FIELDS)
+        changed[recipe.pk] = (index, recipe)
+
+    if retitled:
+        fields.add('slug')
+        new_slugs = generate_unique_slugs(Recipe, [recipe.title for recipe in retitled],
+                                          exclude_pks=[recipe.pk for recipe in retitled])
+        for recipe, slug in zip(retitled, new_slugs):
+            recipe.slug = slug
+
+    now = timezone.now()
+    recipes = [recipe for _, recipe in changed.values()]
+    for recipe in recipes:
+        recipe.updated_at = now  # auto_now is not applied by bulk_update
+
+    with transaction.atomic():
+        Recipe.objects.bulk_update(recipes, sorted(fields), batch_size=500)
+        recipes_written(recipes, created=False, update_fields=frozenset(fields))
+
+    for index, recipe in changed.values():
+        results[index] = {'index': index, 'status': status.HTTP_200_OK, 'id': recipe.pk, 'slug': recipe.slug}
+    return results
+
+
+def bulk_delete_recipes(author, data):
+    if not isinstance(data, dict):
+        raise serializers.ValidationError({'detail': "Expected an object with 'ids' and/or 'slugs'."})
+    ids = data.get('ids') or []
+    slugs = data.get('slugs') or []
+    if not isinstance(ids, list) or not isinstance(slugs, list):
+        raise serializers.ValidationError({'detail': "'ids' and 'slugs' must be lists."})
+    check_batch(ids + slugs)
+    try:
+        ids = [int(pk) for pk in ids]
+    except (TypeError, ValueError):
+        raise serializers.ValidationError({'ids': "Recipe ids must be integers."})
+
+    with transaction.atomic():
+        matched = Recipe.objects.filter(author=author).filter(Q(id__in=ids) | Q(slug__in=slugs))
+        found = list(matched.values_list('id', 'slug'))
+        matched.delete()
+
+    found_ids = {pk for pk, _ in found}
+    found_slugs = {slug for _, slug in found}
+    return {
+        'deleted': [pk for pk, _ in found],
+        'missing': [pk for pk in ids if pk not in found_ids] + [slug for slug in slugs if slug not in found_slugs],
+    }
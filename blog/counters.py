@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import Avg, Count, F, FloatField, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Category, Recipe, Review
+from .sync import record_updates
+
+# Per-category recipe_count / latest_recipe and per-recipe rating_avg /
+# rating_count, kept up to date with single-row UPDATEs from the signal
+# receivers (see blog/signals.py). Categories are synced with their counters,
+# so each category written here also gets a change log entry; recipe ratings
+# are not part of /api/changes/.
+
+
+def _latest(category_ref):
+    return Recipe.objects.filter(category=category_ref).order_by('-created_at', '-pk')
+
+
+def recipe_added(category_id, recipe):
+    Category.objects.filter(pk=category_id).update(recipe_count=F('recipe_count') + 1)
+    Category.objects.filter(pk=category_id) \
+                    .filter(Q(latest_recipe_at__isnull=True) | Q(latest_recipe_at__lte=recipe.created_at)) \
+                    .update(latest_recipe=recipe.pk, latest_recipe_at=recipe.created_at)
+    record_updates(Category, [category_id])
+
+
+def recipe_removed(category_id, recipe_id):
+    Category.objects.filter(pk=category_id).update(recipe_count=Greatest(F('recipe_count') - 1, 0))
+    # On delete, SET_NULL has already cleared latest_recipe before post_delete runs
+    latest = _latest(OuterRef('pk')).exclude(pk=recipe_id)
+    Category.objects.filter(pk=category_id) \
+                    .filter(Q(latest_recipe=recipe_id) | Q(latest_recipe__isnull=True)) \
+                    .update(latest_recipe=Subquery(latest.values('pk')[:1]),
+                            latest_recipe_at=Subquery(latest.values('created_at')[:1]))
+    record_updates(Category, [category_id])
+
+
+def recount(category_ids):
+    # Bulk writes: recompute the touched categories in one UPDATE instead of a delta per recipe
+    latest = _latest(OuterRef('pk'))
+    count = Recipe.objects.filter(category=OuterRef('pk')).order_by().values('category') \
+                          .annotate(value=Count('pk')).values('value')
+    Category.objects.filter(pk__in=category_ids).update(
+        recipe_count=Coalesce(Subquery(count, output_field=IntegerField()), 0),
+        latest_recipe=Subquery(latest.values('pk')[:1]),
+        latest_recipe_at=Subquery(latest.values('created_at')[:1]),
+    )
+    record_updates(Category, category_ids)
+
+
+def rating_changed(recipe_id):
+    # Recomputed rather than adjusted: an edited review changes the average without changing the count
+    reviews = Review.objects.filter(recipe=OuterRef('pk'), rating__isnull=False).order_by().values('recipe')
+    Recipe.objects.filter(pk=recipe_id).update(
+        rating_avg=Subquery(reviews.annotate(value=Avg('rating')).values('value'), output_field=FloatField()),
+        rating_count=Coalesce(Subquery(reviews.annotate(value=Count('pk')).values('value'),
+                                       output_field=IntegerField()), 0),
+    )
+
+
+def reconcile(batch_size=500):
+    """Recompute every category's counters from the recipes table; returns how many were wrong."""
+    latest = _latest(OuterRef('pk'))
+    categories = Category.objects.annotate(
+        actual_count=Count('category_recipe'),
+        actual_latest=Subquery(latest.values('pk')[:1]),
+        actual_latest_at=Subquery(latest.values('created_at')[:1]),
+    ).order_by('pk')
+
+    drifted = []
+    for category in categories.iterator(chunk_size=batch_size):
+        if (category.recipe_count, category.latest_recipe_id, category.latest_recipe_at) != \
+                (category.actual_count, category.actual_latest, category.actual_latest_at):
+            category.recipe_count = category.actual_count
+            category.latest_recipe_id = category.actual_latest
+            category.latest_recipe_at = category.actual_latest_at
+            drifted.append(category)
+    with transaction.atomic():
+        Category.objects.bulk_update(drifted, ['recipe_count', 'latest_recipe', 'latest_recipe_at'],
+                                     batch_size=batch_size)
+        record_updates(Category, [category.pk for category in drifted])
+    return len(drifted)
@@ -0,0 +1,181 @@
+"""
+Live updates over server-sent events.
+
+Signal receivers publish small deltas once the writing transaction commits:
+
+- to ``recipe:<id>``: review.created, review.deleted and favourites (the new count)
+- to ``user:<id>``: favourite.added and favourite.removed
+
+The SSE views in blog/views.py stream a channel to the browser (EventSource),
+so clients no longer poll and re-serialize /api/recipe-detail/<slug>/. They
+need an ASGI server (uvicorn, daphne), since each open stream is an idle
+coroutine rather than a blocked worker thread.
+
+EVENTS_BROKER picks the pub/sub backend. InMemoryBroker (the default) fans out
+within one process. RedisBroker publishes through Redis (EVENTS_REDIS_URL),
+and each process relays the events to its own local subscribers, so it
+works across several processes and nodes.
+
+EventSource cannot send an Authorization header, so a browser opening
+/api/my-events/ first POSTs to /api/my-events/ticket/ (token auth) and
+passes the returned ticket as ?ticket=. A ticket is signed, names only the
+user, is good only for opening a stream, and expires after
+EVENTS_TICKET_SECONDS. The long-lived API token never appears in a URL.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core import signing
+from django.utils.module_loading import import_string
+
+from RecipeApi import metrics
+
+QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+TICKET_SALT = 'blog.events.stream-ticket'
+
+
+def recipe_channel(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class InMemoryBroker:
+
+    def __init__(self, **options):
+        self._subscribers = defaultdict(set)  # channel -> {(loop, queue)}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Register a queue for `channel`; call from the event loop that will read it."""
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[channel].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, set())
+            subscribers.difference_update({entry for entry in subscribers if entry[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel, event):
+        self.deliver(channel, {**event, 'published_at': time.time()})
+
+    def deliver(self, channel, event):
+        # Safe from any thread: signal receivers run in sync worker threads
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                pass  # loop closed; the stream's finally clause unsubscribes it
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        metrics.inc('sse_events_dropped_total')
+
+
+class RedisBroker(InMemoryBroker):
+    prefix = 'recipe-events:'
+
+    def __init__(self, url=None, **options):
+        super().__init__()
+        self.url = url or getattr(settings, 'EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+        self._client = None
+        self._listeners = {}  # event loop -> relay task
+
+    def publish(self, channel, event):
+        import redis  # optional dependency, only needed with this backend
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        message = json.dumps({**event, 'published_at': time.time()})
+        self._client.publish(self.prefix + channel, message)
+
+    def subscribe(self, channel):
+        loop = asyncio.get_running_loop()
+        if loop not in self._listeners or self._listeners[loop].done():
+            self._listeners[loop] = loop.create_task(self._relay())
+        return super().subscribe(channel)
+
+    async def _relay(self):
+        # One Redis subscription per process and loop, fanned out to local queues
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        async with client.pubsub() as pubsub:
+            await pubsub.psubscribe(self.prefix + '*')
+            async for message in pubsub.listen():
+                if message['type'] != 'pmessage':
+                    continue
+                channel = message['channel'].decode()[len(self.prefix):]
+                self.deliver(channel, json.loads(message['data']))
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(getattr(settings, 'EVENTS_BROKER', 'blog.events.InMemoryBroker'))()
+    return _broker
+
+
+def publish(channel, event):
+    get_broker().publish(channel, event)
+
+
+def ticket_lifetime():
+    return getattr(settings, 'EVENTS_TICKET_SECONDS', 60)
+
+
+def issue_ticket(user):
+    return signing.TimestampSigner(salt=TICKET_SALT).sign(str(user.pk))
+
+
+def ticket_user_id(ticket):
+    """User id named by a valid, unexpired stream ticket, else None."""
+    try:
+        return int(signing.TimestampSigner(salt=TICKET_SALT).unsign(ticket, max_age=ticket_lifetime()))
+    except (signing.BadSignature, ValueError):
+        return None
+
+
+def format_event(event):
+    data = {key: value for key, value in event.items() if key != 'published_at'}
+    return f"event: {event['type']}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def stream(channel, kind):
+    """Async iterator of SSE frames for one channel, with keep-alive comments."""
+    broker = get_broker()
+    queue = broker.subscribe(channel)
+    metrics.adjust('sse_connections_open', 1, kind=kind)
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            metrics.observe('sse_fanout_seconds', max(time.time() - event['published_at'], 0))
+            metrics.inc('sse_events_sent_total', kind=kind)
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(channel, queue)
+        metrics.adjust('sse_connections_open', -1, kind=kind)
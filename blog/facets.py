@@ -0,0 +1,121 @@
+from django.db.models import Count, Q
+from rest_framework.exceptions import ValidationError
+
+# Faceted filtering for /api/recipes/facets/.
+#
+# Each facet is counted with every filter applied except its own, so a client
+# can show "Dessert (12)" next to an already ticked "Breakfast" checkbox. That
+# is one grouped query per dimension (or one conditional aggregate for the
+# bucketed ones), whatever the number of facet values.
+
+# (label, min minutes inclusive, max minutes exclusive)
+TIME_BUCKETS = (
+    ('under-15', None, 15),
+    ('15-30', 15, 30),
+    ('30-60', 30, 60),
+    ('60-120', 60, 120),
+    ('over-120', 120, None),
+)
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+
+def _int_list(params, name):
+    values = []
+    for raw in params.getlist(name):
+        for part in raw.split(','):
+            if part.strip():
+                values.append(_int(part, name))
+    return values
+
+
+def _int(raw, name):
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise ValidationError({name: "Must be an integer."})
+
+
+def _number(params, name, cast=int):
+    raw = params.get(name)
+    if raw in (None, ''):
+        return None
+    try:
+        return cast(raw)
+    except ValueError:
+        raise ValidationError({name: "Must be a number."})
+
+
+def parse_filters(params):
+    """Map query parameters to one Q per facet dimension."""
+    filters = {}
+    categories = _int_list(params, 'category')
+    if categories:
+        filters['category'] = Q(category__in=categories)
+    authors = _int_list(params, 'author')
+    if authors:
+        filters['author'] = Q(author__in=authors)
+
+    time = Q()
+    min_time, max_time = _number(params, 'min_time'), _number(params, 'max_time')
+    if min_time is not None:
+        time &= Q(total_time__gte=min_time)
+    if max_time is not None:
+        time &= Q(total_time__lte=max_time)
+    if time:
+        filters['total_time'] = time
+
+    servings = _int_list(params, 'servings')
+    if servings:
+        filters['servings'] = Q(servings__in=servings)
+
+    min_rating = _number(params, 'min_rating', float)
+    if min_rating is not None:
+        filters['rating'] = Q(rating_avg__gte=min_rating)
+    return filters
+
+
+def _excluding(queryset, filters, dimension):
+    for name, condition in filters.items():
+        if name != dimension:
+            queryset = queryset.filter(condition)
+    return queryset.order_by()
+
+
+def _bucket_condition(low, high):
+    condition = Q()
+    if low is not None:
+        condition &= Q(total_time__gte=low)
+    if high is not None:
+        condition &= Q(total_time__lt=high)
+    return condition
+
+
+def facet_counts(queryset, filters):
+    category = _excluding(queryset, filters, 'category') \
+        .values('category', 'category__title').annotate(count=Count('pk')).order_by('-count', 'category')
+    author = _excluding(queryset, filters, 'author') \
+        .values('author', 'author__username').annotate(count=Count('pk')).order_by('-count', 'author')
+    servings = _excluding(queryset, filters, 'servings') \
+        .values('servings').annotate(count=Count('pk')).order_by('servings')
+    times = _excluding(queryset, filters, 'total_time').aggregate(**{
+        label: Count('pk', filter=_bucket_condition(low, high)) for label, low, high in TIME_BUCKETS
+    })
+    ratings = _excluding(queryset, filters, 'rating').aggregate(**{
+        str(threshold): Count('pk', filter=Q(rating_avg__gte=threshold)) for threshold in RATING_THRESHOLDS
+    })
+    return {
+        'category': [{'id': row['category'], 'title': row['category__title'], 'count': row['count']}
+                     for row in category],
+        'author': [{'id': row['author'], 'username': row['author__username'], 'count': row['count']}
+                   for row in author],
+        'servings': [{'value': row['servings'], 'count': row['count']} for row in servings],
+        'total_time': [{'bucket': label, 'min': low, 'max': high, 'count': times[label]}
+                       for label, low, high in TIME_BUCKETS],
+        'min_rating': [{'value': threshold, 'count': ratings[str(threshold)]} for threshold in RATING_THRESHOLDS],
+    }
+
+
+def apply_filters(queryset, filters):
+    for condition in filters.values():
+        queryset = queryset.filter(condition)
+    return queryset
@@ -0,0 +1,167 @@
+"""
+Cross-worker invalidation bus for in-process caches.
+
+A write publishes keys such as ``recipe:12`` or ``author:3`` (see
+blog/signals.py). They are appended to the Invalidation table once the
+transaction commits, and subscribers in the writing process are called
+straight away. Every other worker tails the table, one indexed range
+query on the sequence number at most every INVALIDATION_POLL_SECONDS, and
+calls its own subscribers. This happens from InvalidationMiddleware at the
+start of a request, before any cache is read, so a worker that sat idle
+catches up on its next request.
+
+    bus.subscribe('author:', lambda key: ...)   # key is None for "everything"
+
+LocalCache is a small process-local cache whose entries are bus keys, so
+it drops entries when any worker writes. A worker that has not polled for
+longer than the log is kept (INVALIDATION_RETENTION_SECONDS) may have
+missed events, so it flushes every subscriber instead.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+
+POLL_BATCH = 1000
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class InvalidationBus:
+
+    def __init__(self):
+        self._subscribers = []  # (prefix, callback, local)
+        self._last_seq = None
+        self._last_poll = 0.0
+        self._poll_lock = threading.Lock()
+        self._pid = None
+        self._origin = None
+
+    @property
+    def origin(self):
+        # Regenerated after fork, so preloaded gunicorn workers don't share one
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._origin = f'{socket.gethostname()[:40]}:{self._pid}:{uuid.uuid4().hex[:8]}'
+        return self._origin
+
+    def subscribe(self, prefix, callback, local=True):
+        """Call `callback(key)` for keys starting with `prefix`; local=False skips this process's own writes."""
+        self._subscribers.append((prefix, callback, local))
+
+    def publish(self, *keys):
+        keys = [key for key in dict.fromkeys(keys) if key]
+        if keys:
+            transaction.on_commit(lambda: self._append(keys))
+
+    def _append(self, keys):
+        from .models import Invalidation
+
+        Invalidation.objects.bulk_create([Invalidation(key=key, origin=self.origin) for key in keys])
+        for key in keys:
+            self._dispatch(key, remote=False)
+
+    def _dispatch(self, key, remote):
+        for prefix, callback, local in self._subscribers:
+            if (remote or local) and (key is None or key.startswith(prefix)):
+                callback(key)
+
+    def poll(self):
+        """Apply events written by other processes since the last poll; returns how many."""
+        from .models import Invalidation
+
+        if not self._poll_lock.acquire(blocking=False):
+            return 0  # another thread of this worker is already polling
+        try:
+            now = time.monotonic()
+            if self._last_seq is None:
+                # Caches of a fresh worker are empty: start from the end of the log
+                self._last_seq = Invalidation.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
+            elif now - self._last_poll > _setting('INVALIDATION_RETENTION_SECONDS', 3600):
+                self._dispatch(None, remote=True)
+            self._last_poll = now
+
+            applied = 0
+            while True:
+                rows = list(Invalidation.objects.filter(seq__gt=self._last_seq).order_by('seq')
+                            .values_list('seq', 'key', 'origin')[:POLL_BATCH])
+                for seq, key, origin in rows:
+                    if origin != self.origin:
+                        self._dispatch(key, remote=True)
+                        applied += 1
+                    self._last_seq = seq
+                if len(rows) < POLL_BATCH:
+                    return applied
+        finally:
+            self._poll_lock.release()
+
+    def maybe_poll(self):
+        if time.monotonic() - self._last_poll >= _setting('INVALIDATION_POLL_SECONDS', 1):
+            self.poll()
+
+
+bus = InvalidationBus()
+
+
+class LocalCache:
+    """Process-local LRU keyed by bus keys, emptied by invalidations from any worker."""
+
+    def __init__(self, prefix, timeout=300, max_entries=10000):
+        self.prefix = prefix
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every invalidation
+        bus.subscribe(prefix, self.invalidate)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout=None, generation=None):
+        """Store `value`; with `generation`, only if nothing was invalidated since it was read."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False  # built from data that has changed since
+            self._entries[key] = (time.monotonic() + (timeout or self.timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class InvalidationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        bus.maybe_poll()
+        return self.get_response(request)
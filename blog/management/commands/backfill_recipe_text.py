@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from blog.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ("Recompute sanitized HTML, plain text and reading time for recipes in batches "
+            "(migration 0015 already fills in rows that were never rendered).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--only-missing', action='store_true',
+                            help="Skip recipes that already have rendered content.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        queryset = Recipe.objects.only('id', 'ingredients', 'instructions').order_by('id')
+        if options['only_missing']:
+            queryset = queryset.filter(word_count=0)
+
+        last_id, total = 0, 0
+        while True:
+            # Keyset pagination keeps every batch an index range scan
+            batch = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            for recipe in batch:
+                recipe.render_content()
+            Recipe.objects.bulk_update(batch, Recipe.CONTENT_FIELDS)
+            last_id = batch[-1].id
+            total += len(batch)
+            self.stdout.write(f"Rendered {total} recipes...")
+        self.stdout.write(self.style.SUCCESS(f"Rendered {total} recipes."))
@@ -0,0 +1,86 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from RecipeApi.compression import CompressedBodyCache, compress, supported_encodings
+
+DEFAULT_PATHS = ['/api/home/', '/api/recipes/?page_size=100', '/api/categories/', '/api/changes/']
+
+
+WORDS = ('chicken onion garlic ginger tomato cumin turmeric butter cream rice lentil coriander chilli '
+         'stir simmer fry roast chop slice whisk fold season rest serve gently until golden').split()
+
+
+def synthetic_body(recipes, seed=0):
+    # Recipe list shaped like AddRecipeSerializer output, with TinyMCE-style markup
+    rng = random.Random(seed)
+
+    def sentence(words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+    items = []
+    for n in range(recipes):
+        title = sentence(3)[:-1]
+        items.append({
+            'id': n, 'title': title, 'slug': f"{title.lower().replace(' ', '-')}-{n}",
+            'category': rng.randint(1, 12), 'image': f'/media/recipe_images/{n}.{rng.getrandbits(48):012x}.jpg',
+            'prep_time': rng.randint(5, 60), 'cook_time': rng.randint(5, 120), 'servings': rng.randint(1, 8),
+            'ingredients': '<ul>' + ''.join(f'<li><strong>{rng.randint(1, 500)} g</strong> {sentence(2)}</li>'
+                                            for _ in range(rng.randint(5, 15))) + '</ul>',
+            'instructions': ''.join(f'<p>{sentence(rng.randint(8, 20))}</p>' for _ in range(rng.randint(4, 10))),
+            'created_at': '2024-10-12T03:42:00Z', 'updated_at': '2024-10-12T03:42:00Z',
+            'reviews': [{'id': rng.getrandbits(20), 'user': f'user{rng.randint(1, 999)}', 'recipe': title,
+                         'comment': sentence(rng.randint(4, 12)), 'rating': rng.randint(1, 5),
+                         'created_date': '2024-10-13'} for _ in range(rng.randint(0, 6))],
+            'is_favourited': False, 'author_name': f'chef{rng.randint(1, 50)}',
+        })
+    return json.dumps(items).encode()
+
+
+class Command(BaseCommand):
+    help = "Report bytes saved against CPU time for each encoding and level, cold and from the compressed cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', help=f"API paths to fetch (default: {' '.join(DEFAULT_PATHS)}).")
+        parser.add_argument('--synthetic', type=int, default=0, metavar='N',
+                            help="Also measure a generated list of N recipes.")
+        parser.add_argument('--levels', default='1,6,9')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        bodies = []
+        client = Client(raise_request_exception=False)
+        for path in options['paths'] or DEFAULT_PATHS:
+            response = client.get(path, HTTP_ACCEPT_ENCODING='identity')
+            if response.status_code == 200 and not response.streaming:
+                bodies.append((path, response.content))
+            else:
+                self.stderr.write(f"Skipping {path}: HTTP {response.status_code}")
+        if options['synthetic']:
+            bodies.append((f"synthetic x{options['synthetic']}", synthetic_body(options['synthetic'])))
+
+        levels = [int(level) for level in options['levels'].split(',')]
+        repeat = options['repeat']
+        self.stdout.write(f"{'body':<32} {'enc':<8} {'lvl':>3} {'raw':>10} {'sent':>10} {'saved':>7} "
+                          f"{'cold ms':>9} {'cached ms':>10}")
+        for name, body in bodies:
+            for encoding in supported_encodings():
+                for level in levels:
+                    started = time.perf_counter()
+                    for _ in range(repeat):
+                        compressed = compress(body, encoding, level)
+                    cold = (time.perf_counter() - started) * 1000 / repeat
+
+                    cache = CompressedBodyCache(max_bytes=64 * 1024 * 1024)
+                    cache.get_or_compress(body, encoding, level)
+                    started = time.perf_counter()
+                    for _ in range(repeat):
+                        cache.get_or_compress(body, encoding, level)
+                    cached = (time.perf_counter() - started) * 1000 / repeat
+
+                    saved = 1 - len(compressed) / len(body) if body else 0
+                    self.stdout.write(f"{name[:32]:<32} {encoding:<8} {level:>3} {len(body):>10} "
+                                      f"{len(compressed):>10} {saved:>6.1%} {cold:>9.3f} {cached:>10.4f}")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from blog.similarity import compute_similar_recipes
+
+
+class Command(BaseCommand):
+    help = "Precompute the top-k similar recipes for recipes added or edited since the last run."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recompute every neighbour list.")
+        parser.add_argument('-k', type=int, default=10, help="Neighbours stored per recipe.")
+        parser.add_argument('--dim', type=int, default=1024, help="Hashed vector size.")
+        parser.add_argument('--block-size', type=int, default=256, help="Rows per matrix product.")
+
+    def handle(self, *args, **options):
+        written = compute_similar_recipes(k=options['k'], dim=options['dim'],
+                                          block_size=options['block_size'], full=options['full'])
+        self.stdout.write(self.style.SUCCESS(f"Updated {written} neighbour lists."))
@@ -0,0 +1,106 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.text import slugify
+
+from blog.models import Category, Recipe
+from blog.trigram import SIMILARITY_THRESHOLD, index_recipes, recipe_trigrams, search, trigrams
+from user_account.models import CustomUser
+
+WORDS = ('chicken beef lamb paneer tofu prawn salmon lentil chickpea potato spinach mushroom tomato '
+         'butter garlic ginger lemon honey chilli coconut curry masala tikka biryani korma stew soup '
+         'salad pie roast grilled fried baked spicy creamy smoky crispy').split()
+CATEGORIES = ('Breakfast', 'Lunch', 'Dinner', 'Dessert', 'Snacks', 'Drinks', 'Vegetarian', 'Seafood')
+
+
+def typo(word, rng):
+    # One deleted, swapped or replaced letter
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(('delete', 'swap', 'replace'))
+    if kind == 'delete':
+        return word[:i] + word[i + 1:]
+    if kind == 'swap':
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word[:i] + rng.choice('aeiourstn') + word[i + 1:]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Time fuzzy search through the trigram index against scoring every recipe, optionally on N "
+            "generated recipes that are rolled back afterwards.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0, metavar='N',
+                            help="Insert N generated recipes for the run (rolled back).")
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['synthetic']:
+                    self.generate(options['synthetic'], random.Random(options['seed']))
+                self.run(options['queries'], random.Random(options['seed'] + 1))
+                raise Rollback
+        except Rollback:
+            pass
+
+    def generate(self, count, rng):
+        author, _ = CustomUser.objects.get_or_create(username='fuzzy-benchmark',
+                                                     defaults={'email': 'fuzzy-benchmark@example.com'})
+        categories = [Category.objects.create(title=f'{title} bench') for title in CATEGORIES]
+        started = time.perf_counter()
+        for offset in range(0, count, 1000):
+            batch = []
+            for n in range(offset, min(offset + 1000, count)):
+                title = ' '.join(rng.sample(WORDS, rng.randint(2, 4))).title()
+                batch.append(Recipe(author=author, category=rng.choice(categories), title=title,
+                                    slug=f'{slugify(title)}-bench-{n}', ingredients='', instructions='',
+                                    prep_time=10, cook_time=20, servings=2))
+            index_recipes(Recipe.objects.bulk_create(batch))
+        self.stdout.write(f"Indexed {count} synthetic recipes in {time.perf_counter() - started:.1f} s")
+
+    def run(self, count, rng):
+        titles = list(Recipe.objects.values_list('title', flat=True).order_by('?')[:count])
+        if not titles:
+            self.stderr.write("No recipes to search; use --synthetic N.")
+            return
+        queries = [' '.join(typo(word, rng) for word in title.lower().split()) for title in titles]
+
+        indexed, hits = [], 0
+        for query, title in zip(queries, titles):
+            started = time.perf_counter()
+            matches = search(query, limit=10)
+            indexed.append((time.perf_counter() - started) * 1000)
+            # Generated titles repeat word sets, so any recipe with the same words counts as found
+            found = Recipe.objects.filter(pk__in=[pk for pk, _ in matches]).values_list('title', flat=True)
+            hits += any(sorted(found_title.lower().split()) == sorted(title.lower().split()) for found_title in found)
+
+        # Baseline: load every recipe and score it in Python
+        scanned = []
+        for query in queries[:5]:
+            started = time.perf_counter()
+            wanted = trigrams(query)
+            scored = []
+            for pk, title, category in Recipe.objects.values_list('pk', 'title', 'category__title').iterator():
+                grams = recipe_trigrams(title, category)
+                similarity = len(wanted & grams) / len(wanted)
+                if similarity >= SIMILARITY_THRESHOLD:
+                    scored.append((similarity, -len(grams), pk))
+            sorted(scored, reverse=True)[:10]
+            scanned.append((time.perf_counter() - started) * 1000)
+
+        total = Recipe.objects.count()
+        self.stdout.write(f"{total} recipes, {len(queries)} misspelled queries (e.g. {queries[0]!r})")
+        p95 = statistics.quantiles(indexed, n=20)[-1] if len(indexed) > 1 else indexed[0]
+        self.stdout.write(f"  trigram index  p50 {statistics.median(indexed):8.2f} ms   p95 {p95:8.2f} ms")
+        self.stdout.write(f"  full scan      p50 {statistics.median(scanned):8.2f} ms")
+        self.stdout.write(f"  intended recipe in top 10: {hits}/{len(queries)}")
@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog.sync import compact
+
+
+class Command(BaseCommand):
+    help = ("Compact the change log: keep the latest entry per object and drop tombstones older than --days. "
+            "Clients with cursors from before a dropped tombstone get 410 and resync.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help="How long tombstones are kept.")
+
+    def handle(self, *args, **options):
+        superseded, tombstones = compact(timezone.now() - timedelta(days=options['days']))
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {superseded} superseded entries and {tombstones} expired tombstones."))
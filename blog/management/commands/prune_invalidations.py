@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from blog.models import Invalidation
+
+
+class Command(BaseCommand):
+    help = ("Delete invalidation bus entries older than INVALIDATION_RETENTION_SECONDS; "
+            "workers idle for longer flush their caches instead of replaying them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=int, default=None,
+                            help="Override INVALIDATION_RETENTION_SECONDS.")
+
+    def handle(self, *args, **options):
+        seconds = options['seconds'] or getattr(settings, 'INVALIDATION_RETENTION_SECONDS', 3600)
+        cutoff = timezone.now() - timedelta(seconds=seconds)
+        deleted, _ = Invalidation.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} invalidation entries."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog.trigram import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the fuzzy search trigram index from scratch (it is kept up to date by signals otherwise)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        count = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} recipes."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recompute per-category recipe counts and latest recipe, fixing any drift."
+
+    def handle(self, *args, **options):
+        fixed = reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Fixed {fixed} categories."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from blog.trending import refresh_trending
+
+
+class Command(BaseCommand):
+    help = ("Fold new favourites and reviews, and queued retractions, into the time-decayed trending "
+            "scores (run from cron).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        processed = refresh_trending(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} new events."))
@@ -0,0 +1,132 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: import the WSGI/ASGI application, serve one
+# request in-process and report how long that took.
+CHILD = r'''
+import asyncio, io, json, os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'RecipeApi.settings')
+mode, path = sys.argv[1], sys.argv[2]
+if mode == 'wsgi':
+    from RecipeApi.wsgi import application
+    loaded = time.perf_counter()
+    result = {}
+    def start_response(status, headers, exc_info=None):
+        result['status'] = int(status.split()[0])
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0),
+        'wsgi.multithread': False, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    b''.join(application(environ, start_response))
+    status = result['status']
+else:
+    from RecipeApi.asgi import application
+    loaded = time.perf_counter()
+    statuses = []
+    async def serve():
+        messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()  # no disconnect; Django cancels this once it has responded
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                 'headers': [(b'host', b'localhost')], 'server': ('localhost', 80), 'client': ('127.0.0.1', 0)}
+        await application(scope, receive, send)
+    asyncio.run(serve())
+    status = statuses[0]
+done = time.perf_counter()
+print('BENCH ' + json.dumps({'import_ms': (loaded - start) * 1000, 'first_response_ms': (done - start) * 1000,
+                             'status': status}))
+'''
+
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package"; self times summed per top-level package
+    totals = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        totals[fields[2].strip().split('.')[0]] += int(fields[0])
+    return totals
+
+
+class Command(BaseCommand):
+    help = ("Measure worker cold start: time to import the WSGI/ASGI app and serve a first request, "
+            "plus the slowest top-level imports (python -X importtime).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--path', default='/api/categories/', help="Path of the first request.")
+        parser.add_argument('--repeat', type=int, default=3, help="Runs; the median is reported.")
+        parser.add_argument('--top', type=int, default=15, help="Slowest packages to list.")
+        parser.add_argument('--threshold-ms', type=float, default=None,
+                            help="Fail if the median time to first response exceeds this.")
+        parser.add_argument('--json', action='store_true', help="Print a machine readable report.")
+
+    def run_child(self, app, path):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'RecipeApi.settings'))
+        started = time.perf_counter()
+        child = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, app, path],
+                               cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        wall = (time.perf_counter() - started) * 1000
+        lines = [line for line in child.stdout.splitlines() if line.startswith('BENCH ')]
+        if child.returncode or not lines:
+            raise CommandError(f"Benchmark process failed:\n{child.stderr[-2000:]}")
+        result = json.loads(lines[-1][len('BENCH '):])
+        result['process_ms'] = wall
+        return result, child.stderr
+
+    def handle(self, *args, **options):
+        runs, imports = [], defaultdict(list)
+        for _ in range(options['repeat']):
+            result, stderr = self.run_child(options['app'], options['path'])
+            runs.append(result)
+            for package, micros in parse_importtime(stderr).items():
+                imports[package].append(micros / 1000)
+
+        report = {
+            'app': options['app'],
+            'path': options['path'],
+            'status': runs[-1]['status'],
+            'process_ms': statistics.median(run['process_ms'] for run in runs),
+            'import_ms': statistics.median(run['import_ms'] for run in runs),
+            'first_response_ms': statistics.median(run['first_response_ms'] for run in runs),
+            'imports_ms': dict(sorted(((package, round(statistics.median(times), 2))
+                                       for package, times in imports.items()),
+                                      key=lambda item: item[1], reverse=True)[:options['top']]),
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.stdout.write(f"{report['app'].upper()} {report['path']} -> {report['status']} "
+                              f"(median of {options['repeat']})")
+            self.stdout.write(f"  app import         {report['import_ms']:8.1f} ms")
+            self.stdout.write(f"  first response     {report['first_response_ms']:8.1f} ms")
+            self.stdout.write(f"  process wall time  {report['process_ms']:8.1f} ms")
+            self.stdout.write("  slowest packages (self time, ms):")
+            for package, ms in report['imports_ms'].items():
+                self.stdout.write(f"    {package:<30} {ms:8.2f}")
+
+        threshold = options['threshold_ms']
+        if threshold is not None and report['first_response_ms'] > threshold:
+            raise CommandError(f"Time to first response {report['first_response_ms']:.1f} ms "
+                               f"exceeds the {threshold:.1f} ms threshold.")
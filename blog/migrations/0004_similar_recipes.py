@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0003_trending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarityState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+                ('k', models.PositiveSmallIntegerField(default=10)),
+                ('dim', models.PositiveIntegerField(default=1024)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SimilarRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_recipes', to='blog.recipe')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_of', to='blog.recipe')),
+            ],
+            options={
+                'ordering': ['rank'],
+                'unique_together': {('recipe', 'rank')},
+            },
+        ),
+    ]
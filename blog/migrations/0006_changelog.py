@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:07
+
+from django.db import migrations, models
+
+
+def seed_changelog(apps, schema_editor):
+    # Existing rows become upserts so a client syncing from cursor 0 gets everything
+    ChangeLog = apps.get_model('blog', 'ChangeLog')
+    sources = [
+        ('category', apps.get_model('blog', 'Category'), None),
+        ('recipe', apps.get_model('blog', 'Recipe'), None),
+        ('review', apps.get_model('blog', 'Review'), None),
+        ('favourite', apps.get_model('blog', 'Favourite'), 'user_id'),
+    ]
+    for name, model, owner_field in sources:
+        fields = ['id', owner_field] if owner_field else ['id']
+        batch = []
+        for row in model.objects.order_by('id').values(*fields).iterator():
+            batch.append(ChangeLog(model=name, object_id=row['id'], action='upsert',
+                                   owner_id=row.get(owner_field) if owner_field else None))
+            if len(batch) >= 1000:
+                ChangeLog.objects.bulk_create(batch)
+                batch = []
+        ChangeLog.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=6)),
+                ('owner_id', models.BigIntegerField(blank=True, null=True)),
+                ('tombstone', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner_id', 'id'], name='blog_change_owner_i_1b11b3_idx')],
+            },
+        ),
+        migrations.RunPython(seed_changelog, migrations.RunPython.noop),
+    ]
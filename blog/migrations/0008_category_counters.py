@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def populate_counters(apps, schema_editor):
+    Category = apps.get_model('blog', 'Category')
+    Recipe = apps.get_model('blog', 'Recipe')
+    latest = Recipe.objects.filter(category=OuterRef('pk')).order_by('-created_at', '-pk')
+    categories = Category.objects.annotate(
+        actual_count=Count('category_recipe'),
+        actual_latest=Subquery(latest.values('pk')[:1]),
+        actual_latest_at=Subquery(latest.values('created_at')[:1]),
+    )
+    for category in categories:
+        category.recipe_count = category.actual_count
+        category.latest_recipe_id = category.actual_latest
+        category.latest_recipe_at = category.actual_latest_at
+    Category.objects.bulk_update(categories, ['recipe_count', 'latest_recipe', 'latest_recipe_at'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_recipe_rendered_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='latest_recipe',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='blog.recipe'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='latest_recipe_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
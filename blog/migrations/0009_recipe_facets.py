@@ -0,0 +1,48 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:16
+
+import django.db.models.expressions
+from django.db import migrations, models
+from django.db.models import Avg, Count, FloatField, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_ratings(apps, schema_editor):
+    Recipe = apps.get_model('blog', 'Recipe')
+    Review = apps.get_model('blog', 'Review')
+    reviews = Review.objects.filter(recipe=OuterRef('pk'), rating__isnull=False).order_by().values('recipe')
+    Recipe.objects.update(
+        rating_avg=Subquery(reviews.annotate(value=Avg('rating')).values('value'), output_field=FloatField()),
+        rating_count=Coalesce(Subquery(reviews.annotate(value=Count('pk')).values('value'),
+                                       output_field=IntegerField()), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_category_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_avg',
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='total_time',
+            field=models.GeneratedField(db_index=True, db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('prep_time'), '+', models.F('cook_time')), output_field=models.IntegerField()),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='servings',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+    ]
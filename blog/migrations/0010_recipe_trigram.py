@@ -0,0 +1,65 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:20
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Frozen copies of blog.autocomplete.normalize and blog.trigram.recipe_trigrams
+# as they were when this migration was written, so later changes to those
+# modules don't change (or break) what it does
+
+_NON_WORD = re.compile(r'[^\w\s]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = _NON_WORD.sub(' ', text.lower())
+    return _SPACES.sub(' ', text).strip()
+
+
+def recipe_trigrams(title, category_title):
+    grams = set()
+    for word in normalize(f'{title} {category_title or ""}').split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def build_index(apps, schema_editor):
+    Recipe = apps.get_model('blog', 'Recipe')
+    RecipeTrigram = apps.get_model('blog', 'RecipeTrigram')
+    batch = []
+    for row in Recipe.objects.order_by('id').values('id', 'title', 'category__title').iterator():
+        grams = recipe_trigrams(row['title'], row['category__title'])
+        batch.extend(RecipeTrigram(recipe_id=row['id'], trigram=gram, size=len(grams)) for gram in grams)
+        if len(batch) >= 5000:
+            RecipeTrigram.objects.bulk_create(batch)
+            batch = []
+    RecipeTrigram.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_recipe_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('size', models.PositiveSmallIntegerField(help_text='Trigrams indexed for this recipe')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='blog.recipe')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['trigram', 'recipe', 'size'], name='blog_recipe_trigram_0c588e_idx')],
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
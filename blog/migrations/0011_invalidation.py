@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_recipe_trigram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Invalidation',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('key', models.CharField(max_length=200)),
+                ('origin', models.CharField(help_text='Process that made the write', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+    ]
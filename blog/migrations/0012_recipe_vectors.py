@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_invalidation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeVector',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feature_vector', serialize=False, to='blog.recipe')),
+                ('source_hash', models.CharField(max_length=40)),
+                ('indexes', models.BinaryField()),
+                ('weights', models.BinaryField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+# The admin's '^title' search is an istartswith lookup, which a plain btree
+# on title can't serve: PostgreSQL compares UPPER(title::text) with LIKE, and
+# SQLite's LIKE is case-insensitive. Index exactly those expressions.
+
+INDEXES = [
+    ('blog_recipe_title_prefix', 'blog_recipe', 'title'),
+    ('blog_category_title_prefix', 'blog_category', 'title'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for name, table, column in INDEXES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} (UPPER({column}::text) text_pattern_ops)')
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} ({column} COLLATE NOCASE)')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        for name, _, _ in INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_recipe_vectors'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
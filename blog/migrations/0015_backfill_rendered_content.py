@@ -0,0 +1,152 @@
+import math
+import re
+from html import escape
+from html.parser import HTMLParser
+
+from django.db import migrations
+
+# Frozen copy of blog.sanitize as it was when this migration was written, so
+# later changes to that module don't change (or break) what the backfill does
+
+# What TinyMCE content may keep once it is stored for display
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'div', 'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr',
+    'i', 'img', 'li', 'ol', 'p', 'pre', 's', 'span', 'strong', 'sub', 'sup', 'table', 'tbody',
+    'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'img': {'src', 'alt', 'width', 'height'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+ALLOWED_SCHEMES = ('http://', 'https://', 'mailto:', '/')
+VOID_TAGS = {'br', 'hr', 'img'}
+# Tags whose content is dropped along with the tag
+DROP_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template'}
+BLOCK_TAGS = {'blockquote', 'br', 'div', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'li', 'ol', 'p', 'pre',
+              'table', 'tr', 'ul'}
+# An open tag of the same name is closed implicitly, as browsers do for <li>egg<li>milk
+SELF_CLOSING_SIBLINGS = {'li', 'p', 'td', 'th', 'tr'}
+
+WORDS_PER_MINUTE = 200
+_SPACES = re.compile(r'[ \t\r\f\v]+')
+_BLANK_LINES = re.compile(r'\s*\n\s*')
+
+
+class _ContentParser(HTMLParser):
+    # Builds the sanitized HTML and the plain text in a single pass
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.html = []
+        self.text = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+        if tag not in ALLOWED_TAGS:
+            return
+        if tag in SELF_CLOSING_SIBLINGS and self.open_tags and self.open_tags[-1] == tag:
+            self.html.append(f"</{self.open_tags.pop()}>")
+        allowed = ALLOWED_ATTRIBUTES.get(tag, set())
+        rendered = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not value.strip().lower().startswith(ALLOWED_SCHEMES):
+                continue
+            rendered.append(f' {name}="{escape(value, quote=True)}"')
+        if tag == 'a':
+            rendered.append(' rel="nofollow noopener"')
+        self.html.append(f"<{tag}{''.join(rendered)}>")
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROP_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append('\n')
+        if tag not in self.open_tags:
+            return
+        # Close anything left open inside this element
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.html.append(f"</{open_tag}>")
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.html.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def result(self):
+        self.close()
+        html = ''.join(self.html) + ''.join(f"</{tag}>" for tag in reversed(self.open_tags))
+        text = _BLANK_LINES.sub('\n', _SPACES.sub(' ', ''.join(self.text).replace('\xa0', ' '))).strip()
+        return html, text
+
+
+def render(raw):
+    """Return (sanitized HTML, plain text) for a TinyMCE HTML fragment."""
+    parser = _ContentParser()
+    parser.feed(raw or '')
+    return parser.result()
+
+
+def word_count(*texts):
+    return sum(len(text.split()) for text in texts)
+
+
+def reading_time(words):
+    # Minutes, rounded up; empty content reads in zero minutes
+    return math.ceil(words / WORDS_PER_MINUTE)
+
+
+BATCH_SIZE = 500
+
+
+def render_existing(apps, schema_editor):
+    # Recipes written before 0007 have empty rendered columns: search reads
+    # ingredients_text and the API returns the *_html copies
+    Recipe = apps.get_model('blog', 'Recipe')
+    fields = ['ingredients_html', 'instructions_html', 'ingredients_text', 'instructions_text',
+              'word_count', 'reading_time']
+    queryset = Recipe.objects.filter(word_count=0).only('id', 'ingredients', 'instructions').order_by('id')
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        for recipe in batch:
+            recipe.ingredients_html, recipe.ingredients_text = render(recipe.ingredients)
+            recipe.instructions_html, recipe.instructions_text = render(recipe.instructions)
+            recipe.word_count = word_count(recipe.ingredients_text, recipe.instructions_text)
+            recipe.reading_time = reading_time(recipe.word_count)
+        Recipe.objects.bulk_update(batch, fields)
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_changelog_compaction'),
+    ]
+
+    operations = [
+        migrations.RunPython(render_existing, migrations.RunPython.noop),
+    ]
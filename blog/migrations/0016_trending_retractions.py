@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-19 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_backfill_rendered_content'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingRetraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cursor', models.CharField(help_text='TrendingState field the event id is compared with', max_length=20)),
+                ('event_id', models.BigIntegerField()),
+                ('recipe_id', models.BigIntegerField()),
+                ('weight', models.FloatField()),
+                ('occurred_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -1,16 +1,25 @@
-from django.db import models
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from user_account.models import CustomUser
 from django.utils.text import slugify
 from .slug import generate_unique_slug
+from . import sanitize
 from tinymce.models import HTMLField
-from PIL import Image
 # Create your models here.
 
 class Category(models.Model):
     title=models.CharField(max_length=150, unique=True)
     slug=models.SlugField(null=True, blank=True)
     created_date=models.DateField(auto_now_add=True)
+    # Maintained by blog/counters.py on recipe writes; `manage.py reconcile_category_counts` fixes drift
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    latest_recipe = models.ForeignKey('Recipe', related_name='+', null=True, blank=True,
+                                      on_delete=models.SET_NULL, editable=False)
+    latest_recipe_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     def __str__(self) -> str:
         return self.title
@@ -23,42 +32,112 @@ class Category(models.Model):
 class Recipe(models.Model):
     author = models.ForeignKey(CustomUser, related_name='user_recipe', on_delete=models.CASCADE)
     category = models.ForeignKey(Category,related_name='category_recipe',on_delete=models.CASCADE)
-    title = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, db_index=True)
     instructions = HTMLField()
     ingredients = HTMLField()  # You can also normalize this with an Ingredient model if you want.
     prep_time = models.IntegerField(help_text="Time in minutes")
     cook_time = models.IntegerField(help_text="Time in minutes")
-    servings = models.IntegerField()
+    servings = models.IntegerField(db_index=True)
+    # Stored so the faceted filter can range-scan an index (see blog/facets.py)
+    total_time = models.GeneratedField(expression=models.F('prep_time') + models.F('cook_time'),
+                                       output_field=models.IntegerField(), db_persist=True, db_index=True)
+    # Kept in step with the reviews by the Review signal receivers (blog/counters.py)
+    rating_avg = models.FloatField(null=True, blank=True, editable=False, db_index=True)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
     image = models.ImageField(upload_to='recipe_images/', blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     slug=models.SlugField(null=True, blank=True)
+    # Derived from ingredients/instructions on every write (see render_content)
+    ingredients_html = models.TextField(blank=True, default='', editable=False)
+    instructions_html = models.TextField(blank=True, default='', editable=False)
+    ingredients_text = models.TextField(blank=True, default='', editable=False)
+    instructions_text = models.TextField(blank=True, default='', editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveIntegerField(default=0, editable=False, help_text="Time in minutes")
+
+    CONTENT_FIELDS = ('ingredients_html', 'instructions_html', 'ingredients_text', 'instructions_text',
+                      'word_count', 'reading_time')
+    # Category the row had before the current save (None when new), set by
+    # save(); the post_save receivers that move counts between categories read it
+    previous_category_id = None
     
     
     def __str__(self) -> str:
         return self.title
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored category so a move can be counted on save
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        if fields is None or {'category', 'category_id'} & set(fields):
+            self._loaded_category_id = self.category_id
+
+    def stored_category_id(self):
+        # Category of the stored row, before any unsaved change to this instance
+        if self.pk is None:
+            return None
+        if '_loaded_category_id' in self.__dict__:
+            return self._loaded_category_id
+        return Recipe.objects.filter(pk=self.pk).values_list('category_id', flat=True).first()
+
+    def render_content(self):
+        # Sanitize the TinyMCE markup once on write so reads never parse HTML
+        self.ingredients_html, self.ingredients_text = sanitize.render(self.ingredients)
+        self.instructions_html, self.instructions_text = sanitize.render(self.instructions)
+        self.word_count = sanitize.word_count(self.ingredients_text, self.instructions_text)
+        self.reading_time = sanitize.reading_time(self.word_count)
     
     def save(self, *args, **kwargs):
         # Check if the instance is being updated (already exists in the database)
         updating = self.pk is not None
+        self.render_content()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'ingredients', 'instructions'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | set(self.CONTENT_FIELDS)
 
         if updating:
             self.slug = generate_unique_slug(self, self.title, update=True)
         else:
             self.slug = generate_unique_slug(self, self.title)
 
-        # Call the original save method to save the object
-        super().save(*args, **kwargs)
+        # Resize a newly uploaded image before it is stored, so the stored file
+        # (and its content-hashed name) is final
+        if self.image and not self.image._committed:
+            self.resize_image()
 
-        # Resize the image after saving it
-        if self.image:
-            img_path = self.image.path
-            img = Image.open(img_path)
+        self.previous_category_id = self.stored_category_id()
 
-            # Resize the image to the specified size (width: 330px, height: 285px)
-            output_size = (330, 285)
-            img = img.resize(output_size)
-            img.save(img_path)
+        # Call the original save method to save the object; post_save receivers
+        # (category counters) run inside the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_category_id = self.category_id
+
+    def resize_image(self):
+        # Imported here, not at worker boot: PIL.Image and its C extension, plus
+        # numpy.typing, which Pillow's type hints import whenever numpy is
+        # installed (the "PIL" and "numpy" rows of `manage.py startup_benchmark`)
+        from PIL import Image
+
+        self.image.seek(0)
+        img = Image.open(self.image)
+        image_format = img.format or 'PNG'
+
+        # Resize the image to the specified size (width: 330px, height: 285px)
+        output_size = (330, 285)
+        img = img.resize(output_size)
+        if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+        buffer = BytesIO()
+        img.save(buffer, format=image_format)
+        self.image.save(os.path.basename(self.image.name), ContentFile(buffer.getvalue()), save=False)
             
     # def save(self, *args, **kwargs):
     #     # Check if the instance is being updated (already exists in the database)
@@ -78,8 +157,8 @@ class Review(models.Model):
     user = models.ForeignKey(CustomUser,related_name='user_review',on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe,related_name='recipe_review',on_delete=models.CASCADE)
     comment = models.TextField(max_length=250)
-    rating = models.IntegerField(choices=[(i, str(i)) for i in range(1, 6)],null=True)
-    created_date = models.DateField(auto_now_add=True)
+    rating = models.IntegerField(choices=[(i, str(i)) for i in range(1, 6)],null=True, db_index=True)
+    created_date = models.DateField(auto_now_add=True, db_index=True)
     
     def __str__(self) -> str:
         return self.comment
@@ -88,7 +167,7 @@ class Review(models.Model):
 class Favourite(models.Model):
     user = models.ForeignKey(CustomUser, related_name='favourites', on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe, related_name='favourited_by', on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     class Meta:
         unique_together = ('user', 'recipe')
@@ -98,3 +177,108 @@ class Favourite(models.Model):
 
 
     
+
+
+class TrendingScore(models.Model):
+    # Scores are stored relative to TrendingState.epoch (see blog/trending.py),
+    # so ordering by this column is ordering by the decayed score at any instant.
+    recipe = models.OneToOneField(Recipe, related_name='trending', on_delete=models.CASCADE)
+    score = models.FloatField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.recipe_id}: {self.score}"
+
+
+class TrendingState(models.Model):
+    # Single row checkpoint for the incremental trending refresh
+    epoch = models.DateTimeField()
+    last_favourite_id = models.BigIntegerField(default=0)
+    last_review_id = models.BigIntegerField(default=0)
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+
+class TrendingRetraction(models.Model):
+    # An unfavourite or deleted review, queued for the next refresh to subtract
+    # (see blog/trending.py); the rows it refers to are already gone
+    cursor = models.CharField(max_length=20, help_text="TrendingState field the event id is compared with")
+    event_id = models.BigIntegerField()
+    recipe_id = models.BigIntegerField()
+    weight = models.FloatField()
+    occurred_at = models.DateTimeField()
+
+
+class SimilarRecipe(models.Model):
+    # Precomputed nearest neighbours, written by `manage.py compute_similar_recipes`
+    recipe = models.ForeignKey(Recipe, related_name='similar_recipes', on_delete=models.CASCADE)
+    similar = models.ForeignKey(Recipe, related_name='similar_of', on_delete=models.CASCADE)
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['rank']
+        unique_together = ('recipe', 'rank')
+
+
+class SimilarityState(models.Model):
+    # Single row checkpoint for incremental neighbour updates
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+    k = models.PositiveSmallIntegerField(default=10)
+    dim = models.PositiveIntegerField(default=1024)
+
+
+class RecipeVector(models.Model):
+    # Hashed feature vector kept between `compute_similar_recipes` runs, stored
+    # sparse (nonzero positions and their values); source_hash tells whether the
+    # title, category or ingredients changed since it was computed
+    recipe = models.OneToOneField(Recipe, primary_key=True, related_name='feature_vector',
+                                  on_delete=models.CASCADE)
+    source_hash = models.CharField(max_length=40)
+    indexes = models.BinaryField()
+    weights = models.BinaryField()
+
+
+class RecipeTrigram(models.Model):
+    # Character-trigram index over recipe and category titles (blog/trigram.py)
+    trigram = models.CharField(max_length=3)
+    recipe = models.ForeignKey(Recipe, related_name='+', on_delete=models.CASCADE)
+    size = models.PositiveSmallIntegerField(help_text="Trigrams indexed for this recipe")
+
+    class Meta:
+        # Covers the lookup: rows for a trigram with recipe and size, no table access
+        indexes = [models.Index(fields=['trigram', 'recipe', 'size'])]
+
+
+class ChangeLog(models.Model):
+    # Append-only log behind /api/changes/; the primary key doubles as the sync cursor
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=6, choices=[(UPSERT, 'Upsert'), (DELETE, 'Delete')])
+    # Set for rows only their owner may see (favourites)
+    owner_id = models.BigIntegerField(null=True, blank=True)
+    # Enough of a deleted row for clients to drop it locally (e.g. recipe id of a favourite)
+    tombstone = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['owner_id', 'id']), models.Index(fields=['model', 'object_id', 'id'])]
+
+    def __str__(self):
+        return f"#{self.pk} {self.action} {self.model}:{self.object_id}"
+
+
+class SyncState(models.Model):
+    # Single row: highest change log id of a tombstone dropped by compaction.
+    # Cursors before it may have missed a delete and must resync from 0.
+    pruned_through = models.BigIntegerField(default=0)
+
+
+class Invalidation(models.Model):
+    # Append-only log behind the cross-worker invalidation bus (blog/invalidation.py)
+    seq = models.BigAutoField(primary_key=True)
+    key = models.CharField(max_length=200)
+    origin = models.CharField(max_length=64, help_text="Process that made the write")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -0,0 +1,137 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+# Derive select_related / prefetch_related / only from what a serializer reads,
+# so views stop hand-writing (and drifting from) them.
+#
+#   author_name = CharField(source='author.username')  -> select author, load author.username
+#   reviews = ReviewSerializer(many=True, source='recipe_review')
+#                                                    -> Prefetch('recipe_review', <optimized Review queryset>)
+#   category = PrimaryKeyRelatedField()              -> just the category_id column
+#   user = StringRelatedField()                      -> select user, whole row (__str__ may read anything)
+#   ingredients = SanitizedHTMLField('ingredients_html')
+#                                                    -> its `read_source` column instead of `source`
+#
+# A serializer can add to its own queryset with an `optimize_queryset(queryset,
+# context)` classmethod, e.g. to annotate what a SerializerMethodField needs.
+# Method fields without that hook, and sources that are not model fields
+# (properties, annotations), turn the column restriction off, since there is
+# no telling which columns they read; the joins and prefetches still apply.
+
+
+class _Plan:
+
+    def __init__(self):
+        self.select = []
+        self.prefetch = []
+        self.only = ['pk']
+        self.full = []  # joined relations needed whole
+        self.restrict = True
+
+    def add(self, collection, value):
+        if value not in collection:
+            collection.append(value)
+
+
+def _forward_single(model_field):
+    # Relations that resolve to one row and can be joined: FK, one-to-one (either side)
+    return model_field.many_to_one or model_field.one_to_one
+
+
+def _plan(serializer, model, plan, prefix='', parent_field=None):
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            if isinstance(field, serializers.Serializer):
+                _plan(field, model, plan, prefix, parent_field)
+            elif not hasattr(serializer, 'optimize_queryset'):
+                plan.restrict = False
+            continue
+        _plan_source(field, model, plan, prefix, parent_field)
+
+
+def _plan_source(field, model, plan, prefix, parent_field):
+    current, path = model, prefix
+    read_source = getattr(field, 'read_source', None)
+    attrs = read_source.split('.') if read_source else field.source_attrs
+    for position, attr in enumerate(attrs):
+        last = position == len(attrs) - 1
+        try:
+            model_field = current._meta.get_field(attr)
+        except FieldDoesNotExist:
+            plan.restrict = False  # property or annotation: columns unknown
+            return
+        name = path + attr
+
+        if not model_field.is_relation:
+            plan.add(plan.only, name)
+            return
+
+        if _forward_single(model_field):
+            if model_field.concrete:
+                plan.add(plan.only, name)
+            if last and isinstance(field, serializers.RelatedField) and \
+                    not isinstance(field, serializers.StringRelatedField) and model_field.concrete:
+                return  # primary key (or slug, via its own query) of the target: the FK column is enough
+            if prefix == '' and attr == parent_field:
+                return  # the parent row of a prefetch; Django attaches it without a query
+            plan.add(plan.select, name)
+            related = model_field.related_model
+            if last:
+                if isinstance(field, serializers.Serializer):
+                    _plan(field, related, plan, name + '__')
+                else:
+                    plan.add(plan.full, name)  # __str__ or similar: whole row
+                return
+            current, path = related, name + '__'
+            continue
+
+        # Many rows: reverse FK or many-to-many
+        child = field.child if isinstance(field, serializers.ListSerializer) else None
+        queryset = model_field.related_model._default_manager.all()
+        if isinstance(child, serializers.Serializer) and last:
+            back = model_field.field.name if model_field.one_to_many else None
+            queryset = optimize(queryset, type(child), context=child.context, parent_field=back,
+                                serializer=child)
+        plan.add(plan.prefetch, Prefetch(name, queryset=queryset))
+        return
+
+
+def optimize(queryset, serializer_class, context=None, only=True, parent_field=None, serializer=None):
+    """Apply the joins, prefetches and column restriction `serializer_class` needs to `queryset`."""
+    context = context or {}
+    serializer = serializer or serializer_class(context=context)
+    plan = _Plan()
+    if parent_field:
+        plan.add(plan.only, parent_field)  # the FK the prefetch matches rows on
+    _plan(serializer, queryset.model, plan, parent_field=parent_field)
+
+    if plan.select:
+        queryset = queryset.select_related(*plan.select)
+    if plan.prefetch:
+        queryset = queryset.prefetch_related(*plan.prefetch)
+    if only and plan.restrict:
+        # Naming none of a joined model's columns loads all of them
+        columns = [column for column in plan.only
+                   if not any(column.startswith(path + '__') for path in plan.full)]
+        queryset = queryset.only(*columns)
+    hook = getattr(serializer_class, 'optimize_queryset', None)
+    if hook is not None:
+        queryset = hook(queryset, context)
+    return queryset
+
+
+class OptimizedQuerysetMixin:
+    # For generic views: queryset comes back shaped for the serializer. Views
+    # that write through the serializer set optimize_only = False, because
+    # saving an instance loaded with only() writes just the loaded columns.
+    optimize_only = True
+
+    def optimize(self, queryset):
+        return optimize(queryset, self.get_serializer_class(), self.get_serializer_context(),
+                        only=self.optimize_only)
+
+    def get_queryset(self):
+        return self.optimize(super().get_queryset())
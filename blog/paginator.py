@@ -0,0 +1,51 @@
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+# Unfiltered tables smaller than this are still counted exactly
+ESTIMATE_THRESHOLD = 100000
+
+
+def estimate_row_count(model, using='default'):
+    # Cheap row count estimate from planner statistics, falling back to MAX(pk)
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            elif connection.vendor == 'mysql':
+                cursor.execute("SELECT table_rows FROM information_schema.tables "
+                               "WHERE table_schema = DATABASE() AND table_name = %s", [table])
+            elif connection.vendor == 'sqlite':
+                # Populated by ANALYZE; the first number of `stat` is the row count
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+            else:
+                cursor.execute("SELECT NULL")
+            row = cursor.fetchone()
+        if row and row[0] is not None:
+            estimate = int(str(row[0]).split()[0])
+            if estimate > 0:
+                return estimate
+    except (DatabaseError, ValueError):
+        pass
+    return model._default_manager.using(using).aggregate(max_pk=Max('pk'))['max_pk'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists on large tables: an unfiltered list uses
+    the estimated row count instead of a full COUNT(*). Filtered or searched
+    lists are still counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None or query.where:
+            return super().count
+        estimate = estimate_row_count(self.object_list.model, self.object_list.db)
+        if estimate < ESTIMATE_THRESHOLD:
+            return super().count
+        return estimate
@@ -1,15 +1,29 @@
 from django.contrib.auth.models import User
 from user_account.models import CustomUser
 from rest_framework import serializers
+from django.db.models import Exists, OuterRef
 from .models import Recipe, Category, Review, Favourite
-from tinymce.models import HTMLField
 from django.contrib.auth.hashers import make_password
+from .trending import decay_factor
+
+
+# Recipe content field: takes the raw TinyMCE markup on write, but reads return
+# the copy Recipe.render_content sanitized on save, never the raw input
+class SanitizedHTMLField(serializers.CharField):
+
+    def __init__(self, read_source, **kwargs):
+        self.read_source = read_source  # also tells blog/optimization.py which column is read
+        kwargs.setdefault('style', {'base_template': 'textarea.html'})
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return getattr(instance, self.read_source)
 
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'title', 'slug']
+        fields = ['id', 'title', 'slug', 'recipe_count', 'latest_recipe', 'latest_recipe_at']
         
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -22,8 +36,8 @@ class ReviewSerializer(serializers.ModelSerializer):
 
 
 class AddRecipeSerializer(serializers.ModelSerializer):
-    ingredients = HTMLField()
-    instructions = HTMLField()
+    ingredients = SanitizedHTMLField('ingredients_html')
+    instructions = SanitizedHTMLField('instructions_html')
     # category_id = serializers.IntegerField(write_only=True)
     # category = CategorySerializer()  # Use the full category serializer
     category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
@@ -37,7 +51,18 @@ class AddRecipeSerializer(serializers.ModelSerializer):
                   'servings', 'ingredients', 'instructions', 'created_at', 'updated_at', 
                   'reviews', 'is_favourited', 'author_name']
 
+    @classmethod
+    def optimize_queryset(cls, queryset, context):
+        # Used by blog/optimization.py: one EXISTS per row instead of a query per recipe
+        request = context.get('request')
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return queryset.annotate(favourited=Exists(Favourite.objects.filter(user=user, recipe=OuterRef('pk'))))
+        return queryset
+
     def get_is_favourited(self, obj):
+        if hasattr(obj, 'favourited'):
+            return obj.favourited
         user = self.context['request'].user
         if user.is_authenticated:
             return Favourite.objects.filter(user=user, recipe=obj).exists()
@@ -50,6 +75,76 @@ class AddRecipeSerializer(serializers.ModelSerializer):
     #     return recipe
 
 
+# Item serializer for the bulk my-recipes endpoints; categories are resolved
+# up front in one query and handed over in the context
+class BulkRecipeSerializer(serializers.ModelSerializer):
+    category = serializers.IntegerField()
+
+    class Meta:
+        model = Recipe
+        fields = ['title', 'category', 'prep_time', 'cook_time', 'servings', 'ingredients', 'instructions']
+
+    def validate_category(self, value):
+        category = self.context['categories'].get(value)
+        if category is None:
+            raise serializers.ValidationError(f'Invalid pk "{value}" - object does not exist.')
+        return category
+
+
+# Lightweight recipe card used by listing endpoints that must stay a single query
+class RecipeSummarySerializer(serializers.ModelSerializer):
+    author_name = serializers.CharField(source='author.username', read_only=True)
+    category_title = serializers.CharField(source='category.title', read_only=True)
+
+    class Meta:
+        model = Recipe
+        fields = ['id', 'title', 'slug', 'category', 'category_title', 'image', 'prep_time',
+                  'cook_time', 'servings', 'word_count', 'reading_time', 'created_at', 'author_name']
+
+
+class FacetedRecipeSerializer(RecipeSummarySerializer):
+
+    class Meta(RecipeSummarySerializer.Meta):
+        fields = RecipeSummarySerializer.Meta.fields + ['total_time', 'rating_avg', 'rating_count']
+
+
+class TrendingRecipeSerializer(RecipeSummarySerializer):
+    trending_score = serializers.SerializerMethodField()
+
+    class Meta(RecipeSummarySerializer.Meta):
+        fields = RecipeSummarySerializer.Meta.fields + ['trending_score']
+
+    def get_trending_score(self, obj):
+        # trending_epoch is annotated by TrendingView
+        return round(obj.trending.score * decay_factor(obj.trending_epoch), 4)
+
+
+# Flat representations used by the delta sync endpoint (/api/changes/)
+class SyncRecipeSerializer(serializers.ModelSerializer):
+    author_name = serializers.CharField(source='author.username', read_only=True)
+    ingredients = serializers.CharField(source='ingredients_html', read_only=True)
+    instructions = serializers.CharField(source='instructions_html', read_only=True)
+
+    class Meta:
+        model = Recipe
+        fields = ['id', 'title', 'slug', 'category', 'image', 'prep_time', 'cook_time', 'servings',
+                  'ingredients', 'instructions', 'created_at', 'updated_at', 'author_name']
+
+
+class SyncReviewSerializer(serializers.ModelSerializer):
+    user = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = Review
+        fields = ['id', 'user', 'recipe', 'comment', 'rating', 'created_date']
+
+
+class SyncFavouriteSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Favourite
+        fields = ['id', 'recipe', 'created_at']
+
+
 class UserProfileUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = CustomUser
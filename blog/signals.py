@@ -0,0 +1,289 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from user_account.models import CustomUser
+
+from .autocomplete import autocomplete_index
+from .invalidation import bus
+from .models import Category, ChangeLog, Favourite, Recipe, RecipeVector, Review
+from .sync import record_change, record_changes
+from . import counters, events, sitemaps, trending, trigram
+
+
+# Keep the autocomplete index in step with writes (only once it has been loaded)
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved_autocomplete(sender, instance, created, **kwargs):
+    if autocomplete_index.loaded:
+        autocomplete_index.update_recipe(instance)
+        previous = instance.previous_category_id  # set by Recipe.save
+        if created:
+            autocomplete_index.adjust_popularity('category', instance.category_id, 1)
+        elif previous is not None and previous != instance.category_id:
+            autocomplete_index.adjust_popularity('category', previous, -1)
+            autocomplete_index.adjust_popularity('category', instance.category_id, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted_autocomplete(sender, instance, **kwargs):
+    if autocomplete_index.loaded:
+        autocomplete_index.remove_recipe(instance.pk)
+        autocomplete_index.adjust_popularity('category', instance.category_id, -1)
+
+
+@receiver(post_save, sender=Category)
+def category_saved_autocomplete(sender, instance, **kwargs):
+    if autocomplete_index.loaded:
+        autocomplete_index.update_category(instance)
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted_autocomplete(sender, instance, **kwargs):
+    if autocomplete_index.loaded:
+        autocomplete_index.remove_category(instance.pk)
+
+
+@receiver(post_save, sender=Favourite)
+def favourite_saved_autocomplete(sender, instance, created, **kwargs):
+    if created and autocomplete_index.loaded:
+        autocomplete_index.adjust_popularity('recipe', instance.recipe_id, 1)
+
+
+@receiver(post_delete, sender=Favourite)
+def favourite_deleted_autocomplete(sender, instance, **kwargs):
+    if autocomplete_index.loaded:
+        autocomplete_index.adjust_popularity('recipe', instance.recipe_id, -1)
+
+
+# Delta sync change log; deletes leave tombstones that outlive the rows
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Review)
+def public_row_saved_changelog(sender, instance, **kwargs):
+    record_change(instance, ChangeLog.UPSERT)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Review)
+def public_row_deleted_changelog(sender, instance, **kwargs):
+    tombstone = {'recipe': instance.recipe_id} if sender is Review else None
+    record_change(instance, ChangeLog.DELETE, tombstone=tombstone)
+
+
+@receiver(post_save, sender=Favourite)
+def favourite_saved_changelog(sender, instance, **kwargs):
+    record_change(instance, ChangeLog.UPSERT, owner_id=instance.user_id)
+
+
+@receiver(post_delete, sender=Favourite)
+def favourite_deleted_changelog(sender, instance, **kwargs):
+    record_change(instance, ChangeLog.DELETE, owner_id=instance.user_id, tombstone={'recipe': instance.recipe_id})
+
+
+# Category recipe counters, updated inside the writing transaction
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved_counters(sender, instance, created, **kwargs):
+    previous = instance.previous_category_id
+    if created:
+        counters.recipe_added(instance.category_id, instance)
+    elif previous is not None and previous != instance.category_id:
+        counters.recipe_removed(previous, instance.pk)
+        counters.recipe_added(instance.category_id, instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted_counters(sender, instance, **kwargs):
+    counters.recipe_removed(instance.category_id, instance.pk)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed_rating(sender, instance, **kwargs):
+    counters.rating_changed(instance.recipe_id)
+
+
+# Trending scores: a retracted favourite or deleted review is queued and stops
+# counting at the next refresh. Rows removed along with their recipe are
+# skipped, since the recipe's score row goes too.
+
+@receiver(post_delete, sender=Favourite)
+def favourite_deleted_trending(sender, instance, origin=None, **kwargs):
+    if not isinstance(origin, Recipe):
+        trending.retract_favourite(instance)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted_trending(sender, instance, origin=None, **kwargs):
+    if not isinstance(origin, Recipe):
+        trending.retract_review(instance)
+
+
+# Cross-worker invalidation bus (blog/invalidation.py); in-process caches such
+# as the author stats subscribe to these keys
+
+def _author_key(recipe_id):
+    author_id = Recipe.objects.filter(pk=recipe_id).values_list('author_id', flat=True).first()
+    return f'author:{author_id}' if author_id is not None else None
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed_bus(sender, instance, **kwargs):
+    keys = [f'recipe:{instance.pk}', f'author:{instance.author_id}', f'category:{instance.category_id}']
+    previous = instance.previous_category_id
+    if previous is not None and previous != instance.category_id:
+        keys.append(f'category:{previous}')  # moved out of it: its popularity dropped
+    bus.publish(*keys)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed_bus(sender, instance, **kwargs):
+    bus.publish(f'review:{instance.pk}', f'recipe:{instance.recipe_id}', _author_key(instance.recipe_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed_bus(sender, instance, **kwargs):
+    bus.publish(f'category:{instance.pk}')
+
+
+@receiver(post_save, sender=Favourite)
+@receiver(post_delete, sender=Favourite)
+def favourite_changed_bus(sender, instance, **kwargs):
+    bus.publish(f'recipe:{instance.recipe_id}', f'user:{instance.user_id}', _author_key(instance.recipe_id))
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_changed_bus(sender, instance, **kwargs):
+    bus.publish(f'token:{instance.user_id}', f'user:{instance.user_id}')
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed_bus(sender, instance, **kwargs):
+    bus.publish(f'user:{instance.pk}')
+
+
+# Sitemap chunks and feeds
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed_sitemap(sender, instance, **kwargs):
+    sitemaps.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def category_saved_feeds(sender, instance, **kwargs):
+    sitemaps.invalidate_feeds()
+
+
+# Trigram index for fuzzy search
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved_trigrams(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'category'} & set(update_fields):
+        trigram.index_recipes([instance])
+
+
+@receiver(post_save, sender=Category)
+def category_saved_trigrams(sender, instance, created, **kwargs):
+    if not created:
+        trigram.reindex_category(instance.pk)
+
+
+# Similar recipes: a renamed category changes its recipes' vectors, so drop
+# them and let the next `compute_similar_recipes` run rebuild those
+
+@receiver(post_save, sender=Category)
+def category_saved_vectors(sender, instance, created, **kwargs):
+    if not created:
+        RecipeVector.objects.filter(recipe__category=instance).delete()
+
+
+# Live updates for the SSE streams, sent once the write has committed
+
+def _rating(recipe_id):
+    return Recipe.objects.filter(pk=recipe_id).values('rating_avg', 'rating_count').first() or {}
+
+
+@receiver(post_save, sender=Review)
+def review_saved_events(sender, instance, created, **kwargs):
+    if not created:
+        return
+    review = {'id': instance.pk, 'user': str(instance.user), 'comment': instance.comment,
+              'rating': instance.rating, 'created_date': str(instance.created_date)}
+    transaction.on_commit(lambda: events.publish(events.recipe_channel(instance.recipe_id), {
+        'type': 'review.created', 'recipe': instance.recipe_id, 'review': review, **_rating(instance.recipe_id),
+    }))
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted_events(sender, instance, **kwargs):
+    review_id, recipe_id = instance.pk, instance.recipe_id
+    transaction.on_commit(lambda: events.publish(events.recipe_channel(recipe_id), {
+        'type': 'review.deleted', 'recipe': recipe_id, 'review': review_id, **_rating(recipe_id),
+    }))
+
+
+def _favourite_events(instance, kind):
+    recipe_id, user_id = instance.recipe_id, instance.user_id
+
+    def send():
+        count = Favourite.objects.filter(recipe=recipe_id).count()
+        events.publish(events.recipe_channel(recipe_id), {'type': 'favourites', 'recipe': recipe_id, 'count': count})
+        events.publish(events.user_channel(user_id), {'type': kind, 'recipe': recipe_id})
+    transaction.on_commit(send)
+
+
+@receiver(post_save, sender=Favourite)
+def favourite_saved_events(sender, instance, created, **kwargs):
+    if created:
+        _favourite_events(instance, 'favourite.added')
+
+
+@receiver(post_delete, sender=Favourite)
+def favourite_deleted_events(sender, instance, **kwargs):
+    _favourite_events(instance, 'favourite.removed')
+
+
+# Bulk recipe writes (blog/bulk.py) call this once per batch instead of sending
+# post_save per row. It is the batched form of the Recipe post_save receivers
+# above, so keep the two in step.
+
+def recipes_written(recipes, created, update_fields=None):
+    if not recipes:
+        return
+    moved_from = set()
+    for recipe in recipes:
+        # Same value Recipe.save leaves for the receivers; bulk updates load the
+        # rows first, so this reads the stored category without a query
+        previous = recipe.previous_category_id = None if created else recipe.stored_category_id()
+        if previous is not None and previous != recipe.category_id:
+            moved_from.add(previous)
+        recipe._loaded_category_id = recipe.category_id
+        if autocomplete_index.loaded:
+            autocomplete_index.update_recipe(recipe)
+            if created:
+                autocomplete_index.adjust_popularity('category', recipe.category_id, 1)
+            elif previous is not None and previous != recipe.category_id:
+                autocomplete_index.adjust_popularity('category', previous, -1)
+                autocomplete_index.adjust_popularity('category', recipe.category_id, 1)
+
+    record_changes(recipes, ChangeLog.UPSERT)
+    if created or moved_from:
+        counters.recount(moved_from | {recipe.category_id for recipe in recipes})
+
+    keys = []
+    for recipe in recipes:
+        keys += [f'recipe:{recipe.pk}', f'author:{recipe.author_id}', f'category:{recipe.category_id}']
+    bus.publish(*keys, *(f'category:{category_id}' for category_id in moved_from))
+    sitemaps.invalidate(*(recipe.pk for recipe in recipes))
+    if update_fields is None or {'title', 'category'} & set(update_fields):
+        trigram.index_recipes(recipes)
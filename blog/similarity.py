@@ -0,0 +1,193 @@
+import hashlib
+import re
+import zlib
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .models import Recipe, RecipeVector, SimilarRecipe, SimilarityState
+
+_WORDS = re.compile(r'[a-z]{2,}')
+
+TITLE_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.5
+INGREDIENT_WEIGHT = 1.0
+
+SOURCE_FIELDS = ('title', 'category__title', 'ingredients_text')
+
+
+def tokenize(text):
+    return _WORDS.findall((text or '').lower())
+
+
+def hashed_vector(row, dim):
+    """
+    Hash the title, category and ingredient words of a recipe into a dense
+    `dim`-sized vector (signed feature hashing, log-scaled term frequencies).
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for text, weight in ((row['title'], TITLE_WEIGHT),
+                         (row['category__title'], CATEGORY_WEIGHT),
+                         (row['ingredients_text'], INGREDIENT_WEIGHT)):
+        for token in tokenize(text):
+            h = zlib.crc32(token.encode())
+            vector[h % dim] += weight if h & 0x80000000 else -weight
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def source_hash(row):
+    return hashlib.sha1('\x1f'.join(row[field] or '' for field in SOURCE_FIELDS).encode()).hexdigest()
+
+
+def refresh_vectors(dim, since=None, batch_size=2000):
+    """
+    Recompute the stored vectors of recipes edited since `since` (and of any
+    without one); with since=None, of every recipe. A recipe whose title,
+    category and ingredients hash the same as before keeps its vector.
+    Returns the ids whose vector changed.
+    """
+    rows = Recipe.objects.order_by('id').values('id', *SOURCE_FIELDS)
+    if since is not None:
+        rows = rows.filter(Q(updated_at__gte=since) | Q(feature_vector__isnull=True))
+    changed, batch = [], []
+
+    def flush():
+        stored = {} if since is None else dict(
+            RecipeVector.objects.filter(recipe_id__in=[row['id'] for row in batch])
+                                .values_list('recipe_id', 'source_hash'))
+        objs = []
+        for row in batch:
+            digest = source_hash(row)
+            if stored.get(row['id']) == digest:
+                continue
+            vector = hashed_vector(row, dim)
+            nonzero = np.flatnonzero(vector).astype(np.int32)
+            objs.append(RecipeVector(recipe_id=row['id'], source_hash=digest, indexes=nonzero.tobytes(),
+                                     weights=vector[nonzero].tobytes()))
+            changed.append(row['id'])
+        RecipeVector.objects.bulk_create(objs, batch_size=batch_size, update_conflicts=True,
+                                         unique_fields=['recipe'],
+                                         update_fields=['source_hash', 'indexes', 'weights'])
+        batch.clear()
+
+    for row in rows.iterator(chunk_size=batch_size):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return changed
+
+
+def build_matrix(dim):
+    # Dense matrix of the stored vectors; nothing is re-tokenized here
+    ids, entries = [], []
+    stored = RecipeVector.objects.order_by('recipe_id').values_list('recipe_id', 'indexes', 'weights')
+    for recipe_id, indexes, weights in stored.iterator(chunk_size=2000):
+        ids.append(recipe_id)
+        entries.append((np.frombuffer(indexes, dtype=np.int32), np.frombuffer(weights, dtype=np.float32)))
+    matrix = np.zeros((len(ids), dim), dtype=np.float32)
+    for i, (indexes, weights) in enumerate(entries):
+        matrix[i, indexes] = weights
+    return np.array(ids, dtype=np.int64), matrix
+
+
+def top_k(matrix, rows, k, block_size):
+    """
+    Yield (row index, neighbour indexes, scores) for each index in `rows`,
+    computing cosine similarities one block of rows at a time.
+    """
+    k = min(k, len(matrix) - 1)
+    if k <= 0:
+        return
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        sims = matrix[block] @ matrix.T
+        sims[np.arange(len(block)), block] = -np.inf  # never your own neighbour
+        best = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(sims, best, axis=1)
+        order = np.argsort(-best_scores, axis=1)
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        for i, row in enumerate(block):
+            yield row, best[i], best_scores[i]
+
+
+def _affected_rows(ids, matrix, changed, k, block_size):
+    """
+    Rows whose stored neighbour list may be wrong after `changed` rows were
+    added or edited: the changed rows themselves, rows that list a changed
+    recipe, rows with short lists (a neighbour was deleted), and rows for which
+    a changed recipe now beats their current k-th neighbour.
+    """
+    position = {recipe_id: i for i, recipe_id in enumerate(ids.tolist())}
+    changed_ids = ids[changed].tolist()
+    affected = set(changed.tolist())
+
+    listing_changed = SimilarRecipe.objects.filter(similar_id__in=changed_ids) \
+                                           .values_list('recipe_id', flat=True).distinct()
+    affected.update(position[r] for r in listing_changed if r in position)
+
+    expected = min(k, len(ids) - 1)
+    worst, counts = {}, {}
+    stats = SimilarRecipe.objects.values('recipe_id').annotate(count=Count('id'), worst=Min('score'))
+    for row in stats.iterator():
+        worst[row['recipe_id']] = row['worst']
+        counts[row['recipe_id']] = row['count']
+    for recipe_id, i in position.items():
+        if counts.get(recipe_id, 0) < expected:
+            affected.add(i)
+
+    if len(changed):
+        threshold = np.array([worst.get(recipe_id, -np.inf) for recipe_id in ids.tolist()], dtype=np.float32)
+        for start in range(0, len(ids), block_size):
+            sims = matrix[start:start + block_size] @ matrix[changed].T
+            beats = (sims > threshold[start:start + block_size, None]).any(axis=1)
+            affected.update((np.nonzero(beats)[0] + start).tolist())
+    return np.array(sorted(affected), dtype=np.int64)
+
+
+def compute_similar_recipes(k=10, dim=1024, block_size=256, full=False):
+    """
+    Refresh the stored neighbour lists. Unless `full` is set (or k/dim
+    changed), only recipes whose content changed since the previous run are
+    re-hashed, and only their lists and the lists they can influence are
+    recomputed. Returns the number of lists written.
+    """
+    started = timezone.now()
+    state, _ = SimilarityState.objects.get_or_create(pk=1, defaults={'k': k, 'dim': dim})
+    full = full or state.refreshed_at is None or state.k != k or state.dim != dim
+
+    changed_ids = set(refresh_vectors(dim, since=None if full else state.refreshed_at))
+    ids, matrix = build_matrix(dim)
+    if full:
+        rows = np.arange(len(ids))
+    else:
+        changed = np.array([i for i, recipe_id in enumerate(ids.tolist()) if recipe_id in changed_ids],
+                           dtype=np.int64)
+        rows = _affected_rows(ids, matrix, changed, k, block_size)
+
+    written = 0
+    with transaction.atomic():
+        if full:
+            SimilarRecipe.objects.all().delete()
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            block_ids = ids[block].tolist()
+            if not full:
+                SimilarRecipe.objects.filter(recipe_id__in=block_ids).delete()
+            objs = [
+                SimilarRecipe(recipe_id=int(ids[row]), similar_id=int(ids[n]), score=float(score), rank=rank)
+                for row, neighbours, scores in top_k(matrix, block, k, block_size)
+                for rank, (n, score) in enumerate(zip(neighbours, scores))
+            ]
+            SimilarRecipe.objects.bulk_create(objs, batch_size=2000)
+            written += len(block_ids)
+        state.refreshed_at = started
+        state.k, state.dim = k, dim
+        state.save()
+    return written
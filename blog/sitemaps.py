@@ -0,0 +1,139 @@
+"""
+Sitemaps and feeds for crawlers, so they stop paging through /api/recipes/.
+
+/api/sitemap.xml lists one sitemap per block of SITEMAP_CHUNK_SIZE recipe ids.
+Blocks are id ranges rather than pages, so a recipe always stays in the same
+chunk, and an edit only invalidates that chunk's cache entry. A chunk is
+streamed straight from an .iterator() over (slug, updated_at) rows and kept
+in the cache for the next crawler. /api/feed/rss/ and /api/feed/atom/ carry
+the latest FEED_SIZE recipes.
+
+Rendered XML is kept in a process-local LocalCache. Invalidations go over
+the bus (blog/invalidation.py), so every worker drops its copy.
+"""
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import F, Max, Value
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import feedgenerator
+from django.views.decorators.http import require_safe
+
+from .invalidation import LocalCache, bus
+from .models import Recipe
+
+# The sitemap protocol allows 50,000 URLs / 50 MB per file
+MAX_URLS = 50000
+FEED_SIZE = 50
+XML = 'application/xml; charset=utf-8'
+INDEX_KEY = 'sitemap:index'
+FEED_KEY = 'sitemap:feed:{}'
+
+
+def chunk_size():
+    return min(getattr(settings, 'SITEMAP_CHUNK_SIZE', 10000), MAX_URLS)
+
+
+def chunk_key(chunk):
+    return f'sitemap:chunk:{chunk}'
+
+
+def recipe_url(slug):
+    return settings.RECIPE_PUBLIC_URL.format(slug=slug)
+
+
+def _timeout():
+    return getattr(settings, 'SITEMAP_CACHE_SECONDS', 3600)
+
+
+cache = LocalCache('sitemap:', timeout=_timeout(), max_entries=256)
+
+
+def invalidate(*recipe_ids):
+    chunk_keys = {chunk_key(recipe_id // chunk_size()) for recipe_id in recipe_ids}
+    bus.publish(INDEX_KEY, *chunk_keys, FEED_KEY.format('rss'), FEED_KEY.format('atom'))
+
+
+def invalidate_feeds():
+    bus.publish(FEED_KEY.format('rss'), FEED_KEY.format('atom'))
+
+
+def chunks():
+    """[(chunk number, last modified)] for every non-empty id block, from one grouped query."""
+    rows = cache.get(INDEX_KEY)
+    if rows is None:
+        generation = cache.generation
+        rows = list(Recipe.objects.order_by()
+                    .annotate(chunk=F('pk') / Value(chunk_size()))
+                    .values('chunk').annotate(lastmod=Max('updated_at'))
+                    .order_by('chunk').values_list('chunk', 'lastmod'))
+        cache.set(INDEX_KEY, rows, generation=generation)
+    return rows
+
+
+@require_safe
+def sitemap_index(request):
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    for chunk, lastmod in chunks():
+        location = request.build_absolute_uri(reverse('sitemap-chunk', args=[chunk]))
+        parts.append(f'<sitemap><loc>{escape(location)}</loc><lastmod>{lastmod.isoformat()}</lastmod></sitemap>\n')
+    parts.append('</sitemapindex>\n')
+    return HttpResponse(''.join(parts), content_type=XML)
+
+
+def _render_chunk(chunk, size):
+    # Fills the cache once the whole chunk has been sent, unless an invalidation
+    # arrived meanwhile (the XML may predate it)
+    generation = cache.generation
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    yield parts[0]
+    rows = Recipe.objects.filter(pk__gte=chunk * size, pk__lt=(chunk + 1) * size) \
+                         .order_by('pk').values_list('slug', 'updated_at')
+    for slug, updated_at in rows.iterator(chunk_size=2000):
+        part = f'<url><loc>{escape(recipe_url(slug))}</loc><lastmod>{updated_at.isoformat()}</lastmod></url>\n'
+        parts.append(part)
+        yield part
+    parts.append('</urlset>\n')
+    yield parts[-1]
+    cache.set(chunk_key(chunk), ''.join(parts).encode(), generation=generation)
+
+
+@require_safe
+def sitemap_chunk(request, chunk):
+    cached = cache.get(chunk_key(chunk))
+    if cached is not None:
+        return HttpResponse(cached, content_type=XML)
+    size = chunk_size()
+    if not Recipe.objects.filter(pk__gte=chunk * size, pk__lt=(chunk + 1) * size).exists():
+        raise Http404("No such sitemap.")
+    return StreamingHttpResponse(_render_chunk(chunk, size), content_type=XML)
+
+
+FEEDS = {'rss': feedgenerator.Rss201rev2Feed, 'atom': feedgenerator.Atom1Feed}
+
+
+@require_safe
+def latest_feed(request, kind):
+    feed_class = FEEDS.get(kind)
+    if feed_class is None:
+        raise Http404("No such feed.")
+    body = cache.get(FEED_KEY.format(kind))
+    if body is None:
+        generation = cache.generation
+        feed = feed_class(title="Latest recipes", link=settings.RECIPE_PUBLIC_URL.split('?')[0].rsplit('/', 1)[0] + '/',
+                          description="The newest recipes.", language='en',
+                          feed_url=request.build_absolute_uri())
+        rows = Recipe.objects.order_by('-created_at', '-pk') \
+                             .values('title', 'slug', 'created_at', 'updated_at', 'author__username',
+                                     'category__title')[:FEED_SIZE]
+        for row in rows.iterator():
+            feed.add_item(title=row['title'], link=recipe_url(row['slug']), description='',
+                          unique_id=recipe_url(row['slug']), author_name=row['author__username'],
+                          pubdate=row['created_at'], updateddate=row['updated_at'],
+                          categories=[row['category__title']])
+        body = feed.writeString('utf-8').encode()
+        cache.set(FEED_KEY.format(kind), body, generation=generation)
+    return HttpResponse(body, content_type=f'{feed_class.content_type.split(";")[0]}; charset=utf-8')
@@ -1,6 +1,7 @@
 import random
 import string
 
+from django.db.models import Q
 from django.utils.text import slugify
 
 
@@ -21,3 +22,24 @@ def generate_unique_slug(instance, base_title, new_slug=None, update=False):
         return generate_unique_slug(instance, base_title, new_slug=new_slug, update=update)
 
     return slug
+
+
+def generate_unique_slugs(model, titles, exclude_pks=()):
+    # Batch version of generate_unique_slug: one query for every title in the batch
+    bases = [slugify(title) for title in titles]
+    lookup = Q()
+    for base in set(bases) - {''}:
+        lookup |= Q(slug__startswith=base)
+    taken = set()
+    if lookup:
+        taken.update(model.objects.filter(lookup).exclude(pk__in=exclude_pks).values_list('slug', flat=True))
+
+    slugs = []
+    for base in bases:
+        slug = base
+        while slug in taken:
+            random_string = "".join(random.choices(string.ascii_lowercase, k=4))
+            slug = f"{base}-{random_string}"
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from RecipeApi import metrics
+
+from .invalidation import LocalCache
+
+from .models import Favourite, Recipe, Review
+
+
+# Per-process; any worker's write to an author's recipes, reviews or
+# favourites publishes author:<id> on the invalidation bus (blog/signals.py)
+cache = LocalCache('author:', timeout=getattr(settings, 'AUTHOR_STATS_CACHE_SECONDS', 600))
+
+
+def cache_key(author_id):
+    return f'author:{author_id}'
+
+
+def _per_recipe(queryset, aggregate):
+    # Correlated subquery: one aggregate value per recipe row of the outer query
+    rows = queryset.filter(recipe=OuterRef('pk')).order_by().values('recipe').annotate(value=aggregate)
+    return Coalesce(Subquery(rows.values('value'), output_field=IntegerField()), 0)
+
+
+def compute_author_stats(author_id):
+    """Totals and per-category breakdown for one author, in a single grouped query."""
+    rows = Recipe.objects.filter(author_id=author_id) \
+                         .values('category_id', 'category__title') \
+                         .annotate(recipes=Count('id'),
+                                   reviews=Sum(_per_recipe(Review.objects, Count('id'))),
+                                   rated=Sum(_per_recipe(Review.objects, Count('rating'))),
+                                   rating_sum=Sum(_per_recipe(Review.objects, Sum('rating'))),
+                                   favourites=Sum(_per_recipe(Favourite.objects, Count('id')))) \
+                         .order_by('category__title')
+
+    def average(rating_sum, rated):
+        return round(rating_sum / rated, 2) if rated else None
+
+    categories, totals = [], {'recipes': 0, 'reviews': 0, 'rated': 0, 'rating_sum': 0, 'favourites': 0}
+    for row in rows:
+        for key in totals:
+            totals[key] += row[key] or 0
+        categories.append({
+            'id': row['category_id'],
+            'title': row['category__title'],
+            'recipes': row['recipes'],
+            'reviews': row['reviews'] or 0,
+            'average_rating': average(row['rating_sum'] or 0, row['rated'] or 0),
+            'favourites': row['favourites'] or 0,
+        })
+    return {
+        'total_recipes': totals['recipes'],
+        'reviews_received': totals['reviews'],
+        'average_rating': average(totals['rating_sum'], totals['rated']),
+        'favourites_received': totals['favourites'],
+        'categories': categories,
+    }
+
+
+def author_stats(author_id):
+    key = cache_key(author_id)
+    stats = cache.get(key)
+    metrics.inc('cache_requests_total', cache='author-stats', result='miss' if stats is None else 'hit')
+    if stats is None:
+        generation = cache.generation
+        stats = compute_author_stats(author_id)
+        cache.set(key, stats, generation=generation)  # unless a write landed while computing
+    return stats
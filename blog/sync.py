@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+
+from .models import Category, ChangeLog, Favourite, Recipe, Review, SyncState
+from .serializers import CategorySerializer, SyncFavouriteSerializer, SyncRecipeSerializer, SyncReviewSerializer
+
+# model name in the log -> (queryset, serializer, key in the response). Recipe
+# rating and favourite counts are not synced: clients work them out from the
+# synced reviews and favourites. Category counters are, see record_updates.
+SYNCED = {
+    'category': (lambda: Category.objects.all(), CategorySerializer, 'categories'),
+    'recipe': (lambda: Recipe.objects.select_related('author'), SyncRecipeSerializer, 'recipes'),
+    'review': (lambda: Review.objects.select_related('user'), SyncReviewSerializer, 'reviews'),
+    'favourite': (lambda: Favourite.objects.all(), SyncFavouriteSerializer, 'favourites'),
+}
+
+
+def record_change(instance, action, owner_id=None, tombstone=None):
+    ChangeLog.objects.create(model=instance._meta.model_name, object_id=instance.pk, action=action,
+                             owner_id=owner_id, tombstone=tombstone)
+
+
+def record_changes(instances, action):
+    # One INSERT for a batch of public rows (bulk recipe writes)
+    ChangeLog.objects.bulk_create([ChangeLog(model=instance._meta.model_name, object_id=instance.pk, action=action)
+                                   for instance in instances])
+
+
+def record_updates(model, ids):
+    # Rows changed through queryset.update(), which sends no post_save (the
+    # category counters maintained by blog/counters.py)
+    ChangeLog.objects.bulk_create([ChangeLog(model=model._meta.model_name, object_id=pk, action=ChangeLog.UPSERT)
+                                   for pk in ids])
+
+
+def max_batch():
+    return getattr(settings, 'SYNC_MAX_BATCH', 500)
+
+
+class CursorExpired(Exception):
+    pass
+
+
+def changes_since(user, since, limit, context=None):
+    """
+    Return one batch of changes after `since`: the live rows for every object
+    created or modified, and tombstones for deleted ones. Several entries for
+    the same object inside a batch collapse into the latest one.
+    """
+    visible = Q(owner_id__isnull=True)
+    if user.is_authenticated:
+        visible |= Q(owner_id=user.pk)
+
+    # From 0 the compacted log is a full snapshot: every live row still has its
+    # latest upsert, and a new client has no use for tombstones
+    if since:
+        pruned_through = SyncState.objects.filter(pk=1).values_list('pruned_through', flat=True).first() or 0
+        if since < pruned_through:
+            raise CursorExpired()
+
+    entries = list(ChangeLog.objects.filter(visible, id__gt=since).order_by('id')
+                   .values('id', 'model', 'object_id', 'action', 'tombstone')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        latest[(entry['model'], entry['object_id'])] = entry
+
+    upserts = {name: [] for name in SYNCED}
+    deleted = {key: [] for _, _, key in SYNCED.values()}
+    for (name, object_id), entry in latest.items():
+        if name not in SYNCED:
+            continue
+        if entry['action'] == ChangeLog.DELETE:
+            deleted[SYNCED[name][2]].append(dict(entry['tombstone'] or {}, id=object_id))
+        else:
+            upserts[name].append(object_id)
+
+    changes = {}
+    for name, (queryset, serializer_class, key) in SYNCED.items():
+        # Objects deleted after this batch are skipped; their tombstone comes in a later batch
+        rows = queryset().filter(pk__in=upserts[name]).order_by('pk') if upserts[name] else []
+        changes[key] = serializer_class(rows, many=True, context=context).data
+
+    return {
+        'cursor': entries[-1]['id'] if entries else since,
+        'has_more': has_more,
+        'changes': changes,
+        'deleted': deleted,
+    }
+
+
+def compact(before):
+    """
+    Shrink the log without losing state: drop every entry a later entry for
+    the same object supersedes, and tombstones created before `before`.
+    Returns (superseded, tombstones) deleted.
+    """
+    later = ChangeLog.objects.filter(model=OuterRef('model'), object_id=OuterRef('object_id'), id__gt=OuterRef('id'))
+    with transaction.atomic():
+        superseded, _ = ChangeLog.objects.filter(Exists(later)).delete()
+        expired = ChangeLog.objects.filter(action=ChangeLog.DELETE, created_at__lt=before)
+        last_id = expired.aggregate(last=Max('id'))['last']
+        tombstones = 0
+        if last_id is not None:
+            state, _ = SyncState.objects.select_for_update().get_or_create(pk=1)
+            state.pruned_through = max(state.pruned_through, last_id)
+            state.save()
+            tombstones, _ = expired.filter(id__lte=last_id).delete()
+    return superseded, tombstones
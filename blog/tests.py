@@ -1,3 +1,1472 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.core import signing
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from RecipeApi import metrics, overload
+from RecipeApi.compression import negotiate
+from RecipeApi.storage import ContentHashedStorage, content_hash
+from user_account.models import CustomUser
+
+from . import events, sanitize, sitemaps, stats, trigram
+from .autocomplete import autocomplete_index
+from .management.commands.startup_benchmark import parse_importtime
+from .invalidation import LocalCache, bus
+from .paginator import EstimatedCountPaginator
+from .models import (Category, ChangeLog, Favourite, Invalidation, Recipe, RecipeTrigram, RecipeVector, Review, TrendingRetraction,
+                     TrendingScore)
+from .counters import reconcile
+from .sync import compact
+from .similarity import compute_similar_recipes
+from .trending import refresh_trending
+
+
+def make_user(name, **extra):
+    return CustomUser.objects.create_user(email=f'{name}@example.com', username=name, password='pass', **extra)
+
+
+def make_recipe(author, category, title, **extra):
+    fields = {'instructions': '<p>Cook</p>', 'ingredients': '<p>Chicken</p>',
+              'prep_time': 10, 'cook_time': 20, 'servings': 4, **extra}
+    return Recipe.objects.create(author=author, category=category, title=title, **fields)
+
+
+def token_client(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.get_or_create(user=user)[0].key)
+    return client
+
+
+# Query counts must not grow with the number of rows on a page (no N+1). Each
+# test measures an endpoint, adds more recipes, reviews and favourites, and
+# measures again.
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryCountTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title='Dinner')
+        self.owner = make_user('owner')
+        self.reader = make_user('reader')
+        self.client = APIClient()
+        self.auth = token_client(self.reader)
+        self.count = 0
+        self.add_recipes(1)
+
+    def add_recipes(self, number):
+        for _ in range(number):
+            self.count += 1
+            author = make_user(f'author{self.count}')
+            recipe = make_recipe(author, self.category, f'Chicken curry {self.count}')
+            for reviewer in (make_user(f'reviewer{self.count}a'), make_user(f'reviewer{self.count}b')):
+                Review.objects.create(user=reviewer, recipe=recipe, comment='Tasty', rating=4)
+            Favourite.objects.create(user=self.reader, recipe=recipe)
+            if self.count % 2:
+                recipe.author = self.owner
+                recipe.save()
+        return recipe
+
+    def queries(self, client, url):
+        cache.clear()  # measure the database work, not a cached response
+        bus.poll()  # and not the invalidation bus catching up
+        with CaptureQueriesContext(connection) as captured:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return len(captured)
+
+    def assertConstantQueries(self, url, client=None):
+        client = client or self.client
+        self.queries(client, url)  # warm up per-process state (autocomplete, bus position)
+        before = self.queries(client, url)
+        self.add_recipes(8)
+        self.assertEqual(self.queries(client, url), before, url)
+
+    def test_home(self):
+        self.assertConstantQueries('/api/home/')
+        self.assertConstantQueries('/api/home/', self.auth)
+
+    def test_recipe_list(self):
+        self.assertConstantQueries('/api/recipes/?page_size=50')
+        self.assertConstantQueries('/api/recipes/?page_size=50', self.auth)
+
+    def test_recipe_list_page_size(self):
+        self.add_recipes(10)
+        self.assertEqual(self.queries(self.auth, '/api/recipes/?page_size=1'),
+                         self.queries(self.auth, '/api/recipes/?page_size=10'))
+
+    def test_category_filter(self):
+        self.assertConstantQueries(f'/api/filter/?category={self.category.pk}&page_size=50', self.auth)
+
+    def test_search(self):
+        self.assertConstantQueries('/api/search/?search=chicken&page_size=50', self.auth)
+
+    def test_fuzzy_search(self):
+        self.assertConstantQueries('/api/search/?search=chiken%20cury&mode=fuzzy&page_size=50', self.auth)
+
+    def test_recipe_detail(self):
+        recipe = Recipe.objects.first()
+        url = f'/api/recipe-detail/{recipe.slug}/'
+        before = self.queries(self.auth, url)
+        for number in range(5):
+            Review.objects.create(user=make_user(f'extra{number}'), recipe=recipe, comment='More', rating=5)
+        self.assertEqual(self.queries(self.auth, url), before)
+
+    def test_favourite_list(self):
+        self.assertConstantQueries('/api/favourite-list/', self.auth)
+
+    def test_my_recipes(self):
+        self.assertConstantQueries('/api/my-recipes/', token_client(self.owner))
+
+    def test_facets(self):
+        self.assertConstantQueries('/api/recipes/facets/?page_size=50')
+
+    def test_categories(self):
+        before = self.queries(self.client, '/api/categories/')
+        for number in range(5):
+            Category.objects.create(title=f'Extra {number}')
+        self.assertEqual(self.queries(self.client, '/api/categories/'), before)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AutocompleteTests(TestCase):
+
+    def setUp(self):
+        autocomplete_index.clear()
+        self.addCleanup(autocomplete_index.clear)
+        self.author = make_user('author')
+        self.dinner = Category.objects.create(title='Dinner')
+        self.dessert = Category.objects.create(title='Dessert')
+
+    def suggest(self, query):
+        response = self.client.get('/api/autocomplete/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [(item['type'], item['text']) for item in response.json()['results']]
+
+    def test_ranked_by_popularity(self):
+        make_recipe(self.author, self.dinner, 'Chicken soup')
+        curry = make_recipe(self.author, self.dinner, 'Chicken curry')
+        for number in range(2):
+            Favourite.objects.create(user=make_user(f'fan{number}'), recipe=curry)
+        # The word "chicken" is in two titles, as popular as the curry: recipes win ties
+        self.assertEqual(self.suggest('chi'),
+                         [('recipe', 'Chicken curry'), ('term', 'chicken'), ('recipe', 'Chicken soup')])
+
+    def test_accents_and_punctuation_ignored(self):
+        make_recipe(self.author, self.dessert, 'Crème brûlée!')
+        self.assertIn(('recipe', 'Crème brûlée!'), self.suggest('creme br'))
+        self.assertEqual(self.suggest('!!'), [])
+
+    def test_updated_after_writes(self):
+        recipe = make_recipe(self.author, self.dinner, 'Chicken curry')
+        self.suggest('chi')  # loads the index
+        recipe.title = 'Lamb curry'
+        recipe.save()
+        self.assertNotIn(('recipe', 'Chicken curry'), self.suggest('chi'))
+        self.assertIn(('recipe', 'Lamb curry'), self.suggest('lam'))
+        recipe.delete()
+        self.assertEqual(self.suggest('lam'), [])
+
+    def test_refresh_from_bus(self):
+        recipe = make_recipe(self.author, self.dinner, 'Chicken curry')
+        self.suggest('chi')
+        # As written by another worker: no signals here, only the bus key
+        Recipe.objects.filter(pk=recipe.pk).update(title='Beef stew')
+        autocomplete_index.refresh(f'recipe:{recipe.pk}')
+        self.assertEqual(self.suggest('chi'), [])
+        self.assertIn(('recipe', 'Beef stew'), self.suggest('bee'))
+
+    def test_category_move(self):
+        recipe = make_recipe(self.author, self.dinner, 'Apple pie')
+        make_recipe(self.author, self.dinner, 'Apple crumble')
+        self.suggest('d')
+        # An instance that was never loaded from the database
+        moved = Recipe(pk=recipe.pk, author=self.author, category=self.dessert, title='Apple pie',
+                       instructions='<p>Bake</p>', ingredients='<p>Apples</p>',
+                       prep_time=10, cook_time=40, servings=6, created_at=recipe.created_at)
+        moved.save()
+        self.assertEqual(self.suggest('d'), [('category', 'Dinner'), ('category', 'Dessert')])
+        self.assertEqual(Category.objects.get(pk=self.dinner.pk).recipe_count, 1)
+        self.assertEqual(Category.objects.get(pk=self.dessert.pk).recipe_count, 1)
+        # Loaded, then moved back
+        moved = Recipe.objects.get(pk=recipe.pk)
+        moved.category = self.dinner
+        moved.save()
+        self.assertEqual(Category.objects.get(pk=self.dinner.pk).recipe_count, 2)
+        self.assertEqual(Category.objects.get(pk=self.dessert.pk).recipe_count, 0)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class TrendingTests(TestCase):
+
+    def setUp(self):
+        author = make_user('author')
+        category = Category.objects.create(title='Dinner')
+        self.curry = make_recipe(author, category, 'Chicken curry')
+        self.soup = make_recipe(author, category, 'Chicken soup')
+        self.fans = [make_user(f'fan{number}') for number in range(3)]
+
+    def trending(self):
+        response = self.client.get('/api/trending/')
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()]
+
+    def score(self, recipe):
+        return TrendingScore.objects.filter(recipe=recipe).values_list('score', flat=True).first()
+
+    def test_ranked_by_events(self):
+        for fan in self.fans:
+            Favourite.objects.create(user=fan, recipe=self.soup)
+        Review.objects.create(user=self.fans[0], recipe=self.curry, comment='Good', rating=5)
+        self.assertEqual(refresh_trending(), 4)
+        self.assertEqual(self.trending(), ['Chicken soup', 'Chicken curry'])
+        self.assertEqual(refresh_trending(), 0)  # nothing new
+
+    def test_retracted_after_refresh(self):
+        favourites = [Favourite.objects.create(user=fan, recipe=self.curry) for fan in self.fans]
+        refresh_trending()
+        before = self.score(self.curry)
+        favourites[0].delete()
+        self.assertEqual(self.score(self.curry), before)  # queued until the next refresh
+        self.assertEqual(refresh_trending(), 1)
+        self.assertAlmostEqual(self.score(self.curry), before * 2 / 3, places=6)
+        self.assertFalse(TrendingRetraction.objects.exists())
+
+    def test_retracted_before_refresh(self):
+        favourite = Favourite.objects.create(user=self.fans[0], recipe=self.curry)
+        review = Review.objects.create(user=self.fans[0], recipe=self.curry, comment='Good', rating=5)
+        favourite.delete()
+        review.delete()
+        # Never counted, so nothing to subtract, and the retractions are dropped
+        self.assertEqual(refresh_trending(), 0)
+        self.assertIsNone(self.score(self.curry))
+        self.assertFalse(TrendingRetraction.objects.exists())
+        self.assertEqual(self.trending(), [])
+
+    def test_recipe_delete_queues_nothing(self):
+        Favourite.objects.create(user=self.fans[0], recipe=self.curry)
+        refresh_trending()
+        self.curry.delete()
+        self.assertFalse(TrendingRetraction.objects.exists())
+        self.assertEqual(self.trending(), [])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class SimilarRecipesTests(TestCase):
+
+    def setUp(self):
+        author = make_user('author')
+        dinner = Category.objects.create(title='Dinner')
+        dessert = Category.objects.create(title='Dessert')
+        self.curry = make_recipe(author, dinner, 'Chicken curry', ingredients='<p>Chicken, rice, curry paste</p>')
+        self.stew = make_recipe(author, dinner, 'Chicken stew', ingredients='<p>Chicken, carrots, stock</p>')
+        self.cake = make_recipe(author, dessert, 'Chocolate cake', ingredients='<p>Flour, sugar, cocoa</p>')
+        self.tart = make_recipe(author, dessert, 'Chocolate tart', ingredients='<p>Pastry, sugar, cocoa</p>')
+
+    def similar(self, recipe):
+        response = self.client.get(f'/api/recipe-detail/{recipe.slug}/similar/')
+        self.assertEqual(response.status_code, 200)
+        return [item['title'] for item in response.json()]
+
+    def test_nearest_first(self):
+        self.assertEqual(compute_similar_recipes(k=2, dim=256), 4)
+        self.assertEqual(self.similar(self.curry)[0], 'Chicken stew')
+        self.assertEqual(self.similar(self.cake)[0], 'Chocolate tart')
+        self.assertEqual(len(self.similar(self.tart)), 2)
+
+    def test_incremental_run(self):
+        compute_similar_recipes(k=2, dim=256)
+        vectors = dict(RecipeVector.objects.values_list('recipe_id', 'source_hash'))
+        self.curry.servings = 8  # not part of the vector
+        self.curry.save()
+        compute_similar_recipes(k=2, dim=256)
+        self.assertEqual(dict(RecipeVector.objects.values_list('recipe_id', 'source_hash')), vectors)
+
+        self.stew.title = 'Chocolate mousse'
+        self.stew.ingredients = '<p>Cream, sugar, cocoa</p>'
+        self.stew.save()
+        compute_similar_recipes(k=2, dim=256)
+        self.assertNotEqual(RecipeVector.objects.get(recipe=self.stew).source_hash, vectors[self.stew.pk])
+        self.assertIn('Chocolate mousse', self.similar(self.cake))
+
+    def test_category_rename_drops_vectors(self):
+        compute_similar_recipes(k=2, dim=256)
+        category = self.cake.category
+        category.title = 'Sweets'
+        category.save()
+        self.assertFalse(RecipeVector.objects.filter(recipe__category=category).exists())
+        self.assertEqual(RecipeVector.objects.count(), 2)
+
+    def test_single_recipe(self):
+        Recipe.objects.exclude(pk=self.curry.pk).delete()
+        compute_similar_recipes(k=2, dim=256)
+        self.assertEqual(self.similar(self.curry), [])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AdminTests(TestCase):
+
+    def setUp(self):
+        self.admin = make_user('admin', is_staff=True, is_superuser=True)
+        self.client.force_login(self.admin)
+        category = Category.objects.create(title='Dinner')
+        self.curry = make_recipe(self.admin, category, 'Chicken curry')
+        self.spicy = make_recipe(self.admin, category, 'Spicy chicken')
+
+    def titles(self, url, params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(str(obj) for obj in response.context['cl'].result_list)
+
+    def test_recipe_search_is_prefix_or_slug(self):
+        url = '/admin/blog/recipe/'
+        self.assertEqual(self.titles(url, {'q': 'chick'}), ['Chicken curry'])
+        self.assertEqual(self.titles(url, {'q': self.spicy.slug}), ['Spicy chicken'])
+        self.assertEqual(self.titles(url, {'q': 'curry'}), [])
+
+    def test_user_autocomplete(self):
+        response = self.client.get('/admin/autocomplete/', {
+            'app_label': 'blog', 'model_name': 'recipe', 'field_name': 'author', 'term': 'ADM'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['text'] for item in response.json()['results']], [str(self.admin)])
+
+    def test_prefix_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE '%%_prefix'")
+            names = {row[0] for row in cursor.fetchall()}
+        self.assertTrue({'blog_recipe_title_prefix', 'blog_category_title_prefix'} <= names)
+
+    def test_estimated_count(self):
+        self.curry.delete()
+        with mock.patch('blog.paginator.ESTIMATE_THRESHOLD', 1):
+            # Unfiltered: MAX(pk) stands in for COUNT(*) without planner statistics
+            self.assertEqual(EstimatedCountPaginator(Recipe.objects.all(), 10).count, self.spicy.pk)
+            self.assertEqual(EstimatedCountPaginator(Recipe.objects.filter(title__startswith='S'), 10).count, 1)
+        self.assertEqual(EstimatedCountPaginator(Recipe.objects.all(), 10).count, 1)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkRecipeTests(TestCase):
+    url = '/api/my-recipes/bulk/'
+
+    def setUp(self):
+        self.author = make_user('author')
+        self.api = token_client(self.author)
+        self.dinner = Category.objects.create(title='Dinner')
+        self.dessert = Category.objects.create(title='Dessert')
+
+    def item(self, title, category=None, **extra):
+        return {'title': title, 'category': (category or self.dinner).pk, 'prep_time': 5, 'cook_time': 10,
+                'servings': 2, 'ingredients': '<p>Eggs</p>', 'instructions': '<p>Whisk</p>', **extra}
+
+    def count(self, category):
+        return Category.objects.get(pk=category.pk).recipe_count
+
+    def test_create(self):
+        response = self.api.post(self.url, [self.item('Omelette'), self.item('Omelette')], format='json')
+        self.assertEqual(response.status_code, 201)
+        slugs = [result['slug'] for result in response.json()['results']]
+        self.assertEqual(len(set(slugs)), 2)
+        recipe = Recipe.objects.get(slug=slugs[0])
+        self.assertEqual((recipe.author, recipe.ingredients_text), (self.author, 'Eggs'))
+        self.assertEqual(self.count(self.dinner), 2)
+        self.assertEqual(ChangeLog.objects.filter(model='recipe', action=ChangeLog.UPSERT).count(), 2)
+
+    def test_create_partly_invalid(self):
+        response = self.api.post(self.url, [self.item('Omelette'), self.item('', category=self.dessert),
+                                            {**self.item('Pancakes'), 'category': 999}], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']], [201, 400, 400])
+        self.assertIn('category', response.json()['results'][2]['errors'])
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_batch_limits(self):
+        self.assertEqual(self.api.post(self.url, [], format='json').status_code, 400)
+        self.assertEqual(self.api.post(self.url, {'title': 'x'}, format='json').status_code, 400)
+        with self.settings(BULK_MAX_ITEMS=2):
+            response = self.api.post(self.url, [self.item(f'Dish {n}') for n in range(3)], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(APIClient().post(self.url, [self.item('Omelette')], format='json').status_code, 401)
+
+    def test_update(self):
+        omelette = make_recipe(self.author, self.dinner, 'Omelette')
+        pancakes = make_recipe(self.author, self.dinner, 'Pancakes')
+        other = make_recipe(make_user('other'), self.dinner, 'Not mine')
+        response = self.api.patch(self.url, [
+            {'id': omelette.pk, 'title': 'Cheese omelette', 'ingredients': '<p>Eggs, cheese</p>'},
+            {'slug': pancakes.slug, 'category': self.dessert.pk},
+            {'slug': omelette.slug, 'servings': 9},  # same recipe as the first item
+            {'id': other.pk, 'title': 'Mine now'},
+            {'title': 'No lookup'},
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']], [200, 200, 400, 404, 400])
+        omelette.refresh_from_db()
+        self.assertEqual((omelette.title, omelette.slug, omelette.ingredients_text, omelette.servings),
+                         ('Cheese omelette', 'cheese-omelette', 'Eggs, cheese', 4))
+        self.assertEqual(Recipe.objects.get(pk=other.pk).title, 'Not mine')
+        self.assertEqual((self.count(self.dinner), self.count(self.dessert)), (2, 1))
+
+    def test_delete(self):
+        omelette = make_recipe(self.author, self.dinner, 'Omelette')
+        other = make_recipe(make_user('other'), self.dinner, 'Not mine')
+        response = self.api.delete(self.url, {'ids': [omelette.pk, other.pk], 'slugs': ['missing']}, format='json')
+        self.assertEqual(response.json(), {'deleted': [omelette.pk], 'missing': [other.pk, 'missing']})
+        self.assertEqual(self.count(self.dinner), 1)
+        self.assertEqual(self.api.delete(self.url, {'ids': ['x']}, format='json').status_code, 400)
+
+    def test_constant_queries(self):
+        def queries(size):
+            items = [self.item(f'Dish {size} {n}') for n in range(size)]
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.api.post(self.url, items, format='json').status_code, 201)
+            return len(captured)
+        self.assertEqual(queries(1), queries(10))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ChangesTests(TestCase):
+
+    def setUp(self):
+        self.author = make_user('author')
+        self.reader = make_user('reader')
+        self.api = token_client(self.reader)
+        self.category = Category.objects.create(title='Dinner')
+        self.recipe = make_recipe(self.author, self.category, 'Chicken curry')
+
+    def changes(self, since=0, client=None, **params):
+        response = (client or self.api).get('/api/changes/', {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_snapshot_and_delta(self):
+        data = self.changes()
+        self.assertEqual([recipe['title'] for recipe in data['changes']['recipes']], ['Chicken curry'])
+        self.assertEqual(data['changes']['recipes'][0]['ingredients'], '<p>Chicken</p>')
+        self.assertEqual(data['changes']['categories'][0]['recipe_count'], 1)
+        self.assertFalse(data['has_more'])
+        cursor = data['cursor']
+
+        self.assertEqual(self.changes(cursor)['cursor'], cursor)  # nothing new
+        self.recipe.title = 'Lamb curry'
+        self.recipe.save()
+        data = self.changes(cursor)
+        self.assertEqual([recipe['title'] for recipe in data['changes']['recipes']], ['Lamb curry'])
+
+    def test_tombstones(self):
+        review = Review.objects.create(user=self.reader, recipe=self.recipe, comment='Good', rating=4)
+        favourite = Favourite.objects.create(user=self.reader, recipe=self.recipe)
+        cursor = self.changes()['cursor']
+        review_id, favourite_id = review.pk, favourite.pk
+        review.delete()
+        favourite.delete()
+        deleted = self.changes(cursor)['deleted']
+        self.assertEqual(deleted['reviews'], [{'id': review_id, 'recipe': self.recipe.pk}])
+        self.assertEqual(deleted['favourites'], [{'id': favourite_id, 'recipe': self.recipe.pk}])
+
+    def test_favourites_are_private(self):
+        Favourite.objects.create(user=self.reader, recipe=self.recipe)
+        self.assertEqual(len(self.changes()['changes']['favourites']), 1)
+        self.assertEqual(self.changes(client=token_client(self.author))['changes']['favourites'], [])
+        self.assertEqual(self.changes(client=APIClient())['changes']['favourites'], [])
+
+    def test_batches(self):
+        for number in range(4):
+            make_recipe(self.author, self.category, f'Dish {number}')
+        seen, cursor, has_more = set(), 0, True
+        while has_more:
+            data = self.changes(cursor, limit=3)
+            seen.update(recipe['title'] for recipe in data['changes']['recipes'])
+            cursor, has_more = data['cursor'], data['has_more']
+        self.assertEqual(len(seen), 5)
+        response = self.api.get('/api/changes/', {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_compaction(self):
+        review = Review.objects.create(user=self.reader, recipe=self.recipe, comment='Good', rating=4)
+        old_cursor = self.changes()['cursor']
+        review.delete()
+        for number in range(3):
+            self.recipe.servings = number + 1
+            self.recipe.save()
+        cursor = self.changes()['cursor']
+
+        superseded, tombstones = compact(timezone.now() + timedelta(seconds=1))
+        self.assertGreater(superseded, 0)
+        self.assertEqual(tombstones, 1)
+        self.assertEqual(ChangeLog.objects.filter(model='recipe', object_id=self.recipe.pk).count(), 1)
+        # Cursors from before the dropped tombstone must resync; later ones carry on
+        self.assertEqual(self.api.get('/api/changes/', {'since': old_cursor}).status_code, 410)
+        self.assertEqual(self.changes(cursor)['changes']['recipes'], [])
+        snapshot = self.changes()
+        self.assertEqual(len(snapshot['changes']['recipes']), 1)
+        self.assertEqual(snapshot['deleted']['reviews'], [])
+
+    def test_counter_repairs_are_synced(self):
+        Category.objects.filter(pk=self.category.pk).update(recipe_count=7)  # drift
+        cursor = self.changes()['cursor']
+        self.assertEqual(reconcile(), 1)
+        categories = self.changes(cursor)['changes']['categories']
+        self.assertEqual([(category['id'], category['recipe_count']) for category in categories],
+                         [(self.category.pk, 1)])
+        self.assertEqual(reconcile(), 0)
+
+
+class SanitizeTests(SimpleTestCase):
+
+    def html(self, raw):
+        return sanitize.render(raw)[0]
+
+    def test_scripts_and_handlers_removed(self):
+        self.assertEqual(self.html('<p onclick="steal()">Hi<script>alert(1)</script></p>'), '<p>Hi</p>')
+        self.assertEqual(self.html('<img src="/media/x.png" onerror="alert(1)" alt="Dish">'),
+                         '<img src="/media/x.png" alt="Dish">')
+        self.assertEqual(self.html('<style>p{}</style><iframe src="//evil"></iframe>Text'), 'Text')
+        self.assertEqual(self.html('<svg onload="alert(1)"><b>bold</b></svg>'), '<b>bold</b>')
+
+    def test_unsafe_urls_dropped(self):
+        self.assertEqual(self.html('<a href="javascript:alert(1)">x</a>'), '<a rel="nofollow noopener">x</a>')
+        self.assertEqual(self.html('<a href=" JaVaScRiPt:alert(1)">x</a>'), '<a rel="nofollow noopener">x</a>')
+        self.assertEqual(self.html('<img src="data:text/html;base64,AAAA">'), '<img>')
+        self.assertEqual(self.html('<a href="https://example.com/?a=1&b=&quot;2">x</a>'),
+                         '<a href="https://example.com/?a=1&amp;b=&quot;2" rel="nofollow noopener">x</a>')
+
+    def test_text_escaped(self):
+        self.assertEqual(self.html('1 &lt; 2 &amp;&amp; <b>3 &gt; 2</b>'), '1 &lt; 2 &amp;&amp; <b>3 &gt; 2</b>')
+        self.assertEqual(self.html('&lt;script&gt;alert(1)&lt;/script&gt;'), '&lt;script&gt;alert(1)&lt;/script&gt;')
+
+    def test_markup_repaired(self):
+        self.assertEqual(self.html('<ul><li>egg<li>milk</ul>'), '<ul><li>egg</li><li>milk</li></ul>')
+        self.assertEqual(self.html('<p><b>open'), '<p><b>open</b></p>')
+        self.assertEqual(self.html('stray</p></div>'), 'stray')
+
+    def test_text_and_reading_time(self):
+        html, text = sanitize.render('<h2>Steps</h2><ol><li>Boil&nbsp;water</li><li>Add  pasta</li></ol>')
+        self.assertEqual(text, 'Steps\nBoil water\nAdd pasta')
+        self.assertEqual(sanitize.word_count(text, ''), 5)
+        self.assertEqual(sanitize.reading_time(0), 0)
+        self.assertEqual(sanitize.reading_time(201), 2)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RenderedContentTests(TestCase):
+
+    def test_api_serves_sanitized_copy(self):
+        author = make_user('author')
+        api = token_client(author)
+        category = Category.objects.create(title='Dinner')
+        response = api.post('/api/my-recipes/', {
+            'title': 'Soup', 'category': category.pk, 'prep_time': 5, 'cook_time': 10, 'servings': 2,
+            'ingredients': '<p>Leeks<script>alert(1)</script></p>', 'instructions': '<p onclick="x()">Simmer</p>',
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual((response.json()['ingredients'], response.json()['instructions']),
+                         ('<p>Leeks</p>', '<p>Simmer</p>'))
+        recipe = Recipe.objects.get(slug=response.json()['slug'])
+        self.assertEqual(recipe.ingredients, '<p>Leeks<script>alert(1)</script></p>')  # raw input is kept
+        self.assertEqual((recipe.ingredients_text, recipe.word_count, recipe.reading_time), ('Leeks', 2, 1))
+        detail = self.client.get(f'/api/recipe-detail/{recipe.slug}/').json()
+        self.assertEqual(detail['ingredients'], '<p>Leeks</p>')
+
+    def test_update_fields_rerender(self):
+        recipe = make_recipe(make_user('author'), Category.objects.create(title='Dinner'), 'Soup')
+        recipe.ingredients = '<p>Leeks and potatoes</p>'
+        recipe.save(update_fields=['ingredients'])
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        self.assertEqual((recipe.ingredients_html, recipe.word_count), ('<p>Leeks and potatoes</p>', 4))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class CategoryCounterTests(TestCase):
+
+    def setUp(self):
+        self.author = make_user('author')
+        self.dinner = Category.objects.create(title='Dinner')
+        self.dessert = Category.objects.create(title='Dessert')
+
+    def listing(self):
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response.status_code, 200)
+        return {item['title']: (item['recipe_count'], item['latest_recipe']) for item in response.json()}
+
+    def test_maintained_on_writes(self):
+        first = make_recipe(self.author, self.dinner, 'Curry')
+        second = make_recipe(self.author, self.dinner, 'Stew')
+        self.assertEqual(self.listing(), {'Dinner': (2, second.pk), 'Dessert': (0, None)})
+        second.category = self.dessert
+        second.save()
+        self.assertEqual(self.listing(), {'Dinner': (1, first.pk), 'Dessert': (1, second.pk)})
+        first.delete()
+        self.assertEqual(self.listing(), {'Dinner': (0, None), 'Dessert': (1, second.pk)})
+
+    def test_recipe_ratings(self):
+        recipe = make_recipe(self.author, self.dinner, 'Curry')
+        first = Review.objects.create(user=make_user('a'), recipe=recipe, comment='Ok', rating=2)
+        Review.objects.create(user=make_user('b'), recipe=recipe, comment='Good', rating=5)
+        Review.objects.create(user=make_user('c'), recipe=recipe, comment='No rating')
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.rating_avg, recipe.rating_count), (3.5, 2))
+        first.delete()
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.rating_avg, recipe.rating_count), (5.0, 1))
+
+    def test_reconcile_repairs_drift(self):
+        recipe = make_recipe(self.author, self.dinner, 'Curry')
+        Category.objects.filter(pk=self.dinner.pk).update(recipe_count=5, latest_recipe=None)
+        Category.objects.filter(pk=self.dessert.pk).update(recipe_count=2)
+        out = StringIO()
+        call_command('reconcile_category_counts', stdout=out)
+        self.assertIn('Fixed 2 categories.', out.getvalue())
+        self.assertEqual(self.listing(), {'Dinner': (1, recipe.pk), 'Dessert': (0, None)})
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = self.settings(PROFILING_ENABLED=True, PROFILING_DIR=self.directory, PROFILING_SAMPLE_RATE=0.0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.staff = token_client(make_user('staff', is_staff=True))
+        self.member = token_client(make_user('member'))
+
+    def dumps(self):
+        return list(self.directory.glob('*.prof'))
+
+    def test_staff_request(self):
+        response = self.staff.get('/api/home/', HTTP_X_PROFILE='1')
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertIn('"top"', response['X-Profile-Summary'])
+        self.assertEqual(self.dumps(), [self.directory / f"{response['X-Profile-Id']}.prof"])
+
+    def test_not_staff(self):
+        for client in (self.member, APIClient()):
+            response = client.get('/api/home/', {'_profile': '1'})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Profile-Summary', response)
+            self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.dumps(), [])
+
+    def test_sampled_requests(self):
+        with self.settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_RING_SIZE=2):
+            client = APIClient()  # a new handler picks up the settings
+            for _ in range(3):
+                response = client.get('/api/home/')
+                self.assertNotIn('X-Profile-Id', response)
+            self.assertEqual(len(self.dumps()), 2)
+
+    def test_disabled(self):
+        with self.settings(PROFILING_ENABLED=False):
+            response = token_client(make_user('admin', is_staff=True)).get('/api/home/', HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.dumps(), [])
+
+
+def png_bytes(size=(640, 480), color='red'):
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class StartupTests(SimpleTestCase):
+
+    def test_heavy_packages_not_imported_at_boot(self):
+        # (not requests: rest_framework.compat imports it whenever it is installed)
+        code = ("import sys\nfrom RecipeApi.wsgi import application\n"
+                "print(sorted({'PIL', 'numpy'} & {name.split('.')[0] for name in sys.modules}))")
+        child = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                               env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'RecipeApi.settings'})
+        self.assertEqual(child.returncode, 0, child.stderr)
+        self.assertEqual(child.stdout.strip(), '[]')
+
+    def test_parse_importtime(self):
+        stderr = ("import time: self [us] | cumulative | imported package\n"
+                  "import time:       120 |        120 |   PIL._util\n"
+                  "import time:      3000 |       3120 | PIL.Image\n"
+                  "import time:       500 |        500 | json\n"
+                  "unrelated line\n")
+        self.assertEqual(parse_importtime(stderr), {'PIL': 3120, 'json': 500})
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RecipeImageTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_upload_resized(self):
+        from PIL import Image
+
+        recipe = make_recipe(make_user('author'), Category.objects.create(title='Dinner'), 'Curry',
+                             image=SimpleUploadedFile('curry.png', png_bytes(), content_type='image/png'))
+        with Image.open(recipe.image.path) as image:
+            self.assertEqual((image.size, image.format), ((330, 285), 'PNG'))
+        # Saving again leaves the stored file alone
+        name = recipe.image.name
+        recipe.save()
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).image.name, name)
+
+
+class MediaTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name, MEDIA_SERVE_BACKEND='stream')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = ContentHashedStorage(location=media.name)
+        self.data = bytes(range(256)) * 4
+        self.name = self.storage.save('recipe_images/curry.PNG', ContentFile(self.data))
+        Path(media.name, 'legacy.txt').write_text('not hashed')
+
+    def get(self, name, **headers):
+        response = self.client.get(f'/media/{name}', **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        if hasattr(response, 'close'):
+            response.close()
+        return response, body
+
+    def test_hashed_names(self):
+        self.assertRegex(self.name, r'^recipe_images/curry\.[0-9a-f]{12}\.png$')
+        self.assertEqual(self.storage.save('recipe_images/other.png', ContentFile(self.data)),
+                         'recipe_images/other.' + content_hash(self.name) + '.png')
+        self.assertEqual(self.storage.save('recipe_images/curry.PNG', ContentFile(self.data)), self.name)
+
+    def test_long_names_keep_the_hash(self):
+        long_name = 'recipe_images/' + 'x' * 120 + '.jpeg'
+        first = self.storage.save(long_name, ContentFile(b'first'), max_length=100)
+        second = self.storage.save(long_name, ContentFile(b'second'), max_length=100)
+        self.assertNotEqual(first, second)
+        for name, data in ((first, b'first'), (second, b'second')):
+            # Only the stem is shortened: no random suffix, hash and extension intact
+            self.assertRegex(name, r'^recipe_images/x{68}\.[0-9a-f]{12}\.jpeg$')
+            self.assertEqual(self.storage.open(name).read(), data)
+        self.assertEqual(self.storage.save(long_name, ContentFile(b'first'), max_length=100), first)
+
+    def test_whole_file(self):
+        response, body = self.get(self.name)
+        self.assertEqual((response.status_code, body), (200, self.data))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], f'"{content_hash(self.name)}"')
+        response, _ = self.get('legacy.txt')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+    def test_conditional(self):
+        etag = f'"{content_hash(self.name)}"'
+        response, body = self.get(self.name, HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+        self.assertEqual((response.status_code, body), (304, b''))
+        self.assertEqual(self.get(self.name, HTTP_IF_NONE_MATCH='"other"')[0].status_code, 200)
+
+    def test_ranges(self):
+        response, body = self.get(self.name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual((response.status_code, body), (206, self.data[10:20]))
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=-5')[1], self.data[-5:])
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=1000-')[1], self.data[1000:])
+        response, _ = self.get(self.name, HTTP_RANGE='bytes=5000-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.data)}'))
+        # Several ranges, or an If-Range for another version: the whole file
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1,4-5')[0].status_code, 200)
+        self.assertEqual(self.get(self.name, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')[0].status_code, 200)
+
+    def test_server_backends(self):
+        with self.settings(MEDIA_SERVE_BACKEND='x-accel-redirect'):
+            response, body = self.get(self.name)
+        self.assertEqual((response['X-Accel-Redirect'], body), ('/protected-media/' + self.name, b''))
+        with self.settings(MEDIA_SERVE_BACKEND='x-sendfile'):
+            response, _ = self.get(self.name)
+        self.assertTrue(response['X-Sendfile'].endswith(self.name))
+
+    def test_missing_and_unsafe(self):
+        self.assertEqual(self.get('recipe_images/missing.png')[0].status_code, 404)
+        self.assertEqual(self.get('../settings.py')[0].status_code, 404)
+        self.assertEqual(self.get('recipe_images')[0].status_code, 404)
+        self.assertEqual(self.client.post(f'/media/{self.name}').status_code, 405)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+                   COMPRESSION_MIN_SIZE=64)
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        author = make_user('author')
+        category = Category.objects.create(title='Dinner')
+        for number in range(5):
+            make_recipe(author, category, f'Chicken curry {number}')
+
+    def counter(self, name, **labels):
+        return metrics.registry.snapshot()['counters'].get((name, tuple(sorted(labels.items()))), 0)
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, deflate', ('gzip', 'deflate')), 'gzip')
+        self.assertEqual(negotiate('deflate;q=1, gzip;q=0.5', ('gzip', 'deflate')), 'deflate')
+        self.assertEqual(negotiate('gzip;q=0, *', ('gzip', 'deflate')), 'deflate')
+        self.assertEqual(negotiate('br;q=1, gzip;q=0.1', ('gzip', 'deflate')), 'gzip')
+        self.assertIsNone(negotiate('identity', ('gzip', 'deflate')))
+        self.assertIsNone(negotiate('', ('gzip', 'deflate')))
+        self.assertIsNone(negotiate('*;q=0', ('gzip', 'deflate')))
+
+    def test_compressed_and_cached(self):
+        plain = self.client.get('/api/home/')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        first = self.client.get('/api/home/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(first.content), plain.content)
+        self.assertEqual(int(first['Content-Length']), len(first.content))
+        hits = self.counter('cache_requests_total', cache='compressed-body', result='hit')
+        second = self.client.get('/api/home/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.counter('cache_requests_total', cache='compressed-body', result='hit'), hits + 1)
+
+    def test_small_bodies_left_alone(self):
+        with self.settings(COMPRESSION_MIN_SIZE=1024 * 1024):
+            response = APIClient().get('/api/home/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_credentials_never_compressed(self):
+        user = make_user('reader' * 20)  # reflected next to the token, and compressible
+        response = self.client.post('/account/login/', {'username': user.get_username(), 'password': 'pass'},
+                                    HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn(b'"token"', response.content)
+        self.assertNotIn('Content-Encoding', response)
+        response = token_client(user).post('/api/my-events/ticket/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AuthorStatsTests(TestCase):
+
+    def setUp(self):
+        stats.cache.invalidate(None)
+        self.author = make_user('author')
+        self.api = token_client(self.author)
+        self.dinner = Category.objects.create(title='Dinner')
+        self.dessert = Category.objects.create(title='Dessert')
+        self.curry = make_recipe(self.author, self.dinner, 'Curry')
+        self.stew = make_recipe(self.author, self.dinner, 'Stew')
+        self.cake = make_recipe(self.author, self.dessert, 'Cake')
+        make_recipe(make_user('other'), self.dinner, 'Not mine')
+        fans = [make_user(f'fan{number}') for number in range(3)]
+        Review.objects.create(user=fans[0], recipe=self.curry, comment='Ok', rating=3)
+        Review.objects.create(user=fans[1], recipe=self.curry, comment='Great', rating=5)
+        Review.objects.create(user=fans[2], recipe=self.cake, comment='No stars')
+        Review.objects.create(user=fans[0], recipe=self.cake, comment='Good', rating=4)
+        for fan in fans:
+            Favourite.objects.create(user=fan, recipe=self.stew)
+
+    def get(self):
+        response = self.api.get('/api/my-stats/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_totals_and_categories(self):
+        data = self.get()
+        self.assertEqual((data['total_recipes'], data['reviews_received'], data['average_rating'],
+                          data['favourites_received']), (3, 4, 4.0, 3))
+        self.assertEqual(data['categories'], [
+            {'id': self.dessert.pk, 'title': 'Dessert', 'recipes': 1, 'reviews': 2, 'average_rating': 4.0,
+             'favourites': 0},
+            {'id': self.dinner.pk, 'title': 'Dinner', 'recipes': 2, 'reviews': 2, 'average_rating': 4.0,
+             'favourites': 3},
+        ])
+
+    def test_single_query(self):
+        with CaptureQueriesContext(connection) as captured:
+            stats.compute_author_stats(self.author.pk)
+        self.assertEqual(len(captured), 1)
+
+    def test_no_recipes(self):
+        response = token_client(make_user('newcomer')).get('/api/my-stats/')
+        self.assertEqual(response.json(), {'total_recipes': 0, 'reviews_received': 0, 'average_rating': None,
+                                           'favourites_received': 0, 'categories': []})
+        self.assertEqual(APIClient().get('/api/my-stats/').status_code, 401)
+
+    def test_cached_until_a_write(self):
+        self.get()
+        Recipe.objects.filter(pk=self.cake.pk).update(title='Tart')  # no signal: stays cached
+        with self.assertNumQueries(1):  # the token lookup only
+            self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Favourite.objects.create(user=make_user('late'), recipe=self.cake)
+        self.assertEqual(self.get()['favourites_received'], 4)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], METRICS_TOKEN='scrape-me')
+class MetricsTests(TestCase):
+
+    def test_access(self):
+        self.assertEqual(APIClient().get('/metrics').status_code, 403)
+        self.assertEqual(token_client(make_user('cook')).get('/metrics').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 200)
+        self.assertEqual(token_client(make_user('admin', is_staff=True)).get('/metrics').status_code, 200)
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_exposition_format(self):
+        APIClient().get('/api/categories/')
+        response = APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me')
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE http_requests_total counter', lines)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        self.assertIn('# TYPE db_connections_open gauge', lines)
+        buckets = [line for line in lines if line.startswith('http_request_duration_seconds_bucket{route="category-list"')]
+        self.assertEqual(len(buckets), len(metrics.BUCKETS) + 1)
+        self.assertTrue(buckets[-1].startswith('http_request_duration_seconds_bucket{route="category-list",le="+Inf"}'))
+        counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+        self.assertEqual(counts, sorted(counts))
+        self.assertIn(f'http_request_duration_seconds_count{{route="category-list"}} {counts[-1]}', lines)
+
+    def test_render_escapes_labels(self):
+        data = {'counters': {('cache_requests_total', (('cache', 'a"b\\c'), ('result', 'hit'))): 3,
+                             ('cache_requests_total', (('cache', 'a"b\\c'), ('result', 'miss'))): 1},
+                'histograms': {}, 'gauges': {}}
+        lines = metrics.render(data).splitlines()
+        self.assertIn('cache_requests_total{cache="a\\"b\\\\c",result="hit"} 3', lines)
+        self.assertIn('cache_hit_ratio{cache="a\\"b\\\\c"} 0.75', lines)
+
+    def test_connection_gauge_drops_exited_threads(self):
+        registry = metrics.Registry()
+        with mock.patch.object(metrics, 'connections') as fake:
+            fake.all.return_value = [mock.Mock(connection=object())]
+            worker = threading.Thread(target=registry.note_connections)
+            worker.start()
+            worker.join()
+            registry.note_connections()
+        self.assertEqual(registry.snapshot()['gauges'][('db_connections_open', ())], 1)
+        self.assertEqual(len(registry._open_connections), 1)
+
+    def test_multiprocess_sums_live_workers_and_prunes_exited(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        worker = {'counters': [['http_requests_total', [['route', 'x']], 2]], 'histograms': [],
+                  'gauges': [['sse_connections_open', [['kind', 'recipe']], 1]]}
+        Path(directory, 'metrics-111.json').write_text(json.dumps(worker))
+        Path(directory, 'metrics-222.json').write_text(json.dumps(worker))
+        registry = metrics.Registry()
+        registry.inc('http_requests_total', route='x')
+        with override_settings(METRICS_MULTIPROC_DIR=directory), \
+                mock.patch.object(metrics, '_alive', lambda pid: pid != 222):
+            data = registry.collect()
+        self.assertEqual(data['counters'][('http_requests_total', (('route', 'x'),))], 3)
+        self.assertEqual(data['gauges'][('sse_connections_open', (('kind', 'recipe'),))], 1)
+        self.assertEqual(sorted(path.name for path in Path(directory).iterdir()),
+                         sorted(['metrics-111.json', f'metrics-{os.getpid()}.json']))
+
+    def test_new_process_flushes_on_first_request(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        stale = Path(directory, f'metrics-{os.getpid()}.json')
+        stale.write_text('{"counters": [["http_requests_total", [], 99]]}')
+        registry = metrics.Registry()
+        registry._last_flush = time.monotonic()
+        with override_settings(METRICS_MULTIPROC_DIR=directory):
+            registry.maybe_flush()
+            self.assertNotIn('99', stale.read_text())
+            stale.write_text('{}')
+            registry.maybe_flush()  # flushed recently in this process
+        self.assertEqual(stale.read_text(), '{}')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class FacetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = make_user('alice'), make_user('bob')
+        cls.dinner = Category.objects.create(title='Dinner')
+        cls.dessert = Category.objects.create(title='Dessert')
+        cls.quick = make_recipe(cls.alice, cls.dinner, 'Omelette', prep_time=5, cook_time=5, servings=1)
+        cls.stew = make_recipe(cls.alice, cls.dinner, 'Stew', prep_time=30, cook_time=100, servings=4)
+        cls.cake = make_recipe(cls.bob, cls.dessert, 'Cake', prep_time=20, cook_time=25, servings=4)
+        Review.objects.create(user=cls.bob, recipe=cls.stew, comment='Good', rating=5)
+        Review.objects.create(user=cls.alice, recipe=cls.cake, comment='Dry', rating=2)
+
+    def get(self, query='', status=200):
+        response = token_client(self.alice).get('/api/recipes/facets/' + query)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def counts(self, facet):
+        return {row.get('id', row.get('value', row.get('bucket'))): row['count'] for row in facet}
+
+    def test_unfiltered(self):
+        data = self.get()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(self.counts(data['facets']['category']), {self.dinner.pk: 2, self.dessert.pk: 1})
+        self.assertEqual(self.counts(data['facets']['servings']), {1: 1, 4: 2})
+        self.assertEqual(self.counts(data['facets']['total_time']),
+                         {'under-15': 1, '15-30': 0, '30-60': 1, '60-120': 0, 'over-120': 1})
+        self.assertEqual(self.counts(data['facets']['min_rating']), {4: 1, 3: 1, 2: 2, 1: 2})
+
+    def test_facet_ignores_its_own_filter(self):
+        data = self.get(f'?category={self.dessert.pk}&servings=4')
+        self.assertEqual([recipe['id'] for recipe in data['results']], [self.cake.pk])
+        # Other categories still counted under the servings filter, servings under the category one
+        self.assertEqual(self.counts(data['facets']['category']), {self.dinner.pk: 1, self.dessert.pk: 1})
+        self.assertEqual(self.counts(data['facets']['servings']), {4: 1})
+        self.assertEqual(self.counts(data['facets']['author']), {self.bob.pk: 1})
+
+    def test_ranges_and_lists(self):
+        data = self.get(f'?category={self.dinner.pk},{self.dessert.pk}&min_time=40&max_time=130&min_rating=4')
+        self.assertEqual([recipe['id'] for recipe in data['results']], [self.stew.pk])
+        data = self.get(f'?author={self.alice.pk}&author={self.bob.pk}&max_time=45')
+        self.assertEqual([recipe['id'] for recipe in data['results']], [self.cake.pk, self.quick.pk])
+
+    def test_query_count_independent_of_values(self):
+        self.get()  # token and invalidation bus set up
+        with CaptureQueriesContext(connection) as few:
+            self.get()
+        for number in range(5):
+            category = Category.objects.create(title=f'Extra {number}')
+            make_recipe(make_user(f'extra{number}'), category, f'Extra {number}', servings=number + 5)
+        self.get()
+        with CaptureQueriesContext(connection) as many:
+            self.get()
+        self.assertEqual(len(many), len(few))
+
+    def test_invalid_values(self):
+        self.assertIn('category', self.get('?category=1,x', status=400))
+        self.assertIn('min_time', self.get('?min_time=soon', status=400))
+        self.assertIn('min_rating', self.get('?min_rating=high', status=400))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class OverloadTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(overload._controllers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = make_user('cook')
+        self.category = Category.objects.create(title='Dinner')
+        self.api = token_client(self.user)
+
+    def queued(self, seconds):
+        return {'HTTP_X_REQUEST_START': f't={time.time() - seconds:.3f}'}
+
+    def test_queue_time(self):
+        factory = RequestFactory()
+        now = time.time()
+        for header in (f't={now - 2}', f'{now - 2}', f'{int((now - 2) * 1000)}', f'{int((now - 2) * 1e6)}'):
+            waited = overload.queue_time(factory.get('/', HTTP_X_REQUEST_START=header))
+            self.assertAlmostEqual(waited, 2, delta=0.1, msg=header)
+        self.assertIsNone(overload.queue_time(factory.get('/')))
+        self.assertIsNone(overload.queue_time(factory.get('/', HTTP_X_REQUEST_START='t=soon')))
+        self.assertEqual(overload.queue_time(factory.get('/', HTTP_X_REQUEST_START=f't={now + 60}')), 0)
+
+    def test_sheds_low_priority_reads_after_a_long_queue(self):
+        before = metrics.registry.snapshot()['counters'].get(
+            ('http_requests_shed_total', (('route', 'recipe-facets'),)), 0)
+        response = self.api.get('/api/recipes/facets/', **self.queued(2))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '5')
+        self.assertEqual(metrics.registry.snapshot()['counters'][
+            ('http_requests_shed_total', (('route', 'recipe-facets'),))], before + 1)
+        self.assertEqual(self.api.get('/api/recipes/facets/', **self.queued(0.1)).status_code, 200)
+        self.assertEqual(self.api.get('/api/recipes/facets/').status_code, 200)
+        # Hot endpoints and deep pages
+        self.assertEqual(self.api.get('/api/home/', **self.queued(2)).status_code, 200)
+        self.assertEqual(self.api.get('/api/favourite-list/?page=21', **self.queued(2)).status_code, 503)
+
+    def test_never_sheds_writes(self):
+        recipe = make_recipe(self.user, self.category, 'Curry')
+        response = self.api.post(f'/api/add-favourite/{recipe.slug}/', **self.queued(2))
+        self.assertLess(response.status_code, 500)
+        self.assertTrue(Favourite.objects.filter(recipe=recipe).exists())
+
+    def test_sheds_on_average_latency(self):
+        with override_settings(LOAD_SHEDDING={'latency_threshold': 0.5}):
+            api = token_client(self.user)
+            controller = overload._controller(0.5, 0.5)
+            for _ in range(20):
+                controller.record(3.0)
+            self.assertEqual(api.get('/api/recipes/').status_code, 503)
+            controller.updated -= overload.EWMA_STALE_AFTER  # nothing completed lately: forgotten
+            self.assertEqual(api.get('/api/recipes/').status_code, 200)
+
+    def test_deadline_exceeded(self):
+        make_recipe(self.user, self.category, 'Curry')
+        with override_settings(REQUEST_DEADLINES={'recipe-facets': 1e-9}):
+            api = token_client(self.user)
+            before = metrics.registry.snapshot()['counters'].get(
+                ('http_request_deadline_exceeded_total', (('route', 'recipe-facets'),)), 0)
+            response = api.get('/api/recipes/facets/')
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json(), {'detail': "The request took too long and was cancelled."})
+            self.assertEqual(metrics.registry.snapshot()['counters'][
+                ('http_request_deadline_exceeded_total', (('route', 'recipe-facets'),))], before + 1)
+            self.assertEqual(api.get('/api/home/').status_code, 200)  # default budget
+
+    def test_sqlite_statement_interrupted(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("SQLite progress handler")
+        middleware = overload.OverloadMiddleware(lambda request: None)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            db = middleware.install({'connection': connection}, time.monotonic() - 1, 0)
+            try:
+                with self.assertRaises(OperationalError):
+                    cursor.execute('WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 10000000)'
+                                   ' SELECT count(*) FROM n')
+            finally:
+                middleware.uninstall(db)
+            cursor.execute('SELECT 1')
+
+
+@override_settings(SITEMAP_CHUNK_SIZE=10, RECIPE_PUBLIC_URL='https://recipes.example/r/{slug}')
+class SitemapTests(TestCase):
+
+    def setUp(self):
+        sitemaps.cache.invalidate(None)
+        self.author = make_user('cook')
+        self.category = Category.objects.create(title='Dinner')
+        self.recipes = [make_recipe(self.author, self.category, f'Dish {number}') for number in range(3)]
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_index_lists_id_blocks(self):
+        far = make_recipe(self.author, self.category, 'Far', id=self.recipes[0].pk + 25)
+        response = self.client.get('/api/sitemap.xml')
+        self.assertEqual(response['Content-Type'], 'application/xml; charset=utf-8')
+        chunks = [self.recipes[0].pk // 10, self.recipes[-1].pk // 10, far.pk // 10]
+        for chunk in chunks:
+            self.assertContains(response, f'<loc>http://testserver/api/sitemap-{chunk}.xml</loc>')
+        self.assertEqual(response.content.count(b'<sitemap>'), len(set(chunks)))
+
+    def test_chunk_streamed_then_cached(self):
+        chunk = self.recipes[0].pk // 10
+        first = self.client.get(f'/api/sitemap-{chunk}.xml')
+        self.assertTrue(first.streaming)
+        body = self.body(first).decode()
+        for recipe in self.recipes:
+            self.assertIn(f'<loc>https://recipes.example/r/{recipe.slug}</loc>', body)
+        with self.assertNumQueries(0):
+            second = self.client.get(f'/api/sitemap-{chunk}.xml')
+        self.assertFalse(second.streaming)
+        self.assertEqual(second.content.decode(), body)
+        self.assertEqual(self.client.get('/api/sitemap-999.xml').status_code, 404)
+
+    def test_write_invalidates_chunk_index_and_feeds(self):
+        chunk = self.recipes[0].pk // 10
+        self.body(self.client.get(f'/api/sitemap-{chunk}.xml'))
+        self.client.get('/api/sitemap.xml')
+        self.client.get('/api/feed/rss/')
+        recipe = self.recipes[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.title = 'Renamed dish'
+            recipe.save()
+        self.assertIsNone(sitemaps.cache.get(sitemaps.chunk_key(chunk)))
+        self.assertIsNone(sitemaps.cache.get(sitemaps.INDEX_KEY))
+        self.assertContains(self.client.get('/api/feed/rss/'), 'Renamed dish')
+        self.assertIn(f'/r/{recipe.slug}<'.encode(), self.body(self.client.get(f'/api/sitemap-{chunk}.xml')))
+
+    def test_invalidated_while_streaming_is_not_cached(self):
+        chunk = self.recipes[0].pk // 10
+        response = self.client.get(f'/api/sitemap-{chunk}.xml')
+        parts = iter(response.streaming_content)
+        next(parts)
+        sitemaps.cache.invalidate(sitemaps.chunk_key(chunk))
+        list(parts)
+        self.assertIsNone(sitemaps.cache.get(sitemaps.chunk_key(chunk)))
+
+    def test_feeds(self):
+        rss = self.client.get('/api/feed/rss/')
+        self.assertEqual(rss['Content-Type'], 'application/rss+xml; charset=utf-8')
+        self.assertEqual(rss.content.count(b'<item>'), 3)
+        atom = self.client.get('/api/feed/atom/')
+        self.assertEqual(atom['Content-Type'], 'application/atom+xml; charset=utf-8')
+        self.assertContains(atom, '<category term="Dinner"')
+        self.assertEqual(self.client.get('/api/feed/json/').status_code, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.title = 'Supper'
+            self.category.save()
+        self.assertContains(self.client.get('/api/feed/atom/'), '<category term="Supper"')
+        self.assertEqual(self.client.post('/api/feed/rss/').status_code, 405)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class FuzzySearchTests(TestCase):
+
+    def setUp(self):
+        self.author = make_user('cook')
+        self.dinner = Category.objects.create(title='Dinner')
+        self.curry = make_recipe(self.author, self.dinner, 'Chicken Curry')
+        self.soup = make_recipe(self.author, self.dinner, 'Chicken Noodle Soup With Extra Vegetables')
+        self.cake = make_recipe(self.author, Category.objects.create(title='Dessert'), 'Lemon Cake')
+
+    def search(self, query):
+        response = token_client(self.author).get('/api/search/', {'search': query, 'mode': 'fuzzy'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [recipe['id'] for recipe in (data['results'] if isinstance(data, dict) else data)]
+
+    def test_trigrams(self):
+        self.assertEqual(trigram.trigrams('Curry'), {'  c', ' cu', 'cur', 'urr', 'rry', 'ry '})
+        self.assertEqual(trigram.trigrams('  '), set())
+
+    def test_typo_tolerant_and_ranked(self):
+        self.assertEqual(self.search('chiken cury'), [self.curry.pk, self.soup.pk])
+        self.assertEqual(self.search('lemn cake'), [self.cake.pk])
+        self.assertEqual(self.search('dessert'), [self.cake.pk])  # category names are indexed too
+        self.assertEqual(self.search('zzzz'), [])
+        self.assertEqual(self.search('!!'), [])
+
+    def test_similarity_threshold(self):
+        matches = dict(trigram.search('curry'))
+        self.assertEqual(matches[self.curry.pk], 1.0)
+        self.assertNotIn(self.cake.pk, matches)
+        self.assertEqual(trigram.search('curry', threshold=1.1), [])
+
+    def test_index_follows_writes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.cake.title = 'Lime Tart'
+            self.cake.save()
+        self.assertEqual(self.search('lime tart'), [self.cake.pk])
+        self.assertEqual(self.search('lemon cake'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dinner.title = 'Supper'
+            self.dinner.save()
+        self.assertEqual(self.search('supper'), [self.curry.pk, self.soup.pk])
+        self.cake.delete()
+        self.assertEqual(self.search('lime tart'), [])
+
+    def test_rebuild(self):
+        RecipeTrigram.objects.all().delete()
+        self.assertEqual(self.search('curry'), [])
+        out = StringIO()
+        call_command('rebuild_trigram_index', stdout=out)
+        self.assertEqual(self.search('curry'), [self.curry.pk])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BatchTests(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(overload._controllers, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        stats.cache.invalidate(None)  # keyed by user id, which other tests reuse
+        self.user = make_user('cook')
+        self.api = token_client(self.user)
+        self.recipe = make_recipe(self.user, Category.objects.create(title='Dinner'), 'Curry')
+
+    def batch(self, urls, status=200, **extra):
+        response = self.api.post('/api/batch/', {'requests': urls}, format='json', **extra)
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_runs_each_request(self):
+        responses = self.batch(['/api/categories/', f'/api/recipe-detail/{self.recipe.slug}/', '/api/my-stats/'])
+        self.assertEqual([item['status'] for item in responses['responses']], [200, 200, 200])
+        self.assertEqual(responses['responses'][1]['body']['title'], 'Curry')
+        self.assertEqual(responses['responses'][2]['body']['total_recipes'], 1)  # outer request's user
+        self.assertEqual(responses['responses'][0]['path'], '/api/categories/')
+
+    def test_rejected_items(self):
+        responses = self.batch(['/api/my-events/', f'/api/recipe-detail/{self.recipe.slug}/events/',
+                                '/admin/', 'https://elsewhere.example/api/home/', '/api/nope/', '/api/batch/',
+                                '/api/home/'])['responses']
+        self.assertEqual([item['status'] for item in responses], [400, 400, 400, 400, 404, 400, 200])
+        self.assertEqual(responses[0]['body'], {'detail': "Async views cannot be batched."})
+        self.assertEqual(responses[5]['body'], {'detail': "Batches cannot be nested."})
+
+    def test_shed_item(self):
+        queued = {'HTTP_X_REQUEST_START': f't={time.time() - 2:.3f}'}
+        responses = self.batch(['/api/recipes/facets/', '/api/home/'], **queued)['responses']
+        self.assertEqual([item['status'] for item in responses], [503, 200])
+        self.assertEqual(responses[0]['body'], {'detail': "The service is busy; try again shortly."})
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_limits_and_validation(self):
+        self.batch(['/api/home/'] * 2)
+        self.assertIn('At most 2', self.batch(['/api/home/'] * 3, status=400)['detail'])
+        self.batch('/api/home/', status=400)
+        self.batch([1, 2], status=400)
+        self.assertEqual(self.api.get('/api/batch/').status_code, 405)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class EventStreamTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user('cook')
+
+    def ticket(self):
+        response = token_client(self.user).post('/api/my-events/ticket/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['expires_in'], 60)
+        return response.json()['ticket']
+
+    def test_ticket(self):
+        self.assertEqual(events.ticket_user_id(self.ticket()), self.user.pk)
+        self.assertEqual(APIClient().post('/api/my-events/ticket/').status_code, 401)
+        self.assertEqual(token_client(self.user).get('/api/my-events/ticket/').status_code, 405)
+
+    def test_rejected_tickets(self):
+        ticket = self.ticket()
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertIsNone(events.ticket_user_id(ticket))  # expired
+        forged = f'{make_user("victim").pk}:' + ticket.split(':', 1)[1]
+        self.assertIsNone(events.ticket_user_id(forged))
+        # Signed with the project key, but for something else
+        self.assertIsNone(events.ticket_user_id(signing.TimestampSigner(salt='other').sign(str(self.user.pk))))
+        self.assertIsNone(events.ticket_user_id(signing.TimestampSigner(salt=events.TICKET_SALT).sign('me')))
+        self.assertIsNone(events.ticket_user_id(''))
+
+    async def first_frame(self, path, **params):
+        response = await self.async_client.get(path, params)
+        if not response.streaming:
+            return response, None
+        chunks = aiter(response.streaming_content)
+        frame = await anext(chunks)
+        await chunks.aclose()
+        return response, frame
+
+    async def test_stream_requires_credentials(self):
+        ticket = events.issue_ticket(self.user)
+        response, frame = await self.first_frame('/api/my-events/', ticket=ticket)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(frame, b'retry: 5000\n\n')
+        response, _ = await self.first_frame('/api/my-events/', ticket=ticket + 'x')
+        self.assertEqual(response.status_code, 401)
+        response, _ = await self.first_frame('/api/my-events/')
+        self.assertEqual(response.status_code, 401)
+        await CustomUser.objects.filter(pk=self.user.pk).aupdate(is_active=False)
+        response, _ = await self.first_frame('/api/my-events/', ticket=ticket)
+        self.assertEqual(response.status_code, 401)
+
+    def test_needs_asgi(self):
+        self.assertEqual(self.client.get('/api/my-events/').status_code, 501)
+
+    def test_stream_delivers_events(self):
+        async def run():
+            frames = events.stream(events.user_channel(self.user.pk), 'user')
+            self.assertEqual(await anext(frames), 'retry: 5000\n\n')
+            events.publish(events.user_channel(self.user.pk), {'type': 'favourite.added', 'recipe': 7})
+            events.publish(events.user_channel(0), {'type': 'favourite.added', 'recipe': 8})
+            frame = await asyncio.wait_for(anext(frames), 1)
+            await frames.aclose()
+            return frame
+
+        self.assertEqual(asyncio.run(run()), 'event: favourite.added\ndata: {"type":"favourite.added","recipe":7}\n\n')
+
+
+class InvalidationBusTests(TestCase):
+
+    def setUp(self):
+        for name, value in (('_subscribers', list(bus._subscribers)), ('_last_seq', None), ('_last_poll', 0.0)):
+            patcher = mock.patch.object(bus, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.cache = LocalCache('test:')
+        bus.poll()  # start from the end of the log
+
+    def test_publish_on_commit(self):
+        self.cache.set('test:1', 'one')
+        with self.captureOnCommitCallbacks() as callbacks:
+            bus.publish('test:1', 'test:1', None, 'other:2')
+            self.assertEqual(self.cache.get('test:1'), 'one')  # not before the commit
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(self.cache.get('test:1'))
+        self.assertEqual(list(Invalidation.objects.order_by('seq').values_list('key', 'origin')),
+                         [('test:1', bus.origin), ('other:2', bus.origin)])
+
+    def test_poll_applies_other_workers_writes(self):
+        remote_only = []
+        bus.subscribe('test:', remote_only.append, local=False)
+        for key in ('test:1', 'test:2'):
+            self.cache.set(key, key)
+        Invalidation.objects.create(key='test:1', origin='elsewhere:1')
+        Invalidation.objects.create(key='test:2', origin=bus.origin)  # already applied when written
+        self.assertEqual(bus.poll(), 1)
+        self.assertEqual((self.cache.get('test:1'), self.cache.get('test:2')), (None, 'test:2'))
+        self.assertEqual(remote_only, ['test:1'])
+        self.assertEqual(bus.poll(), 0)
+
+    def test_maybe_poll_is_rate_limited(self):
+        self.cache.set('test:1', 'one')
+        Invalidation.objects.create(key='test:1', origin='elsewhere:1')
+        bus.maybe_poll()
+        self.assertEqual(self.cache.get('test:1'), 'one')
+        bus._last_poll -= 1
+        bus.maybe_poll()
+        self.assertIsNone(self.cache.get('test:1'))
+
+    @override_settings(INVALIDATION_RETENTION_SECONDS=60)
+    def test_idle_longer_than_retention_flushes_everything(self):
+        self.cache.set('test:1', 'one')
+        bus._last_poll -= 30
+        bus.poll()
+        self.assertEqual(self.cache.get('test:1'), 'one')
+        bus._last_poll -= 61  # entries may have been pruned meanwhile
+        self.assertEqual(bus.poll(), 0)
+        self.assertIsNone(self.cache.get('test:1'))
+
+    def test_set_skipped_after_concurrent_invalidation(self):
+        generation = self.cache.generation
+        self.cache.invalidate('test:2')
+        self.assertFalse(self.cache.set('test:1', 'stale', generation=generation))
+        self.assertIsNone(self.cache.get('test:1'))
+        self.assertTrue(self.cache.set('test:1', 'fresh', generation=self.cache.generation))
+
+    def test_author_stats_not_cached_when_written_meanwhile(self):
+        stats.cache.invalidate(None)
+        author = make_user('cook')
+        real = stats.compute_author_stats
+
+        def compute_then_write(author_id):
+            result = real(author_id)
+            stats.cache.invalidate(stats.cache_key(author_id))  # a favourite lands mid-computation
+            return result
+        with mock.patch.object(stats, 'compute_author_stats', compute_then_write):
+            stats.author_stats(author.pk)
+        self.assertIsNone(stats.cache.get(stats.cache_key(author.pk)))
+        stats.author_stats(author.pk)
+        self.assertIsNotNone(stats.cache.get(stats.cache_key(author.pk)))
+
+    def test_prune(self):
+        Invalidation.objects.create(key='test:1', origin='elsewhere:1')
+        Invalidation.objects.filter(key='test:1').update(created_at=timezone.now() - timedelta(hours=2))
+        Invalidation.objects.create(key='test:2', origin='elsewhere:1')
+        call_command('prune_invalidations', stdout=StringIO())
+        self.assertEqual(list(Invalidation.objects.values_list('key', flat=True)), ['test:2'])
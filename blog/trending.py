@@ -0,0 +1,142 @@
+import math
+from collections import defaultdict
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Favourite, Review, TrendingRetraction, TrendingScore, TrendingState
+
+# Every event contributes weight * exp(rate * (t_event - epoch)). Because all
+# scores decay by the same factor over time, ranking by the stored value is the
+# same as ranking by the decayed score, so rows only change when new events
+# arrive. The displayed score is stored * exp(-rate * (now - epoch)).
+
+FAVOURITE_WEIGHT = 1.0
+REVIEW_WEIGHT = 1.0
+UNRATED_REVIEW_RATING = 3
+
+# Rebase the epoch before exp() gets anywhere near float overflow (~709)
+MAX_EXPONENT = 600
+
+
+def decay_rate():
+    half_life = getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 72) * 3600
+    return math.log(2) / half_life
+
+
+def review_weight(rating):
+    # 1.2 for a one star review up to 2.0 for five stars
+    return REVIEW_WEIGHT + (rating or UNRATED_REVIEW_RATING) / 5
+
+
+def decay_factor(epoch, now=None):
+    now = now or timezone.now()
+    return math.exp(-decay_rate() * (now - epoch).total_seconds())
+
+
+def _as_datetime(when):
+    if not isinstance(when, datetime):
+        # Review.created_date is a plain date
+        when = datetime.combine(when, time.min, tzinfo=dt_timezone.utc)
+    return when
+
+
+def _growth(epoch, when):
+    return math.exp(decay_rate() * (_as_datetime(when) - epoch).total_seconds())
+
+
+def _rebase(state, now):
+    factor = decay_factor(state.epoch, now)
+    TrendingScore.objects.update(score=F('score') * factor)
+    state.epoch = now
+
+
+def refresh_trending(batch_size=2000):
+    """
+    Fold the favourites and reviews created since the last run into the
+    stored scores, and subtract queued retractions of counted ones. Returns
+    the number of events processed.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        state, _ = TrendingState.objects.select_for_update().get_or_create(pk=1, defaults={'epoch': now})
+        if decay_rate() * (now - state.epoch).total_seconds() > MAX_EXPONENT:
+            _rebase(state, now)
+
+        gains = defaultdict(float)
+        processed = 0
+        started = {'last_favourite_id': state.last_favourite_id, 'last_review_id': state.last_review_id}
+        seen = {'last_favourite_id': set(), 'last_review_id': set()}
+
+        favourites = Favourite.objects.filter(id__gt=state.last_favourite_id) \
+                                      .order_by('id') \
+                                      .values_list('id', 'recipe_id', 'created_at')
+        for pk, recipe_id, created_at in favourites.iterator(chunk_size=batch_size):
+            gains[recipe_id] += FAVOURITE_WEIGHT * _growth(state.epoch, created_at)
+            state.last_favourite_id = pk
+            seen['last_favourite_id'].add(pk)
+            processed += 1
+
+        reviews = Review.objects.filter(id__gt=state.last_review_id) \
+                                .order_by('id') \
+                                .values_list('id', 'recipe_id', 'created_date', 'rating')
+        for pk, recipe_id, created_date, rating in reviews.iterator(chunk_size=batch_size):
+            gains[recipe_id] += review_weight(rating) * _growth(state.epoch, created_date)
+            state.last_review_id = pk
+            seen['last_review_id'].add(pk)
+            processed += 1
+
+        # Read after the events: a delete and its retraction commit together,
+        # so the event of any retraction seen here is gone for good, and it
+        # was counted if an earlier run or this one saw it
+        done = []
+        for retraction in TrendingRetraction.objects.order_by('pk').iterator(chunk_size=batch_size):
+            cursor = retraction.cursor
+            if retraction.event_id <= started[cursor] or retraction.event_id in seen[cursor]:
+                gains[retraction.recipe_id] -= retraction.weight * _growth(state.epoch, retraction.occurred_at)
+                processed += 1
+            done.append(retraction.pk)
+        for start in range(0, len(done), batch_size):
+            TrendingRetraction.objects.filter(pk__in=done[start:start + batch_size]).delete()
+
+        recipe_ids = list(gains)
+        for start in range(0, len(recipe_ids), batch_size):
+            chunk = recipe_ids[start:start + batch_size]
+            existing = TrendingScore.objects.in_bulk(chunk, field_name='recipe_id')
+            changed, created = [], []
+            for recipe_id in chunk:
+                row = existing.get(recipe_id)
+                if row is None:
+                    if gains[recipe_id] > 0:
+                        created.append(TrendingScore(recipe_id=recipe_id, score=gains[recipe_id], updated_at=now))
+                else:
+                    row.score = max(row.score + gains[recipe_id], 0.0)
+                    row.updated_at = now
+                    changed.append(row)
+            TrendingScore.objects.bulk_update(changed, ['score', 'updated_at'])
+            TrendingScore.objects.bulk_create(created)
+
+        state.refreshed_at = now
+        state.save()
+    return processed
+
+
+def retract(recipe_id, event_id, cursor, weight, when):
+    """
+    Queue an event to be taken back (an unfavourite, a deleted review). The
+    next refresh_trending subtracts it if it had been counted. One INSERT:
+    the delete doesn't wait on TrendingState or a running refresh.
+    """
+    TrendingRetraction.objects.create(recipe_id=recipe_id, event_id=event_id, cursor=cursor, weight=weight,
+                                      occurred_at=_as_datetime(when))
+
+
+def retract_favourite(favourite):
+    retract(favourite.recipe_id, favourite.pk, 'last_favourite_id', FAVOURITE_WEIGHT, favourite.created_at)
+
+
+def retract_review(review):
+    retract(review.recipe_id, review.pk, 'last_review_id', review_weight(review.rating), review.created_date)
@@ -0,0 +1,94 @@
+import math
+
+from django.db import transaction
+from django.db.models import Case, Count, Max, Value, When
+
+from .autocomplete import normalize
+from .models import Recipe, RecipeTrigram
+
+# Character-trigram index for typo-tolerant search ("chiken curry").
+#
+# Each recipe's title and category name are split into trigrams the way
+# pg_trgm does it: every word padded with two spaces in front and one behind,
+# so "curry" -> "  c", " cu", "cur", "urr", "rry", "ry ". A lookup only reads
+# the index rows of the query's trigrams. Similarity is the share of the
+# query's trigrams a recipe has (like pg_trgm's word_similarity, so a long
+# title or category name doesn't drown a good match). Recipes below the
+# threshold are dropped in the HAVING clause before any ranking happens, and
+# ties go to the recipe with fewer trigrams overall: the closer match.
+
+SIMILARITY_THRESHOLD = 0.4
+MAX_RESULTS = 50
+
+
+def trigrams(text):
+    grams = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def recipe_trigrams(title, category_title):
+    return trigrams(f'{title} {category_title or ""}')
+
+
+def index_recipes(recipes):
+    """(Re)index the given recipes; each needs title and category loaded."""
+    rows, ids = [], []
+    for recipe in recipes:
+        grams = recipe_trigrams(recipe.title, recipe.category.title)
+        ids.append(recipe.pk)
+        rows.extend(RecipeTrigram(recipe_id=recipe.pk, trigram=gram, size=len(grams)) for gram in grams)
+    with transaction.atomic():
+        RecipeTrigram.objects.filter(recipe__in=ids).delete()
+        RecipeTrigram.objects.bulk_create(rows, batch_size=1000)
+
+
+def reindex_category(category_id, batch_size=500):
+    recipes = Recipe.objects.filter(category=category_id).select_related('category').only('title', 'category__title')
+    batch = []
+    for recipe in recipes.iterator(chunk_size=batch_size):
+        batch.append(recipe)
+        if len(batch) >= batch_size:
+            index_recipes(batch)
+            batch = []
+    if batch:
+        index_recipes(batch)
+
+
+def rebuild(batch_size=500):
+    RecipeTrigram.objects.all().delete()
+    recipes = Recipe.objects.select_related('category').only('title', 'category__title').order_by('pk')
+    count, batch = 0, []
+    for recipe in recipes.iterator(chunk_size=batch_size):
+        batch.append(recipe)
+        if len(batch) >= batch_size:
+            index_recipes(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        index_recipes(batch)
+        count += len(batch)
+    return count
+
+
+def search(query, limit=MAX_RESULTS, threshold=SIMILARITY_THRESHOLD):
+    """[(recipe id, similarity)] best first."""
+    grams = trigrams(query)
+    if not grams:
+        return []
+    rows = RecipeTrigram.objects.filter(trigram__in=grams) \
+                                .values('recipe') \
+                                .annotate(shared=Count('pk'), recipe_size=Max('size')) \
+                                .filter(shared__gte=max(math.ceil(threshold * len(grams)), 1)) \
+                                .order_by('-shared', 'recipe_size', 'recipe')[:limit]
+    return [(row['recipe'], row['shared'] / len(grams)) for row in rows]
+
+
+def ranked_queryset(queryset, matches):
+    # Keep the similarity order of `matches` in a regular Recipe queryset
+    if not matches:
+        return queryset.none()
+    order = Case(*[When(pk=pk, then=Value(rank)) for rank, (pk, _) in enumerate(matches)])
+    return queryset.filter(pk__in=[pk for pk, _ in matches]).order_by(order)
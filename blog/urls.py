@@ -1,25 +1,39 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import sitemaps, views
 
 
 # Create a router and register the viewset with it
 recipe_router  = DefaultRouter()
-recipe_router.register(r'my-recipes', views.RecipeViewSet, basename='recipe')
+# Own basename: 'recipe-list'/'recipe-detail' name the public routes (metrics, deadlines, shedding)
+recipe_router.register(r'my-recipes', views.RecipeViewSet, basename='my-recipe')
 recipe_router.register(r'my-profile', views.UserProfileUpdateView, basename='profile')
 
 
 # Include the router-generated URLs in your project’s URL patterns
 urlpatterns = [
     path('home/', views.HomeView.as_view(), name='home'),  # API home page
+    path('trending/', views.TrendingView.as_view(), name='recipe-trending'),
     path('categories/', views.CategoryListView.as_view(), name='category-list'),
     # path('ctg/', views.SelectCategoryView.as_view(), name='ctg-list'),
     path('recipes/', views.RecipeListView.as_view(), name='recipe-list'),  # API home page
     path('recipe-detail/<str:slug>/', views.RecipeDetailView.as_view(), name='recipe-detail'),
+    path('recipe-detail/<str:slug>/similar/', views.SimilarRecipesView.as_view(), name='recipe-similar'),
+    path('recipe-detail/<str:slug>/events/', views.recipe_events_view, name='recipe-events'),
     path('add-favourite/<str:slug>/', views.AddFavouriteView.as_view(), name='toggle_favourite'),
     path('favourite-list/', views.FavouriteListView.as_view(), name='favourite_list'),
     path('favourite-list/<str:slug>/', views.FavouriteListView.as_view(), name='favourite_list'), # for delete
+    path('recipes/facets/', views.FacetedRecipeView.as_view(), name='recipe-facets'),
     path('filter/', views.CategoryFilterView.as_view(), name='recipe-filter'),
     path('search/', views.RecipeSearchView.as_view(), name='recipe-search'),
+    path('autocomplete/', views.AutocompleteView.as_view(), name='recipe-autocomplete'),
+    path('my-stats/', views.AuthorStatsView.as_view(), name='my-stats'),
+    path('my-events/', views.user_events_view, name='my-events'),
+    path('my-events/ticket/', views.StreamTicketView.as_view(), name='my-events-ticket'),
+    path('batch/', views.BatchView.as_view(), name='batch'),
+    path('changes/', views.ChangesView.as_view(), name='changes'),
+    path('sitemap.xml', sitemaps.sitemap_index, name='sitemap-index'),
+    path('sitemap-<int:chunk>.xml', sitemaps.sitemap_chunk, name='sitemap-chunk'),
+    path('feed/<str:kind>/', sitemaps.latest_feed, name='recipe-feed'),
     path('', include(recipe_router.urls)),
 ]
\ No newline at end of file
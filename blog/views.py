@@ -1,13 +1,26 @@
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views.decorators.http import require_GET
+from rest_framework.authtoken.models import Token
 from user_account.models import CustomUser
 from rest_framework import viewsets, pagination, status
+from rest_framework.decorators import action
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from .models import Recipe, Category, Favourite
-from .serializers import AddRecipeSerializer, UserProfileUpdateSerializer, CategorySerializer, ReviewSerializer
-from django.db.models import Q
+from .models import Recipe, Category, Favourite, TrendingState
+from .autocomplete import autocomplete_index
+from .stats import author_stats
+from .sync import CursorExpired, changes_since, max_batch
+from .bulk import batch_status, bulk_create_recipes, bulk_delete_recipes, bulk_update_recipes
+from .serializers import AddRecipeSerializer, UserProfileUpdateSerializer, CategorySerializer, ReviewSerializer, \
+    TrendingRecipeSerializer, RecipeSummarySerializer, FacetedRecipeSerializer
+from .facets import apply_filters, facet_counts, parse_filters
+from .optimization import OptimizedQuerysetMixin, optimize
+from . import batch, events, trigram
+from django.db.models import Q, Subquery
 from rest_framework.filters import SearchFilter
 
 class PaginationView(pagination.PageNumberPagination):
@@ -16,14 +29,34 @@ class PaginationView(pagination.PageNumberPagination):
     max_page_size = 100
 
 
-# Home view - Displays the latest 3 recipes with N+1 optimization
-class HomeView(ListAPIView):
-    queryset = Recipe.objects.select_related('category').prefetch_related('recipe_review__user').order_by('-created_at')[:12]
+# Home view - Displays the latest recipes; joins and prefetches come from the
+# serializer (blog/optimization.py)
+class HomeView(OptimizedQuerysetMixin, ListAPIView):
     serializer_class = AddRecipeSerializer
 
+    def get_queryset(self):
+        return self.optimize(Recipe.objects.order_by('-created_at'))[:12]
+
+
+# Trending recipes, precomputed by `manage.py refresh_trending`; one query on the indexed score
+class TrendingView(OptimizedQuerysetMixin, ListAPIView):
+    serializer_class = TrendingRecipeSerializer
+    max_limit = 50
+
+    def get_queryset(self):
+        try:
+            limit = min(max(int(self.request.query_params.get('limit', 12)), 1), self.max_limit)
+        except ValueError:
+            limit = 12
+        epoch = TrendingState.objects.filter(pk=1).values('epoch')
+        return self.optimize(Recipe.objects.select_related('trending')) \
+                             .filter(trending__score__gt=0) \
+                             .annotate(trending_epoch=Subquery(epoch)) \
+                             .order_by('-trending__score')[:limit]
+
 
 # List all categories
-class CategoryListView(ListAPIView):
+class CategoryListView(OptimizedQuerysetMixin, ListAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     
@@ -34,8 +67,8 @@ class CategoryListView(ListAPIView):
 
 
 # List all recipes with filtering and search functionality
-class RecipeListView(ListAPIView):
-    queryset = Recipe.objects.select_related('category').prefetch_related('recipe_review__user').order_by('-created_at')
+class RecipeListView(OptimizedQuerysetMixin, ListAPIView):
+    queryset = Recipe.objects.order_by('-created_at')
     # queryset = Recipe.objects.all().order_by('-created_at')  # Fetch all recipes, ordered by creation date
     serializer_class = AddRecipeSerializer
     pagination_class = PaginationView  # Use the custom pagination class
@@ -43,13 +76,16 @@ class RecipeListView(ListAPIView):
 
 
 # Recipe detail view - Optimized for review relations
-class RecipeDetailView(RetrieveAPIView):
-    queryset = Recipe.objects.select_related('category', 'author') \
-                             .prefetch_related('recipe_review')
+class RecipeDetailView(OptimizedQuerysetMixin, RetrieveAPIView):
     serializer_class = AddRecipeSerializer
     lookup_field = 'slug'
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        if self.request.method == 'POST':
+            return Recipe.objects.all()  # only the recipe the review is attached to
+        return self.optimize(Recipe.objects.all())
+
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return ReviewSerializer
@@ -66,19 +102,47 @@ class RecipeDetailView(RetrieveAPIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
     
+# Similar recipes precomputed by `manage.py compute_similar_recipes`, served with one join
+class SimilarRecipesView(OptimizedQuerysetMixin, ListAPIView):
+    serializer_class = RecipeSummarySerializer
+
+    def get_queryset(self):
+        return self.optimize(Recipe.objects.filter(similar_of__recipe__slug=self.kwargs['slug'])) \
+                   .order_by('similar_of__rank')
+
+
 # RecipeViewSet for creating and managing recipes by the logged-in user
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(OptimizedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = AddRecipeSerializer
     permission_classes = [IsAuthenticated]
+    optimize_only = False  # instances are saved back
 
     def get_queryset(self):
-        return Recipe.objects.filter(author=self.request.user) \
-                             .select_related('category', 'author') \
-                             .prefetch_related('recipe_review')
+        return self.optimize(Recipe.objects.filter(author=self.request.user))
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    # POST a list to create, PATCH a list of {id|slug, ...fields} to update,
+    # DELETE {"ids": [...], "slugs": [...]} to remove; see blog/bulk.py
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='bulk')
+    def bulk(self, request):
+        if request.method == 'DELETE':
+            return Response(bulk_delete_recipes(request.user, request.data), status=status.HTTP_200_OK)
+        if request.method == 'PATCH':
+            results = bulk_update_recipes(request.user, request.data)
+        else:
+            results = bulk_create_recipes(request.user, request.data)
+        return Response({'results': results}, status=batch_status(results))
+
+
+# Totals for the logged-in author: one grouped query, cached per author until a relevant write
+class AuthorStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(author_stats(request.user.pk))
+
 
 class AddFavouriteView(APIView):
     permission_classes = [IsAuthenticated]
@@ -99,9 +163,8 @@ class FavouriteListView(APIView):
 
     def get(self, request):
         user = request.user
-        favourites = Recipe.objects.filter(favourited_by__user=user) \
-                                   .select_related('category', 'author') \
-                                   .prefetch_related('recipe_review')
+        favourites = optimize(Recipe.objects.filter(favourited_by__user=user), AddRecipeSerializer,
+                              context={'request': request})
         serializer = AddRecipeSerializer(favourites, many=True, context={'request': request})
         return Response(serializer.data)
 
@@ -134,7 +197,7 @@ class UserProfileUpdateView(viewsets.ModelViewSet):
 
 
 
-class CategoryFilterView(ListAPIView):
+class CategoryFilterView(OptimizedQuerysetMixin, ListAPIView):
     serializer_class = AddRecipeSerializer
 
     def get_queryset(self):
@@ -146,33 +209,146 @@ class CategoryFilterView(ListAPIView):
             return Recipe.objects.none()
 
         # Filter the recipes by category ID
-        queryset = Recipe.objects.select_related('category') \
-                                 .prefetch_related(
-                                     'recipe_review__user'  # Prefetch reviews and the users who created them
-                                 ) \
-                                 .filter(category__id=category_id) \
+        queryset = Recipe.objects.filter(category__id=category_id) \
                                  .order_by('-created_at')
         
-        return queryset
+        return self.optimize(queryset)
     
 
 
-class RecipeSearchView(ListAPIView):
+# Multi-dimension filter returning the page plus facet counts, e.g.
+# /api/recipes/facets/?category=1,3&max_time=45&min_rating=4&servings=2
+class FacetedRecipeView(OptimizedQuerysetMixin, ListAPIView):
+    serializer_class = FacetedRecipeSerializer
+    pagination_class = PaginationView
+
+    def get_queryset(self):
+        self.filters = parse_filters(self.request.query_params)
+        return self.optimize(apply_filters(Recipe.objects.all(), self.filters)) \
+            .order_by('-created_at', '-pk')
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data['facets'] = facet_counts(Recipe.objects.all(), self.filters)
+        return response
+
+
+
+class RecipeSearchView(OptimizedQuerysetMixin, ListAPIView):
     
     serializer_class = AddRecipeSerializer
     filter_backends = [SearchFilter]
 
 
     def get_queryset(self):
-        queryset = Recipe.objects.select_related('category').prefetch_related('recipe_review__user')
+        queryset = self.optimize(Recipe.objects.all())
         
         search_query = self.request.query_params.get('search', None)
+        if search_query and self.request.query_params.get('mode') == 'fuzzy':
+            # Typo tolerant: candidates from the trigram index, best match first
+            return trigram.ranked_queryset(queryset, trigram.search(search_query))
         if search_query:
             # Use Q objects to search across related fields
             queryset = queryset.filter(
                 Q(title__icontains=search_query) |
-                Q(ingredients__icontains=search_query) |
+                Q(ingredients_text__icontains=search_query) |  # precomputed plain text, no markup
                 Q(recipe_review__user__username__icontains=search_query)  # Adjust the field name based on your user model
             ).distinct()  # Use distinct to avoid duplicates due to join operations
         
         return queryset
+
+
+
+# Live review / favourite deltas as server-sent events (see blog/events.py).
+# Plain async views: each open stream is an idle coroutine under an ASGI server.
+
+def _event_stream(channel, kind):
+    response = StreamingHttpResponse(events.stream(channel, kind), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx would otherwise buffer the stream
+    return response
+
+
+def _needs_asgi():
+    return JsonResponse({"detail": "Event streams are only served by the ASGI application."}, status=501)
+
+
+@require_GET
+async def recipe_events_view(request, slug):
+    if not isinstance(request, ASGIRequest):
+        return _needs_asgi()
+    recipe_id = await Recipe.objects.filter(slug=slug).values_list('pk', flat=True).afirst()
+    if recipe_id is None:
+        raise Http404("No Recipe matches the given query.")
+    return _event_stream(events.recipe_channel(recipe_id), 'recipe')
+
+
+@require_GET
+async def user_events_view(request):
+    if not isinstance(request, ASGIRequest):
+        return _needs_asgi()
+    # EventSource cannot send headers: browsers pass a short-lived ?ticket= from
+    # StreamTicketView instead of the API token
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Token '):
+        users = Token.objects.filter(key=header[len('Token '):], user__is_active=True).values_list('user_id', flat=True)
+    else:
+        ticket_user = events.ticket_user_id(request.GET.get('ticket', ''))
+        users = CustomUser.objects.filter(pk=ticket_user, is_active=True).values_list('pk', flat=True)
+    user_id = await users.afirst()
+    if user_id is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    return _event_stream(events.user_channel(user_id), 'user')
+
+
+# POST for a ticket to open /api/my-events/ with (EventSource can't send the token)
+class StreamTicketView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({'ticket': events.issue_ticket(request.user), 'expires_in': events.ticket_lifetime()})
+
+
+
+# Type-ahead suggestions served from the in-memory prefix index (no DB hit once loaded)
+class AutocompleteView(APIView):
+    max_limit = 20
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        try:
+            limit = min(max(int(request.query_params.get('limit', 8)), 1), self.max_limit)
+        except ValueError:
+            limit = 8
+        return Response({'query': query, 'results': autocomplete_index.suggest(query, limit)})
+
+
+
+# Several GETs in one round trip: POST {"requests": ["/api/home/", "/api/categories/", ...]}
+class BatchView(APIView):
+
+    def post(self, request):
+        urls = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            return Response({"detail": "'requests' must be a list of paths."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(urls) > batch.max_requests():
+            return Response({"detail": f"At most {batch.max_requests()} requests per batch."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({'responses': [batch.dispatch(request, url) for url in urls]})
+
+
+
+# Delta sync for offline clients: /api/changes/?since=<cursor>, repeat while has_more
+class ChangesView(APIView):
+
+    def get(self, request):
+        try:
+            since = max(int(request.query_params.get('since', 0)), 0)
+            limit = min(max(int(request.query_params.get('limit', max_batch())), 1), max_batch())
+        except ValueError:
+            return Response({"detail": "'since' and 'limit' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            data = changes_since(request.user, since, limit, context={'request': request})
+        except CursorExpired:
+            return Response({"detail": "Cursor is too old; sync again from 0."}, status=status.HTTP_410_GONE)
+        return Response(data)
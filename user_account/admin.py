@@ -1,7 +1,19 @@
 from django.contrib import admin
 
 # Register your models here.
+from blog.paginator import EstimatedCountPaginator
 from .models import CustomUser
 
 
-admin.site.register(CustomUser)
\ No newline at end of file
+class CustomUserAdmin(admin.ModelAdmin):
+    list_display = ('username', 'email', 'is_active', 'is_staff', 'date_joined')
+    list_filter = ('is_staff', 'is_active')
+    # Prefix search, so the author/user autocomplete widgets match partial
+    # names; served by the prefix indexes from migration 0002
+    search_fields = ('^username', '^email')
+    ordering = ('-id',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+admin.site.register(CustomUser, CustomUserAdmin)
\ No newline at end of file
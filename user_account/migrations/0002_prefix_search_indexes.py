@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# Indexes for the admin's '^username' / '^email' search (istartswith); the
+# unique btrees only serve exact matches. See blog 0013 for the expressions.
+
+INDEXES = [
+    ('user_account_customuser_username_prefix', 'user_account_customuser', 'username'),
+    ('user_account_customuser_email_prefix', 'user_account_customuser', 'email'),
+]
+
+
+def create_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for name, table, column in INDEXES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} (UPPER({column}::text) text_pattern_ops)')
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} ({column} COLLATE NOCASE)')
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        for name, _, _ in INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user_account', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
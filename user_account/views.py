@@ -20,10 +20,12 @@ from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from .serializers import RegisterSerializer, LoginSerializer
 
-import requests
 from django.conf import settings
 
 def send_mail_via_sendgrid(subject, text_message, recipient_email):
+    # Imported on first use so `requests` does not add to worker boot time
+    import requests
+
     api_key = settings.SENDGRID_API_KEY
     url = "https://api.sendgrid.com/v3/mail/send"
 